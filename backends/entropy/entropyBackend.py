@@ -28,11 +28,19 @@ import time
 import traceback
 import threading
 
+# hand the transaction to a running zygote before the slow imports below
+from packagekit.zygote import forward_to_zygote, run_zygote
+if __name__ == "__main__" and sys.argv[1:2] != ['--zygote']:
+    forward_to_zygote('entropy')
+
 from packagekit.enums import *
 
 from packagekit.backend import PackageKitBaseBackend, get_package_id, \
     split_package_id
 from packagekit.package import PackagekitPackage
+from packagekit.cache import PackagekitQueryCache
+from packagekit.lazy import lazy_import
+from packagekit.diagnostics import trace_span
 
 sys.path.insert(0, '/usr/lib/entropy/libraries')
 sys.path.insert(0, '/usr/lib/entropy/lib')
@@ -51,7 +59,8 @@ from entropy.exceptions import SystemDatabaseError, DependenciesNotFound, \
 from entropy.db.exceptions import Error as EntropyRepositoryError
 from entropy.exceptions import DependenciesNotRemovable
 from entropy.fetchers import UrlFetcher
-from entropy.services.client import WebService
+# only needed to report downloads to the repository web services
+entropy_services_client = lazy_import('entropy.services.client')
 from entropy.locks import EntropyResourcesLock
 
 import entropy.tools
@@ -307,12 +316,16 @@ class PackageKitEntropyMixin(object):
         """
         Given an unsorted list of tuples composed by repository identifier and
         EntropyRepository instance, feed PackageKit output by calling
-        self._package()
+        self.packages()
         """
-        lambda_sort = lambda x: x[2].retrieveAtom(x[1])
+        def sort_key(x):
+            # one repository query per package
+            self.check_cancelled()
+            return x[2].retrieveAtom(x[1])
 
-        for repo, pkg_id, c_repo, pkg_type in sorted(pkgs, key=lambda_sort):
-            self._package((pkg_id, c_repo), info=pkg_type)
+        self.packages(
+            self._package_row((pkg_id, c_repo), info=pkg_type)
+            for repo, pkg_id, c_repo, pkg_type in sorted(pkgs, key=sort_key))
 
     def _pk_filter_pkgs(self, pkgs, filters):
         """
@@ -338,6 +351,7 @@ class PackageKitEntropyMixin(object):
         new_pkgs = set()
 
         for repo, pkg_id, c_repo in pkgs:
+            self.check_cancelled()
 
             pkg_type = None
             if important_check:
@@ -437,6 +451,7 @@ class PackageKitEntropyMixin(object):
         Inform repository maintainers that user fetched packages, if user
         enabled this feature.
         """
+        WebService = entropy_services_client.WebService
         if WebService is None:
             # old entropy library, ignore all
             return
@@ -924,6 +939,17 @@ class PackageKitEntropyBackend(PackageKitBaseBackend, PackageKitEntropyMixin):
         self._repo_name_cache = {}
         PackageKitEntropyClient._pk_progress = self.percentage
         PackageKitEntropyClient._pk_message = self._generic_message
+        self.query_cache = PackagekitQueryCache(
+            '/var/cache/PackageKit/entropy/queries')
+
+    def get_cache_fingerprint(self):
+        """
+        Return the modification times of the installed packages repository
+        and of every available repository, which change on each (un)merge
+        and repository update.
+        """
+        return ";".join(["%s=%s" % (repo, repo_db.mtime()) for repo_db, repo
+                         in self._get_all_repos()])
 
     @property
     def _entropy(self):
@@ -934,7 +960,8 @@ class PackageKitEntropyBackend(PackageKitBaseBackend, PackageKitEntropyMixin):
             with self._real_entropy_lock:
 
                 if self._real_entropy is None:
-                    self._real_entropy = PackageKitEntropyClient()
+                    with trace_span('PackageKitEntropyClient'):
+                        self._real_entropy = PackageKitEntropyClient()
 
         return self._real_entropy
 
@@ -1005,7 +1032,7 @@ class PackageKitEntropyBackend(PackageKitBaseBackend, PackageKitEntropyMixin):
             message += ";If you can't do that, ask your system administrator."
             self._log_message(__name__, message, decolorize(message))
 
-    def _package(self, pkg_match, info=None):
+    def _package_row(self, pkg_match, info=None):
 
         # package_id = (package_identifier, EntropyRepository)
         pkg_id, c_repo = pkg_match
@@ -1016,7 +1043,11 @@ class PackageKitEntropyBackend(PackageKitBaseBackend, PackageKitEntropyMixin):
                 info = INFO_INSTALLED
             else:
                 info = INFO_AVAILABLE
-        return self.package(self._etp_to_id(pkg_match), info, desc)
+        return info, self._etp_to_id(pkg_match), desc
+
+    def _package(self, pkg_match, info=None):
+        info, package_id, desc = self._package_row(pkg_match, info=info)
+        return self.package(package_id, info, desc)
 
     def _is_only_trusted(self, transaction_flags):
         return (TRANSACTION_FLAG_ONLY_TRUSTED in transaction_flags) or (
@@ -1250,6 +1281,7 @@ class PackageKitEntropyBackend(PackageKitBaseBackend, PackageKitEntropyMixin):
         count = 0
         max_count = len(repos)
         for repo_db, repo in repos:
+            self.check_cancelled()
 
             count += 1
             percent = PackageKitEntropyMixin.get_percentage(count, max_count)
@@ -1598,6 +1630,7 @@ class PackageKitEntropyBackend(PackageKitBaseBackend, PackageKitEntropyMixin):
         """
         Update repository download statistics.
         """
+        WebService = entropy_services_client.WebService
         if WebService is None:
             # old entropy library, ignore all
             return
@@ -1702,6 +1735,7 @@ class PackageKitEntropyBackend(PackageKitBaseBackend, PackageKitEntropyMixin):
         count = 0
         max_count = len(repos)
         for repo_db, repo in repos:
+            self.check_cancelled()
 
             count += 1
             percent = PackageKitEntropyMixin.get_percentage(count, max_count)
@@ -1741,6 +1775,7 @@ class PackageKitEntropyBackend(PackageKitBaseBackend, PackageKitEntropyMixin):
         count = 0
         max_count = len(repos)
         for repo_db, repo in repos:
+            self.check_cancelled()
             count += 1
             percent = PackageKitEntropyMixin.get_percentage(count, max_count)
 
@@ -1785,6 +1820,7 @@ class PackageKitEntropyBackend(PackageKitBaseBackend, PackageKitEntropyMixin):
         count = 0
         max_count = len(repos)
         for repo_db, repo in repos:
+            self.check_cancelled()
             count += 1
             percent = PackageKitEntropyMixin.get_percentage(count, max_count)
 
@@ -1863,6 +1899,7 @@ class PackageKitEntropyBackend(PackageKitBaseBackend, PackageKitEntropyMixin):
         count = 0
         max_count = len(repos)
         for repo_db, repo in repos:
+            self.check_cancelled()
             count += 1
             percent = PackageKitEntropyMixin.get_percentage(count, max_count)
 
@@ -1929,6 +1966,7 @@ class PackageKitEntropyBackend(PackageKitBaseBackend, PackageKitEntropyMixin):
         count = 0
         max_count = len(repos)
         for repo_db, repo in repos:
+            self.check_cancelled()
             count += 1
             percent = PackageKitEntropyMixin.get_percentage(count, max_count)
 
@@ -2048,6 +2086,8 @@ class PackageKitEntropyBackend(PackageKitBaseBackend, PackageKitEntropyMixin):
 
 
 def main():
+    if sys.argv[1:2] == ['--zygote']:
+        run_zygote(PackageKitEntropyBackend(""), 'entropy')
     backend = PackageKitEntropyBackend("")
     backend.dispatcher(sys.argv[1:])
 
@@ -225,6 +225,7 @@ class PackageKitPisiBackend(PackageKitBaseBackend, PackagekitPackage):
 
         self._updates = dict()
         for package in pisi.api.list_upgradable():
+            self.check_cancelled()
             pkg = self.packagedb.get_package(package)
             version = self.__get_package_version(pkg)
             id = self.get_package_id(pkg.name, version, pkg.architecture, "")
@@ -529,6 +530,7 @@ class PackageKitPisiBackend(PackageKitBaseBackend, PackagekitPackage):
         # Internal FIXME: Use search_details instead of _package when API
         # gains that ability :)
         for pkg in pisi.api.search_package(values):
+            self.check_cancelled()
             self.__get_package(pkg, filters)
 
     def search_file(self, filters, values):
@@ -542,6 +544,7 @@ class PackageKitPisiBackend(PackageKitBaseBackend, PackagekitPackage):
             value = value.lstrip("/")
 
             for pkg, files in pisi.api.search_file(value):
+                self.check_cancelled()
                 self.__get_package(pkg)
 
     def search_group(self, filters, values):
@@ -561,6 +564,7 @@ class PackageKitPisiBackend(PackageKitBaseBackend, PackagekitPackage):
                         self.error(ERROR_GROUP_NOT_FOUND,
                                    "Component %s was not found" % value)
             for pkg in packages:
+                self.check_cancelled()
                 self.__get_package(pkg, filters)
 
     def search_name(self, filters, values):
@@ -571,6 +575,7 @@ class PackageKitPisiBackend(PackageKitBaseBackend, PackagekitPackage):
 
         for value in values:
             for pkg in pisi.api.search_package([value]):
+                self.check_cancelled()
                 self.__get_package(pkg, filters)
 
     def update_packages(self, transaction_flags, package_ids):
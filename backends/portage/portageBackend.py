@@ -23,7 +23,6 @@
 
 import os
 import re
-import signal
 import sys
 import traceback
 from collections import defaultdict
@@ -32,18 +31,22 @@ try:
 except ImportError:
     izip = zip
 
-# layman imports (>=2)
-import layman.config
-import layman.db
-import layman.remotedb
+# hand the transaction to a running zygote before the slow imports below
+from packagekit.zygote import forward_to_zygote, run_zygote
+if __name__ == "__main__" and sys.argv[1:2] != ['--zygote']:
+    forward_to_zygote('portage')
+
 # packagekit imports
 from packagekit.backend import (
     PackageKitBaseBackend,
     get_package_id,
     split_package_id,
 )
+from packagekit.cache import PackagekitQueryCache, files_fingerprint
 from packagekit.enums import *
+from packagekit.lazy import lazy_import
 from packagekit.progress import PackagekitProgress
+from packagekit.diagnostics import trace_span
 # portage imports
 import _emerge.AtomArg
 import _emerge.actions
@@ -54,6 +57,8 @@ import portage.dep
 import portage.versions
 from portage._sets.base import InternalPackageSet
 from portage.exception import InvalidAtom
+# layman imports (>=2), only the commands handling overlays need them
+layman = lazy_import('layman')
 
 # NOTES:
 #
@@ -182,6 +187,10 @@ class PortageBridge():
         self.update()
 
     def update(self):
+        with trace_span('PortageBridge.update'):
+            self._update()
+
+    def _update(self):
         self.settings, self.trees, self.mtimedb = \
             _emerge.actions.load_emerge_config()
         self.vardb = self.trees[self.settings['ROOT']]['vartree'].dbapi
@@ -802,13 +811,41 @@ class PackageKitPortageBackend(PackageKitPortageMixin, PackageKitBaseBackend):
         'unknown': GROUP_UNKNOWN,
     }
 
-    def __sigquit(self, signum, frame):
-        raise SystemExit(1)
-
     def __init__(self, args):
-        signal.signal(signal.SIGQUIT, self.__sigquit)
         PackageKitPortageMixin.__init__(self)
         PackageKitBaseBackend.__init__(self, args)
+        self.query_cache = PackagekitQueryCache('/var/cache/PackageKit/portage/queries')
+
+    def get_cache_fingerprint(self):
+        # portage bumps the mtime of the vdb root on every (un)merge and
+        # syncs rewrite timestamp.chk
+        paths = [os.path.join(self.pvar.settings['EROOT'], portage.VDB_PATH)]
+        for tree in self.pvar.portdb.porttrees:
+            # overlays and git synced repos have no timestamp.chk, but every
+            # pull rewrites the index of a git checkout
+            for path in (os.path.join(tree, 'metadata', 'timestamp.chk'),
+                         os.path.join(tree, '.git', 'index')):
+                if os.path.exists(path):
+                    paths.append(path)
+                    break
+            else:
+                # e.g. a local overlay, whose ebuilds change in place
+                return None
+        mtimes = []
+        for path in paths:
+            try:
+                mtimes.append('%s=%f' % (path, os.stat(path).st_mtime))
+            except OSError:
+                mtimes.append('%s=' % path)
+        # the user config changes visibility, mostly edited in place and
+        # in package.* directories, so every file of it counts
+        config_root = self.pvar.settings['PORTAGE_CONFIGROOT']
+        mtimes.append(files_fingerprint([
+            os.path.join(config_root, portage.USER_CONFIG_PATH),
+            os.path.join(config_root, 'etc', 'make.conf'),
+            os.path.join(config_root, 'etc', 'make.profile'),
+        ]))
+        return ';'.join(mtimes)
 
     def _package(self, cpv, info=None):
         desc = self._get_metadata(cpv, ["DESCRIPTION"])[0]
@@ -1009,6 +1046,7 @@ class PackageKitPortageBackend(PackageKitPortageMixin, PackageKitBaseBackend):
         progress = PackagekitProgress(compute_equal_steps(cp_list))
 
         for percentage, cp in izip(progress, cp_list):
+            self.check_cancelled()
             for cpv in self._get_all_cpv(cp, filters):
                 try:
                     self._package(cpv)
@@ -1172,6 +1210,7 @@ class PackageKitPortageBackend(PackageKitPortageMixin, PackageKitBaseBackend):
 
         # check if a candidate can be updated
         for cp in update_candidates:
+            self.check_cancelled()
             cpv_list_inst = self.pvar.vardb.match(cp)
             cpv_list_avai = self.pvar.portdb.match(cp)
 
@@ -1582,6 +1621,7 @@ class PackageKitPortageBackend(PackageKitPortageMixin, PackageKitBaseBackend):
         s = re.compile(reg_expr)
 
         for percentage, cp in izip(progress, cp_list):
+            self.check_cancelled()
             if s.match(cp):
                 for cpv in self._get_all_cpv(cp, filters):
                     self._package(cpv)
@@ -1602,6 +1642,7 @@ class PackageKitPortageBackend(PackageKitPortageMixin, PackageKitBaseBackend):
         self.percentage(progress.percent)
 
         for percentage, cp in izip(progress, cp_list):
+            self.check_cancelled()
             # unfortunatelly, everything is related to cpv, not cp
             # can't filter cp
             cpv_list = []
@@ -1671,6 +1712,7 @@ class PackageKitPortageBackend(PackageKitPortageMixin, PackageKitBaseBackend):
             nb_cpv = float(len(cpv_list))
 
             for cpv in cpv_list:
+                self.check_cancelled()
                 for f in self._get_file_list(cpv):
                     if (is_full_path and key == f) \
                             or (not is_full_path and searchre.search(f)):
@@ -1692,6 +1734,7 @@ class PackageKitPortageBackend(PackageKitPortageMixin, PackageKitBaseBackend):
         self.percentage(progress.percent)
 
         for percentage, cp in izip(progress, cp_list):
+            self.check_cancelled()
             for group in groups:
                 if self._get_pk_group(cp) == group:
                     for cpv in self._get_all_cpv(cp, filters):
@@ -1736,6 +1779,7 @@ class PackageKitPortageBackend(PackageKitPortageMixin, PackageKitBaseBackend):
         self.percentage(progress.percent)
 
         for percentage, cp in izip(progress, cp_list):
+            self.check_cancelled()
             if category_filter:
                 cat, pkg_name = portage.versions.catsplit(cp)
                 if cat != category_filter:
@@ -1852,6 +1896,8 @@ class PackageKitPortageBackend(PackageKitPortageMixin, PackageKitBaseBackend):
 
 
 def main():
+    if sys.argv[1:2] == ['--zygote']:
+        run_zygote(PackageKitPortageBackend(""), 'portage')
     backend = PackageKitPortageBackend("")
     backend.dispatcher(sys.argv[1:])
 
@@ -0,0 +1,136 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# asyncio event loop behind PackageKitBaseBackend.async_dispatcher()
+#
+
+import os
+import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from .enums import *
+from .backend import exceptionHandler
+from .diagnostics import trace_startup, record_argv, record_command, flush_diagnostics
+
+# commands that only query the package databases and can run side by side
+READ_ONLY_COMMANDS = frozenset([
+    'depends-on',
+    'get-categories',
+    'get-details',
+    'get-details-local',
+    'get-distro-upgrades',
+    'get-files',
+    'get-packages',
+    'get-repo-list',
+    'get-update-detail',
+    'get-updates',
+    'required-by',
+    'resolve',
+    'search-details',
+    'search-file',
+    'search-group',
+    'search-name',
+    'stats',
+    'what-provides',
+])
+
+def run_async_dispatcher(backend, args, max_workers=4):
+    '''
+    Read commands from stdin until "exit", then unlock and exit
+    '''
+    trace_startup()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_dispatch_loop(loop, backend, args, max_workers))
+    finally:
+        loop.close()
+
+    # unlock backend and exit with success
+    if backend.isLocked():
+        backend.unLock()
+    backend.writer.flush()
+    sys.exit(0)
+
+async def _dispatch_loop(loop, backend, args, max_workers):
+    workers = ThreadPoolExecutor(max_workers)
+    stdin_reader = ThreadPoolExecutor(1)
+    running = set()
+
+    record_argv(args)
+    if len(args) > 0:
+        backend.dispatch_command(args[0], args[1:])
+    while True:
+        try:
+            line = await loop.run_in_executor(stdin_reader, sys.stdin.readline)
+        except IOError as e:
+            backend.error(ERROR_TRANSACTION_CANCELLED, 'could not read from stdin: %s' % str(e))
+        except KeyboardInterrupt as e:
+            backend.error(ERROR_PROCESS_KILL, 'process was killed by ctrl-c: %s' % str(e))
+        line = line.strip('\n')
+        if line:
+            record_command(line)
+        if not line or line == 'exit':
+            break
+        args = line.split('\t')
+
+        # read while queries run, so they can be cancelled one by one
+        if backend.pipelined and args[0] == 'cancel' and len(args) == 2:
+            backend.cancel(args[1])
+            continue
+
+        # without request ids the output of two commands can't be told
+        # apart, so only pipelined read-only commands run concurrently
+        if backend.pipelined and len(args) > 1 and args[1] in READ_ONLY_COMMANDS:
+            task = loop.run_in_executor(workers, _run_request, backend, args[0], args[1:])
+            running.add(task)
+            task.add_done_callback(running.discard)
+            continue
+
+        # everything else waits for the queries to drain and runs alone
+        if running:
+            await asyncio.wait(list(running))
+        if backend.pipelined:
+            await loop.run_in_executor(workers, _run_request, backend, args[0], args[1:])
+        else:
+            await loop.run_in_executor(workers, _run_request, backend, None, args)
+
+    if running:
+        await asyncio.wait(list(running))
+    workers.shutdown()
+    stdin_reader.shutdown()
+
+def _run_request(backend, request_id, args):
+    '''
+    Run one command on a worker thread. Errors that would normally end the
+    helper still do, even though sys.exit() only ends the calling thread.
+    '''
+    try:
+        try:
+            if request_id is None:
+                backend.dispatch_command(args[0], args[1:])
+            else:
+                backend._dispatch_request(request_id, args)
+        except Exception:
+            typ, value, tb = sys.exc_info()
+            exceptionHandler(typ, value, tb, backend)
+            raise SystemExit(1)
+    except SystemExit as e:
+        backend.writer.flush()
+        flush_diagnostics()
+        if isinstance(e.code, int):
+            os._exit(e.code)
+        os._exit(1)
@@ -25,14 +25,40 @@
 from __future__ import print_function
 
 import sys
-import traceback
 import os.path
+import select
+import signal
+import threading
+from itertools import islice
+from collections import deque
+
+try:
+    from time import monotonic as _monotonic
+except ImportError:
+    from time import time as _monotonic
 
 from .enums import *
+from . import diagnostics
+from .diagnostics import trace_span, trace_startup, record_argv, record_command, \
+    memory_profile, flush_diagnostics
+from .writer import PackagekitSignalWriter
+from .progress import PackagekitProgressCoalescer
+from .protocol import PROTOCOL_TEXT, PROTOCOL_FRAMED, PROTOCOLS, FRAMED_ENV, SIDE_CHANNEL_ENV, \
+    encode_text, encode_framed
+from .cancel import PackagekitCancellable, PkCancelled, QUIT_GRACE_TIME
 
 PACKAGE_IDS_DELIM = '&'
 FILENAME_DELIM = '|'
 
+# number of package signals joined into one write by packages()
+PACKAGES_CHUNK_SIZE = 512
+
+# a long-lived dispatcher exits once it has been idle for this many
+# seconds, or once it has grown beyond this many bytes, so that the
+# daemon starts a fresh one; 0 means never
+IDLE_TIMEOUT_ENV = 'PK_BACKEND_IDLE_TIMEOUT'
+MAX_RSS_ENV = 'PK_BACKEND_MAX_RSS'
+
 def _to_unicode(txt, encoding='utf-8'):
     if isinstance(txt, str):
         if not isinstance(txt, str):
@@ -40,19 +66,149 @@ def _to_unicode(txt, encoding='utf-8'):
     return txt
 
 def _to_utf8(txt, errors='replace'):
+    ''' Encode one signal field, exactly once, for the daemon '''
     if isinstance(txt, str):
+        return txt.encode('utf-8', errors)
+    if isinstance(txt, bytes):
         return txt
-    if isinstance(txt, unicode):
-        return txt.encode('utf-8', errors=errors)
-    return str(txt)
+    return str(txt).encode('utf-8', errors)
 
 class PkError(Exception):
     def __init__(self, code, details):
+        # keeps the arguments in args, so the error survives pickling
+        Exception.__init__(self, code, details)
         self.code = code
         self.details = details
     def __str__(self):
         return repr("%s: %s" % (self.code, self.details))
 
+def _get_rss():
+    ''' Returns the resident set size of this process in bytes, 0 if unknown '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return 0
+
+def _env_number(name, default=0):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+class _CommandReader(object):
+    '''
+    Reads command lines from the daemon. Unlike sys.stdin.readline() this
+    can give up after a timeout without losing lines that have already
+    been read ahead.
+    '''
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._pending = b''
+        try:
+            self._fd = stream.fileno()
+        except (AttributeError, IOError, ValueError):
+            self._fd = None
+
+    def readline(self, timeout=None):
+        '''
+        Returns the next line without its newline, '' at the end of input
+        or None if no complete line arrived within timeout seconds
+        '''
+        if self._fd is None:
+            return self.stream.readline().strip('\n')
+        if timeout is not None:
+            deadline = _monotonic() + timeout
+        while b'\n' not in self._pending:
+            if timeout is not None:
+                remaining = max(deadline - _monotonic(), 0)
+                if not select.select([self._fd], [], [], remaining)[0]:
+                    return None
+            data = os.read(self._fd, 65536)
+            if not data:
+                line = self._pending
+                self._pending = b''
+                return line.decode('utf-8', 'replace')
+            self._pending += data
+        line, self._pending = self._pending.split(b'\n', 1)
+        return line.decode('utf-8', 'replace')
+
+class _RequestState(threading.local):
+    ''' per-thread state of the command being dispatched '''
+    request_id = None
+    tag = None
+    errors = 0
+    # signals of a command whose result is going into the query cache
+    recording = None
+    # PackagekitCancellable of the running command
+    cancellable = None
+
+class PackagekitCommand(object):
+    '''
+    A command understood by the dispatcher, and what it has cost so far
+    '''
+
+    def __init__(self, name, method, args=(), finish=True):
+        '''
+        @param name: the command name on the wire, e.g. "search-name"
+        @param method: the name of the backend method that handles it
+        @param args: one parser per argument, e.g. ARG_FILTERS
+        @param finish: send finished once the method returns
+        '''
+        self.name = name
+        self.method = method
+        self.args = tuple(args)
+        self.finish = finish
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+
+    def copy(self):
+        return PackagekitCommand(self.name, self.method, self.args, self.finish)
+
+    def parse(self, args):
+        ''' Returns the parsed arguments, or raises PkError '''
+        if len(args) < len(self.args):
+            raise PkError(ERROR_INTERNAL_ERROR, "command '%s' needs %i arguments, got %i" %
+                          (self.name, len(self.args), len(args)))
+        return [parser(arg) for parser, arg in zip(self.args, args)]
+
+class PackagekitCommandRegistry(object):
+    '''
+    Maps command names to PackagekitCommand objects and keeps per-command
+    calls, errors and cumulative latency
+    '''
+
+    def __init__(self, commands=()):
+        self._commands = {}
+        # reentrant, the SIGUSR2 handler may interrupt an update
+        self._lock = threading.RLock()
+        for command in commands:
+            self.register(command.copy())
+
+    def register(self, command):
+        ''' Add a command, or replace the one with the same name '''
+        self._commands[command.name] = command
+
+    def lookup(self, name):
+        return self._commands.get(name)
+
+    def __iter__(self):
+        return iter(sorted(self._commands.values(), key=lambda c: c.name))
+
+    def record(self, command, elapsed, failed):
+        with self._lock:
+            command.calls += 1
+            command.total_time += elapsed
+            if failed:
+                command.errors += 1
+
+    def get_stats(self):
+        ''' Returns (name, calls, errors, total seconds) for each command that ran '''
+        with self._lock:
+            return [(c.name, c.calls, c.errors, c.total_time) for c in self if c.calls]
+
 class PackageKitBaseBackend:
 
     def __init__(self, cmds):
@@ -60,13 +216,62 @@ class PackageKitBaseBackend:
         installExceptionHandler(self)
         self.cmds = cmds
         self._locked = False
+        self.progress = PackagekitProgressCoalescer()
+        self.commands = PackagekitCommandRegistry(DEFAULT_COMMANDS)
+        self.writer = PackagekitSignalWriter()
+        # the stats and the query cache are made on first use, see below;
+        # reentrant, the SIGUSR2 handler may ask for the stats
+        self._lazy_lock = threading.RLock()
+        self._stats = None
+        self._query_cache = None
+        self.pipelined = False
+        self._request = _RequestState()
+        # the real stdout while the framed protocol has fd 1 on stderr
+        self._framed_stdout = None
+        self.set_protocol(PROTOCOL_TEXT)
+        self.idle_timeout = _env_number(IDLE_TIMEOUT_ENV)
+        self.max_rss = int(_env_number(MAX_RSS_ENV))
+        # PackagekitCancellable of each running command, to its request id
+        self._running = {}
+        self._quitting = False
+        self._install_signal_handlers()
+        self.load_environment()
+
+    @property
+    def stats(self):
+        ''' the PackagekitStats of the helper, see stats.py '''
+        with self._lazy_lock:
+            if self._stats is None:
+                from .stats import PackagekitStats
+                self._stats = PackagekitStats(diagnostics.start_time)
+            return self._stats
+
+    @property
+    def query_cache(self):
+        '''
+        the PackagekitQueryCache results are kept in when the backend has
+        a get_cache_fingerprint(), in memory only unless one is set
+        '''
+        with self._lazy_lock:
+            if self._query_cache is None:
+                from .cache import PackagekitQueryCache
+                self._query_cache = PackagekitQueryCache()
+            return self._query_cache
+
+    @query_cache.setter
+    def query_cache(self, cache):
+        self._query_cache = cache
+
+    def load_environment(self):
+        '''
+        Read the transaction settings the daemon passes in the environment
+        '''
         self.lang = "C"
         self.has_network = False
         self.uid = 0
         self.background = False
         self.interactive = False
         self.cache_age = 0
-        self.percentage_old = 0
 
         # try to get LANG
         try:
@@ -118,25 +323,138 @@ class PackageKitBaseBackend:
     def isLocked(self):
         return self._locked
 
+    def get_cache_fingerprint(self):
+        '''
+        Returns a string that changes whenever the package databases do,
+        e.g. made of their timestamps or revisions, or None to not cache
+        query results. Overide in child class to use the query cache.
+        '''
+        return None
+
+    def _emit(self, template, fields=(), urgent=False):
+        '''
+        Queue a signal for the daemon
+        @param template: the text protocol line, e.g. b"status\t%s\n"
+        @param fields: the encoded fields to fill the template with
+        @param urgent: the daemon is waiting on this, don't delay it
+        '''
+        if self.progress.pending:
+            self._send_held_progress()
+        request = self._request
+        if request.recording is not None:
+            request.recording.append((template, fields))
+        self.writer.write(self._encode(template, fields, request.tag), urgent, template)
+
+    def _replay(self, records):
+        ''' Emit signals recorded by the query cache '''
+        encode = self._encode
+        tag = self._request.tag
+        for start in range(0, len(records), PACKAGES_CHUNK_SIZE):
+            encoded = []
+            counts = {}
+            for template, fields in records[start:start + PACKAGES_CHUNK_SIZE]:
+                data = encode(template, fields, tag)
+                entry = counts.setdefault(template, [0, 0])
+                entry[0] += 1
+                entry[1] += len(data)
+                encoded.append(data)
+            self.writer.count_signals(counts)
+            self.writer.write(b"".join(encoded))
+
+    def set_protocol(self, protocol):
+        '''
+        Switch the encoding used for all following signals
+        @param protocol: PROTOCOL_TEXT or PROTOCOL_FRAMED
+        '''
+        if protocol == PROTOCOL_FRAMED:
+            self._encode = encode_framed
+            if self.writer.stream is None:
+                self._divert_stdout()
+        else:
+            self._encode = encode_text
+            self._restore_stdout()
+        self.protocol = protocol
+
+    def _divert_stdout(self):
+        '''
+        Keep stdout to the writer: point fd 1 at stderr, so nothing else
+        printing, from python or C, can end up inside a framed record
+        '''
+        if self._framed_stdout is not None:
+            return
+        self.writer.flush()
+        sys.stdout.flush()
+        fd = os.dup(1)
+        os.dup2(2, 1)
+        self._framed_stdout = os.fdopen(fd, 'wb')
+        self.writer.stream = self._framed_stdout
+
+    def _restore_stdout(self):
+        if self._framed_stdout is None:
+            return
+        self.writer.flush()
+        sys.stdout.flush()
+        os.dup2(self._framed_stdout.fileno(), 1)
+        self._framed_stdout.close()
+        self._framed_stdout = None
+        self.writer.stream = None
+
+    def set_pipelined(self, pipelined):
+        '''
+        Expect a request id in front of every command read by dispatcher()
+        and tag all signals of that command with it
+        '''
+        self.pipelined = pipelined
+
+    @property
+    def request_id(self):
+        ''' the id of the pipelined command running in this thread, or None '''
+        return self._request.request_id
+
+    def _set_request_id(self, request_id):
+        self._request.request_id = request_id
+        if request_id is None:
+            self._request.tag = None
+        else:
+            self._request.tag = _to_utf8(request_id)
+
+    def _send_held_progress(self):
+        '''
+        Send the progress updates of this request that the coalescer held
+        back, so the daemon has the latest values before the next signal
+        '''
+        for name, value, item in self.progress.take_pending(self.request_id):
+            if name == 'percentage':
+                self._emit(b"percentage\t%i\n", (value,))
+            elif name == 'speed':
+                self._emit(b"speed\t%i\n", (value,))
+            elif name == 'item-progress':
+                package_id, status = item
+                self._emit(b"item-progress\t%s\t%s\t%i\n", (_to_utf8(package_id), _to_utf8(status), value))
+
     def percentage(self, percent=None):
         '''
         Write progress percentage
         @param percent: Progress percentage (int preferred)
         '''
+        key = (self.request_id, 'percentage')
         if percent == None:
-            sys.stdout.write(_to_utf8("no-percentage-updates\n"))
-        elif percent == 0 or percent > self.percentage_old:
-            sys.stdout.write(_to_utf8("percentage\t%i\n" % percent))
-            self.percentage_old = percent
-        sys.stdout.flush()
+            self.progress.reset(self.request_id)
+            self._emit(b"no-percentage-updates\n")
+            return
+        if percent == 0:
+            # starting over
+            self.progress.reset(self.request_id)
+        if self.progress.update(key, int(percent), final=percent >= 100):
+            self._emit(b"percentage\t%i\n", (percent,))
 
     def speed(self, bps=0):
         '''
         Write progress speed
         @param bps: Progress speed (int, bytes per second)
         '''
-        sys.stdout.write(_to_utf8("speed\t%i\n" % bps))
-        sys.stdout.flush()
+        if self.progress.update((self.request_id, 'speed'), int(bps), monotonic=False):
+            self._emit(b"speed\t%i\n", (bps,))
 
     def item_progress(self, package_id, status, percent=None):
         '''
@@ -144,8 +462,9 @@ class PackageKitBaseBackend:
         @param package_id: The package ID name, e.g. openoffice-clipart;2.6.22;ppc64;fedora
         @param percent: percentage of the current item (int preferred)
         '''
-        sys.stdout.write(_to_utf8("item-progress\t%s\t%s\t%i\n" % (package_id, status, percent)))
-        sys.stdout.flush()
+        key = (self.request_id, 'item-progress')
+        if self.progress.update(key, int(percent), item=(package_id, status), final=percent >= 100):
+            self._emit(b"item-progress\t%s\t%s\t%i\n", (_to_utf8(package_id), _to_utf8(status), percent))
 
     def error(self, err, description, exit=True):
         '''
@@ -154,13 +473,14 @@ class PackageKitBaseBackend:
         @param description: Error description
         @param exit: exit application with rc = 1, if true
         '''
+        self._request.errors += 1
+
         # unlock before we emit if we are going to exit
         if exit and self.isLocked():
             self.unLock()
 
         # this should be fast now
-        sys.stdout.write(_to_utf8("error\t%s\t%s\n" % (err, description)))
-        sys.stdout.flush()
+        self._emit(b"error\t%s\t%s\n", (_to_utf8(err), _to_utf8(description)), urgent=True)
         if exit:
             # Paradoxically, we don't want to print "finished" to stdout here.
             # Python takes an _enormous_ amount of time to exit, and leaves a
@@ -174,8 +494,7 @@ class PackageKitBaseBackend:
         send 'message' signal
         @param typ: MESSAGE_BROKEN_MIRROR
         '''
-        sys.stdout.write(_to_utf8("message\t%s\t%s\n" % (typ, msg)))
-        sys.stdout.flush()
+        self._emit(b"message\t%s\t%s\n", (_to_utf8(typ), _to_utf8(msg)))
 
     def package(self, package_id, status, summary):
         '''
@@ -184,8 +503,29 @@ class PackageKitBaseBackend:
         @param package_id: The package ID name, e.g. openoffice-clipart;2.6.22;ppc64;fedora
         @param summary: The package Summary
         '''
-        sys.stdout.write(_to_utf8("package\t%s\t%s\t%s\n" % (status, package_id, summary)))
-        sys.stdout.flush()
+        # one line straight away, packages() is for batches
+        self._emit(b"package\t%s\t%s\t%s\n", (_to_utf8(status), _to_utf8(package_id), _to_utf8(summary)))
+
+    def packages(self, pkgs):
+        '''
+        send a 'package' signal for each package, writing them in chunks
+        @param pkgs: iterable of (info, package_id, summary) tuples, a
+                     generator is consumed as it goes and never held in memory
+        '''
+        encode = self._encode
+        tag = self._request.tag
+        recording = self._request.recording
+        template = b"package\t%s\t%s\t%s\n"
+        pkgs = iter(pkgs)
+        while True:
+            chunk = [(_to_utf8(info), _to_utf8(package_id), _to_utf8(summary))
+                     for info, package_id, summary in islice(pkgs, PACKAGES_CHUNK_SIZE)]
+            if not chunk:
+                break
+            if recording is not None:
+                recording.extend([(template, fields) for fields in chunk])
+            data = b"".join([encode(template, fields, tag) for fields in chunk])
+            self.writer.write(data, False, template, len(chunk))
 
     def media_change_required(self, mtype, id, text):
         '''
@@ -194,8 +534,7 @@ class PackageKitBaseBackend:
         @param id: the localised label of the media
         @param text: the localised text describing the media
         '''
-        sys.stdout.write(_to_utf8("media-change-required\t%s\t%s\t%s\n" % (mtype, id, text)))
-        sys.stdout.flush()
+        self._emit(b"media-change-required\t%s\t%s\t%s\n", (_to_utf8(mtype), _to_utf8(id), _to_utf8(text)), urgent=True)
 
     def distro_upgrade(self, dtype, name, summary):
         '''
@@ -204,16 +543,14 @@ class PackageKitBaseBackend:
         @param name: The distro name, e.g. "fedora-9"
         @param summary: The localised distribution name and description
         '''
-        sys.stdout.write(_to_utf8("distro-upgrade\t%s\t%s\t%s\n" % (dtype, name, summary)))
-        sys.stdout.flush()
+        self._emit(b"distro-upgrade\t%s\t%s\t%s\n", (_to_utf8(dtype), _to_utf8(name), _to_utf8(summary)))
 
     def status(self, state):
         '''
         send 'status' signal
         @param state: STATUS_DOWNLOAD, STATUS_INSTALL, STATUS_UPDATE, STATUS_REMOVE, STATUS_WAIT
         '''
-        sys.stdout.write(_to_utf8("status\t%s\n" % state))
-        sys.stdout.flush()
+        self._emit(b"status\t%s\n", (_to_utf8(state),))
 
     def repo_detail(self, repoid, name, state):
         '''
@@ -221,16 +558,14 @@ class PackageKitBaseBackend:
         @param repoid: The repo id tag
         @param state: false is repo is disabled else true.
         '''
-        sys.stdout.write(_to_utf8("repo-detail\t%s\t%s\t%s\n" % (repoid, name, _bool_to_string(state))))
-        sys.stdout.flush()
+        self._emit(b"repo-detail\t%s\t%s\t%s\n", (_to_utf8(repoid), _to_utf8(name), _bool_to_bytes(state)))
 
     def data(self, data):
         '''
         send 'data' signal:
         @param data:  The current worked on package
         '''
-        sys.stdout.write(_to_utf8("data\t%s\n" % data))
-        sys.stdout.flush()
+        self._emit(b"data\t%s\n", (_to_utf8(data),))
 
     def details(self, package_id, summary, package_license, group, desc, url, bytes):
         '''
@@ -243,16 +578,20 @@ class PackageKitBaseBackend:
         @param url: The upstream project homepage
         @param bytes: The size of the package, in bytes
         '''
-        sys.stdout.write(_to_utf8("details\t%s\t%s\t%s\t%s\t%s\t%s\t%ld\n" % (package_id, summary, package_license, group, desc, url, bytes)))
-        sys.stdout.flush()
+        self._emit(b"details\t%s\t%s\t%s\t%s\t%s\t%s\t%ld\n", (_to_utf8(package_id), _to_utf8(summary), _to_utf8(package_license), _to_utf8(group), _to_utf8(desc), _to_utf8(url), bytes))
 
     def files(self, package_id, file_list):
         '''
         Send 'files' signal
         @param file_list: List of the files in the package, separated by ';'
+                          or a list, which the framed protocol sends unescaped
         '''
-        sys.stdout.write(_to_utf8("files\t%s\t%s\n" % (package_id, file_list)))
-        sys.stdout.flush()
+        if isinstance(file_list, (list, tuple)):
+            if self.protocol == PROTOCOL_FRAMED:
+                self._emit(b"files", (_to_utf8(package_id), _to_utf8("\0".join(file_list))))
+                return
+            file_list = ";".join(file_list)
+        self._emit(b"files\t%s\t%s\n", (_to_utf8(package_id), _to_utf8(file_list)))
 
     def category(self, parent_id, cat_id, name, summary, icon):
         '''
@@ -263,15 +602,16 @@ class PackageKitBaseBackend:
         summery   : a summary of the category in current locale.
         icon      : an icon name to represent the category
         '''
-        sys.stdout.write(_to_utf8("category\t%s\t%s\t%s\t%s\t%s\n" % (parent_id, cat_id, name, summary, icon)))
-        sys.stdout.flush()
+        self._emit(b"category\t%s\t%s\t%s\t%s\t%s\n", (_to_utf8(parent_id), _to_utf8(cat_id), _to_utf8(name), _to_utf8(summary), _to_utf8(icon)))
 
     def finished(self):
         '''
         Send 'finished' signal
         '''
-        sys.stdout.write(_to_utf8("finished\n"))
-        sys.stdout.flush()
+        # the last progress held back still goes out first
+        self._send_held_progress()
+        self.progress.reset(self.request_id)
+        self._emit(b"finished\n", urgent=True)
 
     def update_detail(self, package_id, updates, obsoletes, vendor_url, bugzilla_url, cve_url, restart, update_text, changelog, state, issued, updated):
         '''
@@ -289,8 +629,7 @@ class PackageKitBaseBackend:
         @param issued:
         @param updated:
         '''
-        sys.stdout.write(_to_utf8("updatedetail\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (package_id, updates, obsoletes, vendor_url, bugzilla_url, cve_url, restart, update_text, changelog, state, issued, updated)))
-        sys.stdout.flush()
+        self._emit(b"updatedetail\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n", (_to_utf8(package_id), _to_utf8(updates), _to_utf8(obsoletes), _to_utf8(vendor_url), _to_utf8(bugzilla_url), _to_utf8(cve_url), _to_utf8(restart), _to_utf8(update_text), _to_utf8(changelog), _to_utf8(state), _to_utf8(issued), _to_utf8(updated)))
 
     def require_restart(self, restart_type, details):
         '''
@@ -298,8 +637,7 @@ class PackageKitBaseBackend:
         @param restart_type: RESTART_SYSTEM, RESTART_APPLICATION, RESTART_SESSION
         @param details: Optional details about the restart
         '''
-        sys.stdout.write(_to_utf8("requirerestart\t%s\t%s\n" % (restart_type, details)))
-        sys.stdout.flush()
+        self._emit(b"requirerestart\t%s\t%s\n", (_to_utf8(restart_type), _to_utf8(details)))
 
     def allow_cancel(self, allow):
         '''
@@ -307,11 +645,10 @@ class PackageKitBaseBackend:
         @param allow:  Allow the current process to be aborted.
         '''
         if allow:
-            data = 'true'
+            data = b'true'
         else:
-            data = 'false'
-        sys.stdout.write(_to_utf8("allow-cancel\t%s\n" % data))
-        sys.stdout.flush()
+            data = b'false'
+        self._emit(b"allow-cancel\t%s\n", (data,), urgent=True)
 
     def repo_signature_required(self, package_id, repo_name, key_url, key_userid, key_id, key_fingerprint, key_timestamp, sig_type):
         '''
@@ -325,10 +662,10 @@ class PackageKitBaseBackend:
         @param key_timestamp:   Key timestamp
         @param sig_type:        Key type (GPG)
         '''
-        sys.stdout.write(_to_utf8("repo-signature-required\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (
-            package_id, repo_name, key_url, key_userid, key_id, key_fingerprint, key_timestamp, sig_type
-            )))
-        sys.stdout.flush()
+        self._emit(b"repo-signature-required\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n", (
+            _to_utf8(package_id), _to_utf8(repo_name), _to_utf8(key_url), _to_utf8(key_userid),
+            _to_utf8(key_id), _to_utf8(key_fingerprint), _to_utf8(key_timestamp), _to_utf8(sig_type)
+            ), urgent=True)
 
     def eula_required(self, eula_id, package_id, vendor_name, license_agreement):
         '''
@@ -338,10 +675,75 @@ class PackageKitBaseBackend:
         @param vendor_name:     Name of the vendor that wrote the EULA
         @param license_agreement: The license text
         '''
-        sys.stdout.write(_to_utf8("eula-required\t%s\t%s\t%s\t%s\n" % (
-            eula_id, package_id, vendor_name, license_agreement
-            )))
-        sys.stdout.flush()
+        self._emit(b"eula-required\t%s\t%s\t%s\t%s\n", (
+            _to_utf8(eula_id), _to_utf8(package_id), _to_utf8(vendor_name), _to_utf8(license_agreement)
+            ), urgent=True)
+
+    def parallel_map(self, func, items, max_workers=4, ordered=True, processes=False):
+        '''
+        Run func over items on a pool of threads, or of processes, and
+        yield (item, result) tuples, e.g. to look up the details of many
+        package ids at once:
+
+            for package_id, pkg in self.parallel_map(self._lookup, package_ids):
+                self.details(...)
+
+        func should only look things up and leave the signals to the caller.
+        It can raise PkError for a fatal error, which is then sent with
+        error() from the calling thread, exiting as usual; any other
+        exception is re-raised there. Either way the remaining items are
+        dropped. At most twice max_workers items are queued at a time, so
+        items can be a long generator.
+        @param ordered: yield results in the order of items, instead of as
+                        soon as they are ready
+        @param processes: use processes, func and items must be picklable
+        '''
+        # only some commands of some backends need this
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, \
+            wait, FIRST_COMPLETED
+
+        if processes:
+            executor = ProcessPoolExecutor(max_workers)
+            call = func
+        else:
+            executor = ThreadPoolExecutor(max_workers)
+            request_id = self.request_id
+            cancellable = self._request.cancellable
+            def call(item):
+                # anything emitted by mistake still belongs to this request
+                self._set_request_id(request_id)
+                self._request.cancellable = cancellable
+                return func(item)
+
+        items = iter(items)
+        futures = {}
+        queue = deque()
+        def submit(count):
+            for item in islice(items, count):
+                future = executor.submit(call, item)
+                futures[future] = item
+                if ordered:
+                    queue.append(future)
+
+        try:
+            submit(2 * max_workers)
+            while futures:
+                if ordered:
+                    done = [queue.popleft()]
+                else:
+                    done = wait(list(futures), return_when=FIRST_COMPLETED)[0]
+                for future in done:
+                    item = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except PkError as e:
+                        self.error(e.code, e.details)
+                    yield item, result
+                submit(len(done))
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
 
 #
 # Backend Action Methods
@@ -580,170 +982,279 @@ class PackageKitBaseBackend:
         self.dispatch_command(cmd, args)
 
     def dispatch_command(self, cmd, args):
-        if cmd == 'download-packages':
-            directory = args[0]
-            package_ids = args[1].split(PACKAGE_IDS_DELIM)
-            self.download_packages(directory, package_ids)
-            self.finished()
-        elif cmd == 'depends-on':
-            filters = args[0].split(';')
-            package_ids = args[1].split(PACKAGE_IDS_DELIM)
-            recursive = _text_to_bool(args[2])
-            self.depends_on(filters, package_ids, recursive)
-            self.finished()
-        elif cmd == 'get-details':
-            package_ids = args[0].split(PACKAGE_IDS_DELIM)
-            self.get_details(package_ids)
-            self.finished()
-        elif cmd == 'get-details-local':
-            files = args[0].split(PACKAGE_IDS_DELIM)
-            self.get_details_local(files)
-            self.finished()
-        elif cmd == 'get-files':
-            package_ids = args[0].split(PACKAGE_IDS_DELIM)
-            self.get_files(package_ids)
-            self.finished()
-        elif cmd == 'get-packages':
-            filters = args[0].split(';')
-            self.get_packages(filters)
-            self.finished()
-        elif cmd == 'get-repo-list':
-            filters = args[0].split(';')
-            self.get_repo_list(filters)
-            self.finished()
-        elif cmd == 'required-by':
-            filters = args[0].split(';')
-            package_ids = args[1].split(PACKAGE_IDS_DELIM)
-            recursive = _text_to_bool(args[2])
-            self.required_by(filters, package_ids, recursive)
-            self.finished()
-        elif cmd == 'get-update-detail':
-            package_ids = args[0].split(PACKAGE_IDS_DELIM)
-            self.get_update_detail(package_ids)
-            self.finished()
-        elif cmd == 'get-distro-upgrades':
-            self.get_distro_upgrades()
-            self.finished()
-        elif cmd == 'get-updates':
-            filters = args[0].split(';')
-            self.get_updates(filters)
-            self.finished()
-        elif cmd == 'install-files':
-            transaction_flags = args[0].split(';')
-            files_to_inst = args[1].split(FILENAME_DELIM)
-            self.install_files(transaction_flags, files_to_inst)
-            self.finished()
-        elif cmd == 'install-packages':
-            transaction_flags = args[0].split(';')
-            package_ids = args[1].split(PACKAGE_IDS_DELIM)
-            self.install_packages(transaction_flags, package_ids)
-            self.finished()
-        elif cmd == 'install-signature':
-            sigtype = args[0]
-            key_id = args[1]
-            package_id = args[2]
-            self.install_signature(sigtype, key_id, package_id)
-            self.finished()
-        elif cmd == 'refresh-cache':
-            force = _text_to_bool(args[0])
-            self.refresh_cache(force)
-            self.finished()
-        elif cmd == 'remove-packages':
-            transaction_flags = args[0].split(';')
-            package_ids = args[1].split(PACKAGE_IDS_DELIM)
-            allowdeps = _text_to_bool(args[2])
-            autoremove = _text_to_bool(args[3])
-            self.remove_packages(transaction_flags, package_ids, allowdeps, autoremove)
-            self.finished()
-        elif cmd == 'repo-enable':
-            repoid = args[0]
-            state = _text_to_bool(args[1])
-            self.repo_enable(repoid, state)
-            self.finished()
-        elif cmd == 'repo-set-data':
-            repoid = args[0]
-            para = args[1]
-            value = args[2]
-            self.repo_set_data(repoid, para, value)
-            self.finished()
-        elif cmd == 'resolve':
-            filters = args[0].split(';')
-            package_ids = args[1].split(PACKAGE_IDS_DELIM)
-            self.resolve(filters, package_ids)
-            self.finished()
-        elif cmd == 'search-details':
-            filters = args[0].split(';')
-            values = _to_unicode(args[1]).split(PACKAGE_IDS_DELIM)
-            self.search_details(filters, values)
-            self.finished()
-        elif cmd == 'search-file':
-            filters = args[0].split(';')
-            values = args[1].split(PACKAGE_IDS_DELIM)
-            self.search_file(filters, values)
-            self.finished()
-        elif cmd == 'search-group':
-            filters = args[0].split(';')
-            values = args[1].split(PACKAGE_IDS_DELIM)
-            self.search_group(filters, values)
-            self.finished()
-        elif cmd == 'search-name':
-            filters = args[0].split(';')
-            values = _to_unicode(args[1]).split(PACKAGE_IDS_DELIM)
-            self.search_name(filters, values)
-            self.finished()
-        elif cmd == 'signature-install':
-            package = args[0]
-            self.repo_signature_install(package)
-            self.finished()
-        elif cmd == 'update-packages':
-            transaction_flags = args[0].split(';')
-            package_ids = args[1].split(PACKAGE_IDS_DELIM)
-            self.update_packages(transaction_flags, package_ids)
-            self.finished()
-        elif cmd == 'what-provides':
-            filters = args[0].split(';')
-            provides_type = args[1]
-            values = _to_unicode(args[2]).split(PACKAGE_IDS_DELIM)
-            self.what_provides(filters, provides_type, values)
+        command = self.commands.lookup(cmd)
+        if command is None:
+            errmsg = "command '%s' is not known" % cmd
+            self.error(ERROR_INTERNAL_ERROR, errmsg, exit=False)
             self.finished()
-        elif cmd == 'set-locale':
-            code = args[0]
-            self.set_locale(code)
+            return
+
+        errors = self._request.errors
+        start = _monotonic()
+        failed = True
+        cancellable = PackagekitCancellable()
+        self._request.cancellable = cancellable
+        self._running[cancellable] = self.request_id
+        try:
+            with trace_span(cmd, 'dispatch'), memory_profile(cmd):
+                try:
+                    params = command.parse(args)
+                except PkError as e:
+                    self.error(e.code, e.details, exit=False)
+                    self.finished()
+                    return
+                with trace_span(command.method, 'backend'):
+                    try:
+                        self._run_command(command, args, params)
+                    except PkCancelled:
+                        self.error(ERROR_TRANSACTION_CANCELLED, "the transaction was cancelled", exit=False)
+                if command.finish:
+                    self.finished()
+            failed = self._request.errors != errors
+        finally:
+            del self._running[cancellable]
+            self._request.cancellable = None
+            self.commands.record(command, _monotonic() - start, failed)
+            flush_diagnostics()
+
+        if self._quitting and not self._running:
+            # the daemon sent SIGQUIT and expects us to go
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            if self.isLocked():
+                self.unLock()
+            self.writer.flush()
+            sys.exit(1)
+
+    def check_cancelled(self):
+        '''
+        Raise PkCancelled if the running command has been cancelled
+        Cheap enough to call for every package in a long loop. The
+        dispatcher reports the transaction as cancelled, and carries on
+        with the next command.
+        '''
+        cancellable = self._request.cancellable
+        if cancellable is not None and cancellable.cancelled:
+            raise PkCancelled()
+
+    def cancel(self, request_id=None):
+        '''
+        Cancel running commands, at their next check_cancelled()
+        @param request_id: only cancel the pipelined command with this id
+        Returns True if there was something to cancel
+        '''
+        found = False
+        for cancellable, running_id in list(self._running.items()):
+            if request_id is None or running_id == request_id:
+                cancellable.cancel()
+                found = True
+        return found
+
+    def _install_signal_handlers(self):
+        try:
+            signal.signal(signal.SIGUSR1, self._on_sigusr1)
+            signal.signal(signal.SIGQUIT, self._on_sigquit)
+            signal.signal(signal.SIGUSR2, self._on_sigusr2)
+        except ValueError:
+            # not on the main thread, signals are up to whoever runs us
+            pass
+
+    def _on_sigusr1(self, signum, frame):
+        self.cancel()
+
+    def _on_sigusr2(self, signum, frame):
+        # not print(), the main thread may be writing to stderr itself
+        lines = ['stats\t%s\t%s\t%s\n' % row for row in self.get_stats_report()]
+        os.write(2, ''.join(lines).encode('utf-8', 'replace'))
+
+    def _on_sigquit(self, signum, frame):
+        if not self.cancel():
+            raise SystemExit(1)
+        # give the commands a moment to stop by themselves
+        self._quitting = True
+        signal.signal(signal.SIGALRM, self._on_quit_timeout)
+        signal.setitimer(signal.ITIMER_REAL, QUIT_GRACE_TIME)
+
+    def _on_quit_timeout(self, signum, frame):
+        # signal handlers run on the main thread, which sees its own command
+        if self._request.cancellable is not None:
+            raise SystemExit(1)
+        # the commands are on worker threads and can't be interrupted
+        os._exit(1)
+
+    def _run_command(self, command, args, params):
+        '''
+        Run the backend method of a command, or replay its cached result
+        '''
+        key = None
+        # only backends that can tell their databases apart import the cache
+        if type(self).get_cache_fingerprint is not PackageKitBaseBackend.get_cache_fingerprint:
+            from .cache import CACHEABLE_COMMANDS, cache_key
+            if command.name in CACHEABLE_COMMANDS:
+                fingerprint = self.get_cache_fingerprint()
+                if fingerprint is not None:
+                    key = cache_key(command.name, args, fingerprint, self.lang, self.protocol)
+        if key is None:
+            getattr(self, command.method)(*params)
+            return
+
+        records = self.query_cache.get(key)
+        if records is not None:
+            with trace_span('replay', 'cache', signals=len(records)):
+                self._replay(records)
+            return
+        errors = self._request.errors
+        self._request.recording = []
+        try:
+            getattr(self, command.method)(*params)
+            records = self._request.recording
+        finally:
+            self._request.recording = None
+        if self._request.errors == errors:
+            self.query_cache.put(key, records)
+
+    def _cmd_protocol(self, protocol):
+        # no finished here, the acknowledgement is the last text line
+        if protocol == PROTOCOL_FRAMED and os.environ.get(FRAMED_ENV) != '1':
+            errmsg = "protocol '%s' is experimental, set %s=1 to use it" % (protocol, FRAMED_ENV)
+            self.error(ERROR_NOT_SUPPORTED, errmsg, exit=False)
             self.finished()
-        elif cmd == 'get-categories':
-            self.get_categories()
+        elif protocol in PROTOCOLS:
+            self._emit(b"protocol\t%s\n", (_to_utf8(protocol),), urgent=True)
+            self.set_protocol(protocol)
+        else:
+            errmsg = "protocol '%s' is not known" % protocol
+            self.error(ERROR_NOT_SUPPORTED, errmsg, exit=False)
             self.finished()
-        elif cmd == 'upgrade-system':
-            self.upgrade_system(args[0])
+
+    def _cmd_pipeline(self, pipelined):
+        # like protocol, acknowledged without finished
+        self._emit(b"pipeline\t%s\n", (_bool_to_bytes(pipelined),), urgent=True)
+        self.set_pipelined(pipelined)
+
+    def get_stats_report(self):
+        '''
+        Returns what the helper has done so far, see stats.py
+        as a list of (kind, name, value) strings
+        '''
+        stats = self.stats
+        report = [
+            ('helper', 'uptime', '%.3f' % stats.uptime()),
+            ('helper', 'rss', '%i' % _get_rss()),
+        ]
+        for name, calls, errors, total_time in self.commands.get_stats():
+            report.append(('command', name, 'calls=%i errors=%i total-ms=%.1f mean-ms=%.1f' %
+                           (calls, errors, total_time * 1000, total_time * 1000 / calls)))
+        for name, count, size in self.writer.get_signals():
+            report.append(('signal', name, 'count=%i bytes=%i' % (count, size)))
+        caches = [('query', self.query_cache.hits, self.query_cache.misses, self.query_cache.stores)]
+        for name, hits, misses, stores in caches + stats.get_caches():
+            report.append(('cache', name, 'hits=%i misses=%i stores=%i' % (hits, misses, stores)))
+        for name, value in stats.get_counters():
+            report.append(('counter', name, str(value)))
+        return report
+
+    def _cmd_stats(self):
+        for kind, name, value in self.get_stats_report():
+            self._emit(b"stats\t%s\t%s\t%s\n", (_to_utf8(kind), _to_utf8(name), _to_utf8(value)))
+
+    def _cmd_side_channel(self, directory):
+        # like protocol, acknowledged without finished
+        if directory in ('', 'none'):
+            self._emit(b"side-channel\tnone\n", urgent=True)
+            self.writer.side_channel = None
+            return
+        if os.environ.get(SIDE_CHANNEL_ENV) != '1':
+            errmsg = "the side channel is experimental, set %s=1 to use it" % SIDE_CHANNEL_ENV
+            self.error(ERROR_NOT_SUPPORTED, errmsg, exit=False)
             self.finished()
-        elif cmd == 'repair-system':
-            self.repair_system(args[0])
+            return
+        from .sidechannel import PackagekitSideChannel
+        encode = lambda template, fields, tag: self._encode(template, fields, tag)
+        side_channel = PackagekitSideChannel(directory, encode)
+        try:
+            side_channel.check()
+        except (IOError, OSError) as e:
+            errmsg = "cannot use '%s' as side channel: %s" % (directory, str(e))
+            self.error(ERROR_NOT_SUPPORTED, errmsg, exit=False)
             self.finished()
-        else:
-            errmsg = "command '%s' is not known" % cmd
+            return
+        self._emit(b"side-channel\t%s\n", (_to_utf8(directory),), urgent=True)
+        self.writer.side_channel = side_channel
+
+    def _dispatch_request(self, request_id, args):
+        '''
+        Run one pipelined command, tagging everything it emits
+        '''
+        self._set_request_id(request_id)
+        if not args:
+            errmsg = "request '%s' has no command" % request_id
             self.error(ERROR_INTERNAL_ERROR, errmsg, exit=False)
             self.finished()
+        else:
+            self.dispatch_command(args[0], args[1:])
+
+        # not reset on exceptions, so the traceback is tagged too
+        self._set_request_id(None)
 
     def dispatcher(self, args):
+        trace_startup()
+        record_argv(args)
         if len(args) > 0:
             self.dispatch_command(args[0], args[1:])
+        reader = _CommandReader(sys.stdin)
         while True:
             try:
-                line = sys.stdin.readline().strip('\n')
+                line = reader.readline(self._recycle_timeout())
             except IOError as e:
                 self.error(ERROR_TRANSACTION_CANCELLED, 'could not read from stdin: %s' % str(e))
             except KeyboardInterrupt as e:
                 self.error(ERROR_PROCESS_KILL, 'process was killed by ctrl-c: %s' % str(e))
+            if line:
+                record_command(line)
             if not line or line == 'exit':
                 break
             args = line.split('\t')
-            self.dispatch_command(args[0], args[1:])
+            if self.pipelined and args[0] == 'cancel' and len(args) == 2:
+                # nothing runs while we read, the request has already finished
+                continue
+            if self.pipelined:
+                self._dispatch_request(args[0], args[1:])
+            else:
+                self.dispatch_command(args[0], args[1:])
 
         # unlock backend and exit with success
         if self.isLocked():
             self.unLock()
+        self.writer.flush()
         sys.exit(0)
 
+    def _recycle_timeout(self):
+        '''
+        How long to wait for the next command before exiting, None for ever
+        '''
+        # exit between commands only, the daemon sees a finished transaction
+        # and starts a new helper for the next one; commands that have
+        # already been sent are run first
+        rss = self.max_rss and _get_rss()
+        if rss > self.max_rss:
+            print("helper uses %i bytes, more than %i, exiting once idle" %
+                  (rss, self.max_rss), file=sys.stderr)
+            return 0
+        if self.idle_timeout > 0:
+            return self.idle_timeout
+        return None
+
+    def async_dispatcher(self, args, max_workers=4):
+        '''
+        Like dispatcher(), but once the daemon has enabled pipelining, read-only
+        query commands run concurrently on a pool of max_workers threads.
+        Commands that change the system wait for running queries and run alone.
+        The query methods of a backend using this have to be thread safe.
+        '''
+        # asyncio is slow to import, only load it for backends that want it
+        from .asyncdispatch import run_async_dispatcher
+        run_async_dispatcher(self, args, max_workers)
+
 
 def format_string(text, encoding='utf-8'):
     '''
@@ -759,10 +1270,74 @@ def _text_to_bool(text):
         return True
     return False
 
-def _bool_to_string(value):
+def _bool_to_bytes(value):
     if value:
-        return "true"
-    return "false"
+        return b"true"
+    return b"false"
+
+# argument parsers for PackagekitCommand
+def ARG_STRING(text):
+    return text
+
+def ARG_BOOL(text):
+    return _text_to_bool(text)
+
+def ARG_FILTERS(text):
+    return text.split(';')
+
+def ARG_PACKAGE_IDS(text):
+    return text.split(PACKAGE_IDS_DELIM)
+
+def ARG_VALUES(text):
+    return _to_unicode(text).split(PACKAGE_IDS_DELIM)
+
+def ARG_FILENAMES(text):
+    return text.split(FILENAME_DELIM)
+
+# ';' separated, just like filters
+ARG_TRANSACTION_FLAGS = ARG_FILTERS
+
+DEFAULT_COMMANDS = [
+    PackagekitCommand('depends-on', 'depends_on', (ARG_FILTERS, ARG_PACKAGE_IDS, ARG_BOOL)),
+    PackagekitCommand('download-packages', 'download_packages', (ARG_STRING, ARG_PACKAGE_IDS)),
+    PackagekitCommand('get-categories', 'get_categories'),
+    PackagekitCommand('get-details', 'get_details', (ARG_PACKAGE_IDS,)),
+    PackagekitCommand('get-details-local', 'get_details_local', (ARG_PACKAGE_IDS,)),
+    PackagekitCommand('get-distro-upgrades', 'get_distro_upgrades'),
+    PackagekitCommand('get-files', 'get_files', (ARG_PACKAGE_IDS,)),
+    PackagekitCommand('get-packages', 'get_packages', (ARG_FILTERS,)),
+    PackagekitCommand('get-repo-list', 'get_repo_list', (ARG_FILTERS,)),
+    PackagekitCommand('get-update-detail', 'get_update_detail', (ARG_PACKAGE_IDS,)),
+    PackagekitCommand('get-updates', 'get_updates', (ARG_FILTERS,)),
+    PackagekitCommand('install-files', 'install_files', (ARG_TRANSACTION_FLAGS, ARG_FILENAMES)),
+    PackagekitCommand('install-packages', 'install_packages', (ARG_TRANSACTION_FLAGS, ARG_PACKAGE_IDS)),
+    PackagekitCommand('install-signature', 'install_signature', (ARG_STRING, ARG_STRING, ARG_STRING)),
+    PackagekitCommand('refresh-cache', 'refresh_cache', (ARG_BOOL,)),
+    PackagekitCommand('remove-packages', 'remove_packages',
+                      (ARG_TRANSACTION_FLAGS, ARG_PACKAGE_IDS, ARG_BOOL, ARG_BOOL)),
+    PackagekitCommand('repair-system', 'repair_system', (ARG_STRING,)),
+    PackagekitCommand('repo-enable', 'repo_enable', (ARG_STRING, ARG_BOOL)),
+    PackagekitCommand('repo-set-data', 'repo_set_data', (ARG_STRING, ARG_STRING, ARG_STRING)),
+    PackagekitCommand('required-by', 'required_by', (ARG_FILTERS, ARG_PACKAGE_IDS, ARG_BOOL)),
+    PackagekitCommand('resolve', 'resolve', (ARG_FILTERS, ARG_PACKAGE_IDS)),
+    PackagekitCommand('search-details', 'search_details', (ARG_FILTERS, ARG_VALUES)),
+    PackagekitCommand('search-file', 'search_file', (ARG_FILTERS, ARG_PACKAGE_IDS)),
+    PackagekitCommand('search-group', 'search_group', (ARG_FILTERS, ARG_PACKAGE_IDS)),
+    PackagekitCommand('search-name', 'search_name', (ARG_FILTERS, ARG_VALUES)),
+    PackagekitCommand('set-locale', 'set_locale', (ARG_STRING,)),
+    PackagekitCommand('signature-install', 'repo_signature_install', (ARG_STRING,)),
+    PackagekitCommand('update-packages', 'update_packages', (ARG_TRANSACTION_FLAGS, ARG_PACKAGE_IDS)),
+    PackagekitCommand('upgrade-system', 'upgrade_system', (ARG_STRING,)),
+    PackagekitCommand('what-provides', 'what_provides', (ARG_FILTERS, ARG_STRING, ARG_VALUES)),
+
+    # wire protocol negotiation, see protocol.py
+    PackagekitCommand('pipeline', '_cmd_pipeline', (ARG_BOOL,), finish=False),
+    PackagekitCommand('protocol', '_cmd_protocol', (ARG_STRING,), finish=False),
+    PackagekitCommand('side-channel', '_cmd_side_channel', (ARG_STRING,), finish=False),
+
+    # diagnostics, see stats.py
+    PackagekitCommand('stats', '_cmd_stats'),
+]
 
 def get_package_id(name, version, arch, data):
     """Returns a package id."""
@@ -780,6 +1355,7 @@ def exceptionHandler(typ, value, tb, base):
     sys.excepthook = sys.__excepthook__
     # Call backend custom Traceback handler
     if not base.customTracebackHandler(typ):
+        import traceback
         etb = traceback.extract_tb(tb)
         errmsg = 'Error Type: %s;' % str(typ)
         errmsg += 'Error Value: %s;' % str(value)
@@ -0,0 +1,235 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Cache of query results for python backends
+#
+# A backend that overrides get_cache_fingerprint() to return something
+# that changes whenever its package databases change gets the signals of
+# its query commands recorded and, when the same command comes in again
+# with the same arguments and fingerprint, replayed instead of computed.
+#
+# hashlib and pickle are only imported by backends that use the cache.
+#
+
+import os
+import errno
+import threading
+from collections import OrderedDict
+
+from .protocol import signal_name
+
+# commands whose output only depends on their arguments and the databases
+CACHEABLE_COMMANDS = frozenset([
+    'depends-on',
+    'get-details',
+    'get-files',
+    'get-packages',
+    'required-by',
+    'resolve',
+    'search-details',
+    'search-file',
+    'search-group',
+    'search-name',
+    'what-provides',
+])
+
+# signals that describe how a command ran rather than what it found
+_TRANSIENT_SIGNALS = frozenset([
+    b'allow-cancel',
+    b'finished',
+    b'item-progress',
+    b'no-percentage-updates',
+    b'percentage',
+    b'speed',
+    b'status',
+])
+
+DEFAULT_MEMORY_ENTRIES = 64
+DEFAULT_DISK_ENTRIES = 512
+
+def cache_key(command, args, fingerprint, lang, protocol):
+    '''
+    Returns the key a command result is stored under, as a hex string
+    The protocol is part of it as some signals are recorded differently
+    for each, e.g. the unescaped file lists of the framed one.
+    '''
+    import hashlib
+    data = repr((command, tuple(args), fingerprint, lang, protocol))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+def files_fingerprint(paths):
+    '''
+    Returns a string made of the size and modification time of every file
+    under the given paths, for a get_cache_fingerprint() covering config
+    that is edited in place, which leaves the mtime of its directory alone.
+    Directories are walked recursively; symbolic links, e.g. a profile
+    link, count by their target and aren't followed.
+    @param paths: a list of file and directory paths, missing ones are fine
+    '''
+    entries = []
+
+    def add(path):
+        try:
+            st = os.lstat(path)
+        except OSError:
+            entries.append('%s=' % path)
+            return
+        if os.path.islink(path):
+            entries.append('%s->%s' % (path, os.readlink(path)))
+        else:
+            entries.append('%s=%f:%i' % (path, st.st_mtime, st.st_size))
+
+    for path in paths:
+        if not os.path.isdir(path) or os.path.islink(path):
+            add(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                add(os.path.join(root, name))
+            for name in dirs:
+                if os.path.islink(os.path.join(root, name)):
+                    add(os.path.join(root, name))
+    return ';'.join(entries)
+
+class PackagekitQueryCache(object):
+    '''
+    Stores the signals emitted by query commands, the most recently used
+    in memory and, if a directory is given, all of them on disk too.
+    '''
+
+    def __init__(self, path=None, memory_entries=DEFAULT_MEMORY_ENTRIES,
+                 disk_entries=DEFAULT_DISK_ENTRIES):
+        '''
+        @param path: directory to keep results in between helper runs,
+                     only root should be able to write to it
+        @param memory_entries: number of results kept in memory
+        @param disk_entries: number of results kept on disk
+        '''
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    def _remember(self, key, records):
+        self._entries.pop(key, None)
+        self._entries[key] = records
+        while len(self._entries) > self.memory_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        '''
+        Returns the recorded (template, fields) list for key, or None
+        '''
+        with self._lock:
+            records = self._entries.pop(key, None)
+            if records is None and self.path is not None:
+                records = self._load(key)
+            if records is None:
+                self.misses += 1
+                return None
+            self._remember(key, records)
+            self.hits += 1
+            return records
+
+    def put(self, key, records):
+        '''
+        Store what a command emitted
+        @param records: list of (template, fields) as passed to _emit()
+        '''
+        records = [(template, fields) for template, fields in records
+                   if signal_name(template) not in _TRANSIENT_SIGNALS]
+        with self._lock:
+            self._remember(key, records)
+            self.stores += 1
+            if self.path is not None:
+                self._save(key, records)
+
+    def clear(self):
+        ''' Forget all results, in memory and on disk '''
+        with self._lock:
+            self._entries.clear()
+            if self.path is None:
+                return
+            try:
+                names = os.listdir(self.path)
+            except OSError:
+                return
+            for name in names:
+                try:
+                    os.unlink(self._entry_path(name))
+                except OSError:
+                    pass
+
+    def _load(self, key):
+        import pickle
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                records = pickle.load(f)
+            # the modification time orders the entries for eviction
+            os.utime(path, None)
+            return records
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+
+    def _save(self, key, records):
+        import pickle
+        try:
+            os.makedirs(self.path, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                return
+        path = self._entry_path(key)
+        tmp = '%s.%i.tmp' % (path, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump(records, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+        except (IOError, OSError, pickle.PicklingError):
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def _evict(self):
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+        if len(names) <= self.disk_entries:
+            return
+        entries = []
+        for name in names:
+            try:
+                entries.append((os.stat(self._entry_path(name)).st_mtime, name))
+            except OSError:
+                pass
+        entries.sort()
+        for mtime, name in entries[:len(entries) - self.disk_entries]:
+            try:
+                os.unlink(self._entry_path(name))
+            except OSError:
+                pass
@@ -0,0 +1,54 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Cooperative cancellation of python backend commands
+#
+# Every dispatched command gets a PackagekitCancellable. Backends call
+# check_cancelled() in their long loops, which raises PkCancelled once
+# the command has been cancelled; the dispatcher then reports the
+# transaction as cancelled and carries on with the next command.
+#
+# A command is cancelled by:
+#  - SIGUSR1, which cancels every running command, the helper stays
+#  - the line "cancel\t<request id>" while pipelined commands are running
+#    under async_dispatcher(), the helper stays
+#  - SIGQUIT, sent by the daemon to end a helper, which cancels every
+#    running command and exits once they have stopped. Commands that don't
+#    stop within QUIT_GRACE_TIME seconds are interrupted as before.
+#
+
+class PkCancelled(Exception):
+    ''' raised by check_cancelled() in a command that has been cancelled '''
+    pass
+
+# how long SIGQUIT waits for running commands to notice they're cancelled
+QUIT_GRACE_TIME = 0.1
+
+class PackagekitCancellable(object):
+    '''
+    The cancellation state of one command
+    '''
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        ''' Raises PkCancelled if cancel() has been called '''
+        if self.cancelled:
+            raise PkCancelled()
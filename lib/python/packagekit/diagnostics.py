@@ -0,0 +1,111 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Switches for the opt-in diagnostics of python backend helpers
+#
+# Tracing, recording and memory profiling are off unless their variable
+# is set in the environment, and the helper only imports tracing.py,
+# record.py or memprofile.py once it is. Until then the functions here
+# do nothing. The environment is looked at on every call, as a child of
+# a zygote only gets the environment of its transaction after the fork.
+# This module must stay cheap to import.
+#
+
+import os
+
+try:
+    from time import monotonic as _monotonic
+except ImportError:
+    from time import time as _monotonic
+
+TRACE_ENV = 'PK_BACKEND_TRACE'
+RECORD_ENV = 'PK_BACKEND_RECORD'
+MEMPROFILE_ENV = 'PK_BACKEND_MEMPROFILE'
+
+# roughly when the helper started, as backend.py imports us first thing
+start_time = _monotonic()
+
+def _after_fork():
+    # a child of a zygote starts a transaction of its own
+    global start_time
+    start_time = _monotonic()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+class _NullContext(object):
+    ''' what trace_span() and memory_profile() return when off '''
+    def __enter__(self):
+        return self
+    def __exit__(self, typ, value, tb):
+        return False
+
+_NULL_CONTEXT = _NullContext()
+
+def trace_span(name, cat='backend', **args):
+    '''
+    Record the time spent in a block when PK_BACKEND_TRACE is set, for
+    backends to mark their own work:
+
+        with trace_span('PortageBridge.update'):
+            ...
+    '''
+    if TRACE_ENV not in os.environ:
+        return _NULL_CONTEXT
+    from .tracing import trace_span
+    return trace_span(name, cat, **args)
+
+def memory_profile(name):
+    ''' Measure the memory used by a block if PK_BACKEND_MEMPROFILE is set '''
+    if MEMPROFILE_ENV not in os.environ:
+        return _NULL_CONTEXT
+    from .memprofile import memory_profile
+    return memory_profile(name)
+
+def get_recorder():
+    ''' Returns the PackagekitRecorder of this process, or None if not recording '''
+    if RECORD_ENV not in os.environ:
+        return None
+    from .record import get_recorder
+    return get_recorder()
+
+def trace_startup():
+    ''' Record the time from start_time until now as the startup span '''
+    if TRACE_ENV in os.environ:
+        from .tracing import trace_startup
+        trace_startup()
+
+def record_argv(args):
+    ''' Record the command line arguments the helper was started with '''
+    if RECORD_ENV in os.environ:
+        from .record import record_argv
+        record_argv(args)
+
+def record_command(line):
+    ''' Record a command line read from stdin, without its newline '''
+    if RECORD_ENV in os.environ:
+        from .record import record_command
+        record_command(line)
+
+def flush_diagnostics():
+    ''' Write out the trace and capture, e.g. after each command '''
+    environ = os.environ
+    if TRACE_ENV in environ:
+        from .tracing import flush_trace
+        flush_trace()
+    if RECORD_ENV in environ:
+        from .record import flush_record
+        flush_record()
@@ -21,15 +21,55 @@
 # imports
 from .enums import *
 from .package import PackagekitPackage
+from .diagnostics import trace_span
 import collections
-
-class PackagekitFilter(object, PackagekitPackage):
+import functools
+
+# filters that only look at the package itself, to the method checking them
+_BASE_FILTERS = {
+    FILTER_GUI: '_do_gui_filtering',
+    FILTER_NOT_GUI: '_do_gui_filtering',
+    FILTER_DEVELOPMENT: '_do_devel_filtering',
+    FILTER_NOT_DEVELOPMENT: '_do_devel_filtering',
+    FILTER_FREE: '_do_free_filtering',
+    FILTER_NOT_FREE: '_do_free_filtering',
+    FILTER_ARCH: '_do_arch_filtering',
+    FILTER_NOT_ARCH: '_do_arch_filtering',
+}
+
+# filters a bulk hook can answer, to the hook and the value it wants
+_BULK_FILTERS = {
+    FILTER_GUI: ('_pkgs_is_gui', True),
+    FILTER_NOT_GUI: ('_pkgs_is_gui', False),
+    FILTER_DEVELOPMENT: ('_pkgs_is_devel', True),
+    FILTER_NOT_DEVELOPMENT: ('_pkgs_is_devel', False),
+    FILTER_FREE: ('_pkgs_is_free', True),
+    FILTER_NOT_FREE: ('_pkgs_is_free', False),
+    FILTER_ARCH: ('_pkgs_is_arch', True),
+    FILTER_NOT_ARCH: ('_pkgs_is_arch', False),
+    FILTER_INSTALLED: ('_pkgs_is_installed', True),
+    FILTER_NOT_INSTALLED: ('_pkgs_is_installed', False),
+}
+
+def _is_installed_or_older(compare, pkg, installed_pkgs):
+    ''' True if pkg is the same as or a downgrade to an installed package '''
+    for pkg_tmp in installed_pkgs:
+        rc = compare(pkg, pkg_tmp)
+        if rc == 0 or rc == -1:
+            return True
+    return False
+
+class PackagekitFilter(PackagekitPackage, object):
 
     def __init__(self, fltlist="none"):
         ''' save state '''
         self.fltlist = fltlist
-        self.package_list = [] #we can't do emitting as found if we are post-processing
+        self.package_list = [] #we can't do emitting as found if we are post-processing, see stream()
         self.installed_unique = {}
+        # memoised _pkg_version_key() of each package
+        self._version_keys = {}
+        # a PackagekitPackageTable, see add_table()
+        self.table = None
 
     def add_installed(self, pkgs):
         ''' add a list of packages that are already installed '''
@@ -45,8 +85,76 @@ class PackagekitFilter(object, PackagekitPackage):
         ''' add a custom packages indervidually '''
         self.package_list.append((pkg, info))
 
+    def add_table(self, table):
+        '''
+        Filter the packages of a PackagekitPackageTable as vectorised masks,
+        instead of packages added one by one, see table.py
+        '''
+        self.table = table
+
+    def can_stream(self):
+        '''
+        Returns True if the filters in use can be applied to one package at
+        a time, which isn't the case when packages are compared to each
+        other (newest, downgrades of installed packages) or post-processed
+        '''
+        if FILTER_NEWEST in self.fltlist or self.table is not None:
+            return False
+        for name in ('_get_package_list', '_pkg_compare', '_pkg_version_key', 'post_process'):
+            if self._overrides(name):
+                return False
+        return True
+
+    def _overrides(self, name):
+        ''' True if the sub class implements the named method '''
+        return getattr(type(self), name) != getattr(PackagekitFilter, name)
+
+    def stream(self, pkgs):
+        '''
+        Filter (pkg, info) tuples as they come, yielding those that pass
+        If the filters can't be streamed the packages are added to the list
+        instead, and come out of get_package_list() as usual. So either way:
+
+            for pkg, info in fltr.stream_installed(installed):
+                ...
+            for pkg, info in fltr.stream_available(available):
+                ...
+            for pkg, info in fltr.get_package_list():
+                ...
+
+        Packages to be added are added straight away, so they are kept even
+        if the result isn't iterated over; streamed ones are only filtered
+        as it is.
+        '''
+        if not self.can_stream():
+            self.package_list.extend(pkgs)
+            return iter(())
+        return self._stream(pkgs)
+
+    def _stream(self, pkgs):
+        base, installed = self._compile()
+        predicates = base + installed
+        for pkg, info in pkgs:
+            for predicate in predicates:
+                if not predicate(pkg):
+                    break
+            else:
+                yield pkg, info
+
+    def stream_installed(self, pkgs):
+        ''' stream() for a list of packages that are already installed '''
+        return self.stream((pkg, INFO_INSTALLED) for pkg in pkgs)
+
+    def stream_available(self, pkgs):
+        ''' stream() for a list of packages that are available '''
+        return self.stream((pkg, INFO_AVAILABLE) for pkg in pkgs)
+
     def _filter_base(self, pkg):
-        ''' do extra filtering (gui, devel etc) '''
+        '''
+        do extra filtering (gui, devel etc)
+        A sub class overriding this checks all of these filters with it,
+        in place of the one method per filter get_package_list() uses
+        '''
         for flt in self.fltlist:
             if flt in (FILTER_GUI, FILTER_NOT_GUI):
                 if not self._do_gui_filtering(flt, pkg):
@@ -63,7 +171,11 @@ class PackagekitFilter(object, PackagekitPackage):
         return True
 
     def _filter_installed(self, pkg):
-        ''' do extra filtering (gui, devel etc) '''
+        '''
+        do extra filtering (installed or not)
+        Like _filter_base(), used in place of the per filter checks when
+        a sub class overrides it
+        '''
         for flt in self.fltlist:
             if flt in (FILTER_INSTALLED, FILTER_NOT_INSTALLED):
                 if not self._do_installed_filtering(flt, pkg):
@@ -74,52 +186,163 @@ class PackagekitFilter(object, PackagekitPackage):
         '''
         do filtering we couldn't do when generating the list
         '''
+        count = len(self.package_list) if self.table is None else len(self.table)
+        with trace_span('get_package_list', 'filter', packages=count):
+            return self._get_package_list()
 
-        # filter common things here like architecture
-        # NOTE: we can't do installed and ~installed here as we need
-        # this data for the newest and downgrade checks below
-        package_list = self.package_list
-        self.package_list = []
-        for pkg, state in package_list:
-            if self._filter_base(pkg):
-                self.package_list.append((pkg, state))
+    def _compile(self, skip=()):
+        '''
+        Turn fltlist into the predicates a package has to pass
+        Returns a tuple of (base predicates, installed predicates), the
+        installed ones need the whole list and are checked last
+        @param skip: filters to leave out, e.g. those checked in bulk
+        '''
+        base = []
+        installed = []
+        own_base = self._overrides('_filter_base')
+        own_installed = self._overrides('_filter_installed')
+        if own_base:
+            base.append(self._filter_base)
+        if own_installed:
+            installed.append(self._filter_installed)
+        for flt in self.fltlist:
+            if flt in skip:
+                continue
+            method = _BASE_FILTERS.get(flt)
+            if method is not None:
+                if not own_base:
+                    base.append(functools.partial(getattr(self, method), flt))
+            elif flt in (FILTER_INSTALLED, FILTER_NOT_INSTALLED):
+                if not own_installed:
+                    installed.append(functools.partial(self._do_installed_filtering, flt))
+        return base, installed
+
+    def _bulk_filters(self):
+        '''
+        Returns the filters in fltlist that a _pkgs_is_*() hook of the sub
+        class answers, as a list of (filter, hook, wanted value) tuples
+        '''
+        bulk = []
+        # filters left to an overridden _filter_base() or _filter_installed()
+        own = set()
+        if self._overrides('_filter_base'):
+            own.update(_BASE_FILTERS)
+        if self._overrides('_filter_installed'):
+            own.update((FILTER_INSTALLED, FILTER_NOT_INSTALLED))
+        for flt in self.fltlist:
+            spec = _BULK_FILTERS.get(flt)
+            if spec is not None and flt not in own and self._overrides(spec[0]):
+                bulk.append((flt, getattr(self, spec[0]), spec[1]))
+        return bulk
 
-        # prepare lookup table of installed packages
+    def _filter_bulk(self, bulk, package_list):
+        '''
+        Returns the (pkg, state) tuples of package_list passing the bulk
+        filters, asking each hook once about all the packages left
+        '''
+        for flt, hook, want in bulk:
+            if not package_list:
+                break
+            flags = hook([pkg for pkg, state in package_list])
+            package_list = [entry for entry, flag in zip(package_list, flags) if bool(flag) == want]
+        return package_list
+
+    def _get_package_list(self):
+        if self.table is not None:
+            if self.package_list:
+                raise ValueError('packages were added both to the list and a table')
+            if not self._overrides('_filter_base') and not self._overrides('_filter_installed'):
+                self.package_list = self.table.filter(self)
+                return self.post_process()
+            # the overridden filters take one package at a time
+            self.package_list = self.table.rows()
+
+        bulk = self._bulk_filters()
+        bulk_base = [entry for entry in bulk if entry[0] not in (FILTER_INSTALLED, FILTER_NOT_INSTALLED)]
+        bulk_installed = [entry for entry in bulk if entry[0] in (FILTER_INSTALLED, FILTER_NOT_INSTALLED)]
+        base, installed = self._compile(skip=[entry[0] for entry in bulk])
+        get_name = self._pkg_get_name
+        version_key = None
+        if self._overrides('_pkg_version_key'):
+            version_key = self._version_key
+
+        # filter common things here like architecture, and prepare a lookup
+        # table of the installed packages left over, or with version keys
+        # just the newest installed version of each name
+        # NOTE: we can't do installed and ~installed here as we need
+        # this data for the downgrade check below
+        package_list = []
         installed_dict = collections.defaultdict(list)
-        for pkg, state in self.package_list:
-            if state is INFO_INSTALLED:
-                installed_dict[self._pkg_get_name(pkg)].append(pkg)
-
-        # check there are not available versions in the package list
-        # that are older than the installed version
-        package_list = self.package_list
+        newest_installed = {}
+        for pkg, state in self._filter_bulk(bulk_base, self.package_list):
+            for predicate in base:
+                if not predicate(pkg):
+                    break
+            else:
+                package_list.append((pkg, state))
+                if state is INFO_INSTALLED:
+                    name = get_name(pkg)
+                    if version_key is None:
+                        installed_dict[name].append(pkg)
+                    else:
+                        key = version_key(pkg)
+                        if name not in newest_installed or key > newest_installed[name]:
+                            newest_installed[name] = key
+
+        # the installed filters don't change the lookup table, so the bulk
+        # ones can go before the downgrade check
+        package_list = self._filter_bulk(bulk_installed, package_list)
+
+        compare = self._pkg_compare
         self.package_list = []
+        append = self.package_list.append
         for pkg, state in package_list:
-
-            add = True
-            if state is INFO_AVAILABLE:
-                for pkg_tmp in installed_dict[self._pkg_get_name(pkg)]:
-                    rc = self._pkg_compare(pkg, pkg_tmp)
-
-                    # don't add if the same as the installed package
-                    # or a downgrade to the existing installed package
-                    if rc == 0 or rc == -1:
-                        add = False
-                        break
-
-            if add:
-                self.package_list.append((pkg, state))
-
-        # filter installed state last
-        package_list = self.package_list
-        self.package_list = []
-        for pkg, state in package_list:
-            if self._filter_installed(pkg):
-                self.package_list.append((pkg, state))
+            for predicate in installed:
+                if not predicate(pkg):
+                    break
+            else:
+                # check there are not available versions in the package list
+                # that are older than the installed version
+                if state is INFO_AVAILABLE:
+                    name = get_name(pkg)
+                    if version_key is None:
+                        installed_pkgs = installed_dict.get(name)
+                        if installed_pkgs and _is_installed_or_older(compare, pkg, installed_pkgs):
+                            continue
+                    elif name in newest_installed and version_key(pkg) <= newest_installed[name]:
+                        continue
+                append((pkg, state))
+
+        if version_key is not None and FILTER_NEWEST in self.fltlist:
+            self.package_list = self._get_newest(self.package_list)
 
         # do the backend specific filtering
         return self.post_process()
 
+    def _version_key(self, pkg):
+        ''' _pkg_version_key(), computed once for each package '''
+        try:
+            return self._version_keys[pkg]
+        except KeyError:
+            key = self._version_keys[pkg] = self._pkg_version_key(pkg)
+            return key
+        except TypeError:
+            # packages that can't be hashed aren't memoised
+            return self._pkg_version_key(pkg)
+
+    def _get_newest(self, package_list):
+        '''
+        Keep only the newest version of each name, using version keys
+        '''
+        get_name = self._pkg_get_name
+        version_key = self._version_key
+        entries = [(get_name(pkg), version_key(pkg), pkg, state) for pkg, state in package_list]
+        newest = {}
+        for name, key, pkg, state in entries:
+            if name not in newest or key > newest[name]:
+                newest[name] = key
+        return [(pkg, state) for name, key, pkg, state in entries if key == newest[name]]
+
     def post_process(self):
         '''
         do filtering we couldn't do when generating the list
@@ -139,9 +362,25 @@ class PackagekitFilter(object, PackagekitPackage):
         '''
         return 2
 
+    def _pkg_version_key(self, pkg):
+        '''
+        Returns a key ordering the versions of packages with the same name,
+        e.g. a tuple of ints, parsed once and reused for every comparison.
+        When implemented it is used instead of _pkg_compare, and the newest
+        filter is applied too. Any two packages with the same _pkg_get_name()
+        are then taken to be comparable, so whatever _pkg_compare() would
+        return -2 for has to be part of the name, e.g. the slot as in
+        "dev-lang/python:3.12", or an installed package in one slot hides
+        the available ones of another.
+        Optionally implemented in a sub class
+        '''
+        return None
+
     def _pkg_get_name(self, pkg):
         '''
         Returns the name of the package used for duplicate filtering
+        With _pkg_version_key() it has to tell apart packages that can't be
+        compared, e.g. those in different slots
         Needed to be implemented in a sub class
         '''
         return None
@@ -181,6 +420,44 @@ class PackagekitFilter(object, PackagekitPackage):
         '''
         return True
 
+    def _pkgs_is_installed(self, pkgs):
+        '''
+        Return a list of booleans, _pkg_is_installed() of each package
+        Optionally implemented in a sub class that can answer for many
+        packages at once, e.g. with one database query; get_package_list()
+        then uses it instead of _pkg_is_installed(). stream() still checks
+        one package at a time, so _pkg_is_installed() is needed as well.
+        '''
+        return [self._pkg_is_installed(pkg) for pkg in pkgs]
+
+    def _pkgs_is_devel(self, pkgs):
+        '''
+        Return a list of booleans, _pkg_is_devel() of each package
+        Optionally implemented in a sub class, see _pkgs_is_installed()
+        '''
+        return [self._pkg_is_devel(pkg) for pkg in pkgs]
+
+    def _pkgs_is_gui(self, pkgs):
+        '''
+        Return a list of booleans, _pkg_is_gui() of each package
+        Optionally implemented in a sub class, see _pkgs_is_installed()
+        '''
+        return [self._pkg_is_gui(pkg) for pkg in pkgs]
+
+    def _pkgs_is_free(self, pkgs):
+        '''
+        Return a list of booleans, _pkg_is_free() of each package
+        Optionally implemented in a sub class, see _pkgs_is_installed()
+        '''
+        return [self._pkg_is_free(pkg) for pkg in pkgs]
+
+    def _pkgs_is_arch(self, pkgs):
+        '''
+        Return a list of booleans, _pkg_is_arch() of each package
+        Optionally implemented in a sub class, see _pkgs_is_installed()
+        '''
+        return [self._pkg_is_arch(pkg) for pkg in pkgs]
+
     def _do_installed_filtering(self, flt, pkg):
         is_installed = self._pkg_is_installed(pkg)
         if flt == FILTER_INSTALLED:
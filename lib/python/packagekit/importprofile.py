@@ -0,0 +1,149 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Import-time profile of python backend helpers
+#
+# Shows what a helper imports before it can run its first command, as a
+# tree with the time spent in each module and everything it imported:
+#
+#   python3 -m packagekit.importprofile /usr/share/PackageKit/helpers/portage/portageBackend.py
+#
+# The helper is loaded the way the daemon would run it, except that its
+# main() isn't called, in a fresh interpreter started with -X importtime.
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import argparse
+import subprocess
+
+class ImportNode(object):
+    ''' one imported module, with the times python reported in microseconds '''
+    def __init__(self, name, depth, self_time, total_time):
+        self.name = name
+        self.depth = depth
+        self.self_time = self_time
+        self.total_time = total_time
+        self.children = []
+
+def parse_importtime(output):
+    '''
+    Turn the -X importtime report into a tree
+    Returns the list of top level ImportNode, in import order
+    '''
+    stack = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+        try:
+            self_time = int(fields[0])
+            total_time = int(fields[1])
+        except ValueError:
+            # the header line
+            continue
+        # nesting is shown by two spaces per level after the first
+        name = fields[2].rstrip()
+        stripped = name.lstrip(' ')
+        node = ImportNode(stripped, (len(name) - len(stripped) - 1) // 2, self_time, total_time)
+
+        # a module is reported after everything it imported
+        children = []
+        while stack and stack[-1].depth > node.depth:
+            children.append(stack.pop())
+        children.reverse()
+        node.children = children
+        stack.append(node)
+    return stack
+
+def _loader_code(target):
+    if target.endswith('.py') or os.sep in target:
+        # not called __main__, so main() doesn't run
+        return ("import runpy; runpy.run_path(%r, run_name='__pk_import_profile__')" %
+                os.path.abspath(target))
+    return 'import %s' % target
+
+def profile_imports(target):
+    '''
+    Import a backend script or module in a new interpreter
+    Returns a tuple of (list of top level ImportNode, error output)
+    '''
+    env = dict(os.environ)
+    lib_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([lib_dir] + [p for p in [env.get('PYTHONPATH')] if p])
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', _loader_code(target)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, env=env)
+    stdout, stderr = proc.communicate()
+    report = []
+    errors = []
+    for line in stderr.splitlines():
+        if line.startswith('import time:'):
+            report.append(line)
+        else:
+            errors.append(line)
+    return parse_importtime('\n'.join(report)), '\n'.join(errors)
+
+def _walk(nodes):
+    for node in nodes:
+        yield node
+        for child in _walk(node.children):
+            yield child
+
+def print_tree(nodes, threshold=1000, indent=0, out=sys.stdout):
+    '''
+    @param threshold: leave out modules that took less than this many
+                      microseconds, including what they imported
+    '''
+    for node in nodes:
+        if node.total_time < threshold:
+            continue
+        print('%9.1f %9.1f  %s%s' % (node.total_time / 1000.0, node.self_time / 1000.0,
+                                    '  ' * indent, node.name), file=out)
+        print_tree(node.children, threshold, indent + 1, out)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Show the import time tree of python backend helpers')
+    parser.add_argument('targets', nargs='+', metavar='HELPER',
+                        help='path of a backend script, or a module name')
+    parser.add_argument('--threshold', type=float, default=1.0, metavar='MS',
+                        help='hide imports faster than this, in milliseconds')
+    parser.add_argument('--top', type=int, default=10, metavar='N',
+                        help='list the N modules slowest to import themselves')
+    options = parser.parse_args(args)
+
+    for target in options.targets:
+        nodes, errors = profile_imports(target)
+        total = sum(node.total_time for node in nodes)
+        print('%s: %.1f ms in %i modules' % (target, total / 1000.0, len(list(_walk(nodes)))))
+        print('%9s %9s  %s' % ('total ms', 'self ms', 'module'))
+        print_tree(nodes, options.threshold * 1000)
+        print()
+        print('slowest by self time:')
+        for node in sorted(_walk(nodes), key=lambda node: node.self_time, reverse=True)[:options.top]:
+            print('%9.1f  %s' % (node.self_time / 1000.0, node.name))
+        if errors:
+            print()
+            print('the helper failed to load:')
+            print(errors)
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Lazy imports for modules only some commands need
+#
+# A helper is spawned for every transaction, so whatever it imports at
+# the top is paid for by get-repo-list as much as by install-packages.
+# Modules only a few commands use can be imported on first use instead:
+#
+#   layman = lazy_import('layman')
+#   ...
+#   conf = layman.config.BareConfig()
+#
+# Submodules are imported on first access too. When tracing is on, each
+# import shows up as a span of its own.
+#
+
+import importlib
+
+from .diagnostics import trace_span
+
+class _LazyModule(object):
+    '''
+    Stands in for a module until one of its attributes is needed
+    '''
+
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_module'] = None
+
+    def _lazy_load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            name = self.__dict__['_lazy_name']
+            with trace_span(name, 'import'):
+                module = importlib.import_module(name)
+            self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        module = self._lazy_load()
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            # a submodule nobody has imported yet, e.g. layman.db
+            name = '%s.%s' % (module.__name__, attr)
+            try:
+                with trace_span(name, 'import'):
+                    submodule = importlib.import_module(name)
+            except ImportError as e:
+                if getattr(e, 'name', name) != name:
+                    raise
+                raise AttributeError("module '%s' has no attribute '%s'" %
+                                     (module.__name__, attr))
+            # wrapped again, its own submodules may not be imported either
+            lazy = _LazyModule(name)
+            lazy.__dict__['_lazy_module'] = submodule
+            self.__dict__[attr] = lazy
+            return lazy
+
+    def __setattr__(self, attr, value):
+        setattr(self._lazy_load(), attr, value)
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self.__dict__['_lazy_name']
+
+def lazy_import(name):
+    '''
+    Returns a stand-in for the named module that imports it on first use
+    @param name: the module name, e.g. "layman" or "entropy.services.client"
+    '''
+    return _LazyModule(name)
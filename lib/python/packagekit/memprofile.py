@@ -0,0 +1,182 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Opt-in memory profiling of python backend commands
+#
+# Set PK_BACKEND_MEMPROFILE to a file name to run every dispatched command
+# under tracemalloc. For each command the peak and the retained memory,
+# i.e. what is still allocated once the command has finished, are appended
+# to the file together with the allocation sites holding most of it.
+#
+# PK_BACKEND_MEMPROFILE_THRESHOLD sets the retained size in bytes above
+# which a warning is also written to stderr, PK_BACKEND_MEMPROFILE_TOP the
+# number of allocation sites listed and PK_BACKEND_MEMPROFILE_FRAMES the
+# depth of the stack stored for each allocation. Like tracing, this needs
+# KeepEnvironment=true in PackageKit.conf to reach the helper.
+#
+# tracemalloc only counts for the whole process, so one command is
+# measured at a time. Under async_dispatcher() a query starting while
+# another is measured runs unmeasured rather than waiting, which would
+# change the very concurrency being looked at; the file says so, and the
+# numbers of the measured one are marked as including the others.
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import threading
+
+from .diagnostics import MEMPROFILE_ENV
+
+THRESHOLD_ENV = 'PK_BACKEND_MEMPROFILE_THRESHOLD'
+TOP_ENV = 'PK_BACKEND_MEMPROFILE_TOP'
+FRAMES_ENV = 'PK_BACKEND_MEMPROFILE_FRAMES'
+
+DEFAULT_THRESHOLD = 16 * 1024 * 1024
+DEFAULT_TOP = 10
+DEFAULT_FRAMES = 1
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def _format_size(size):
+    if abs(size) < 1024:
+        return '%i B' % size
+    for unit in ('KiB', 'MiB', 'GiB'):
+        size /= 1024.0
+        if abs(size) < 1024 or unit == 'GiB':
+            return '%.1f %s' % (size, unit)
+
+class _NullProfile(object):
+    ''' what memory_profile() returns when profiling is off '''
+    def __enter__(self):
+        return self
+    def __exit__(self, typ, value, tb):
+        return False
+
+_NULL_PROFILE = _NullProfile()
+
+class _Profile(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.measured = profiler._lock.acquire(False)
+        if not self.measured:
+            profiler.skip(self.name)
+            return self
+        profiler._shared = False
+        # forget earlier blocks, so whatever is traced afterwards was
+        # allocated by this command and freeing older ones isn't counted
+        profiler.tracemalloc.clear_traces()
+        return self
+
+    def __exit__(self, typ, value, tb):
+        if not self.measured:
+            return False
+        try:
+            tracemalloc = self.profiler.tracemalloc
+            retained, peak = tracemalloc.get_traced_memory()
+            stats = tracemalloc.take_snapshot().statistics('lineno')
+            self.profiler.report(self.name, retained, peak, stats, self.profiler._shared)
+        finally:
+            self.profiler._lock.release()
+        return False
+
+class PackagekitMemoryProfiler(object):
+    '''
+    Measures each command with tracemalloc and logs what it allocated
+    '''
+
+    def __init__(self, path, threshold=DEFAULT_THRESHOLD, top=DEFAULT_TOP,
+                 frames=DEFAULT_FRAMES):
+        import tracemalloc
+        self.tracemalloc = tracemalloc
+        self.path = path
+        self.threshold = threshold
+        self.top = top
+        # held by the command being measured, the numbers are process wide
+        self._lock = threading.Lock()
+        # another command ran while the one measured did
+        self._shared = False
+        self._warned = False
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def profile(self, name):
+        '''
+        Returns a context manager measuring the memory used by the block
+        @param name: the command being run, e.g. "get-packages"
+        '''
+        return _Profile(self, name)
+
+    def skip(self, name):
+        ''' Note a command left unmeasured as another one was being measured '''
+        self._shared = True
+        if not self._warned:
+            self._warned = True
+            print('WARNING: memory profiling measures one command at a time, '
+                  'concurrent commands run unmeasured', file=sys.stderr)
+        with open(self.path, 'a') as f:
+            f.write('%s %s: not measured, ran alongside another command\n' %
+                    (time.strftime('%Y-%m-%d %H:%M:%S'), name))
+
+    def report(self, name, retained, peak, stats, shared=False):
+        lines = ['%s %s: peak %s, retained %s%s' %
+                 (time.strftime('%Y-%m-%d %H:%M:%S'), name,
+                  _format_size(peak), _format_size(retained),
+                  ', including concurrent commands' if shared else '')]
+        for stat in stats[:self.top]:
+            frame = stat.traceback[0]
+            lines.append('  %11i B %7i blocks  %s:%i' %
+                         (stat.size, stat.count, frame.filename, frame.lineno))
+        if retained > self.threshold:
+            warning = ('WARNING: %s retained %s after finishing (threshold %s)' %
+                       (name, _format_size(retained), _format_size(self.threshold)))
+            lines.append(warning)
+            print(warning, file=sys.stderr)
+        with open(self.path, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+
+_profiler = None
+_profiler_checked = False
+
+def get_memory_profiler():
+    ''' Returns the PackagekitMemoryProfiler of this process, or None '''
+    global _profiler, _profiler_checked
+    if not _profiler_checked:
+        path = os.environ.get(MEMPROFILE_ENV)
+        if path:
+            _profiler = PackagekitMemoryProfiler(path,
+                                                 _env_int(THRESHOLD_ENV, DEFAULT_THRESHOLD),
+                                                 _env_int(TOP_ENV, DEFAULT_TOP),
+                                                 _env_int(FRAMES_ENV, DEFAULT_FRAMES))
+        _profiler_checked = True
+    return _profiler
+
+def memory_profile(name):
+    ''' Measure the memory used by a block if PK_BACKEND_MEMPROFILE is set '''
+    profiler = get_memory_profiler()
+    if profiler is None:
+        return _NULL_PROFILE
+    return profiler.profile(name)
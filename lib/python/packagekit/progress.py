@@ -17,11 +17,21 @@
 # Copyright (C) 2008
 #    Richard Hughes <richard@hughsie.com>
 
+import threading
+
 try:
     from collections import Iterable
 except ImportError:
     from collections.abc import Iterable
 
+try:
+    from time import monotonic as _monotonic
+except ImportError:
+    from time import time as _monotonic
+
+# default maximum number of updates per second for each progress signal
+DEFAULT_PROGRESS_RATE = 10
+
 
 class PackagekitProgress(Iterable):
     '''
@@ -98,3 +108,96 @@ class PackagekitProgress(Iterable):
         incr = endpct -startpct
         self.percent = startpct + incr
 
+class PackagekitProgressCoalescer(object):
+    '''
+    Rate limits progress signals, so backends can report progress from
+    tight download callbacks without flooding the daemon.
+
+    Updates for a key are held back when they arrive less than 1/rate
+    seconds after the last one that was sent, unless they are final (e.g.
+    100%). The latest one held back is pending until take_pending(), which
+    the backend calls before it sends its next signal, so the daemon never
+    stays at an older value. Values that don't change, or go backwards for
+    a monotonic signal, are always dropped. The first update for a new item
+    (e.g. the next package of an item-progress sequence) is always sent.
+    '''
+
+    def __init__(self, rate=DEFAULT_PROGRESS_RATE):
+        self.set_rate(rate)
+        self._state = {}
+        # key to (value, item) of the latest update held back, checked
+        # without the lock before every signal
+        self.pending = {}
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        '''
+        @param rate: maximum updates per second and key, 0 for no limit
+        '''
+        if rate:
+            self.interval = 1.0 / rate
+        else:
+            self.interval = 0.0
+
+    def reset(self, scope=None):
+        '''
+        Forget the last values, so the next update of each key is sent
+        @param scope: only forget the keys starting with this, e.g. a request id
+        '''
+        with self._lock:
+            for key in list(self._state.keys()):
+                if key[0] == scope:
+                    del self._state[key]
+            for key in list(self.pending.keys()):
+                if key[0] == scope:
+                    del self.pending[key]
+
+    def take_pending(self, scope):
+        '''
+        Returns the updates of scope held back, as a list of (signal name,
+        value, item) tuples, and counts them as sent
+        @param scope: the first element of the keys, e.g. a request id
+        '''
+        now = _monotonic()
+        taken = []
+        with self._lock:
+            for key in list(self.pending.keys()):
+                if key[0] != scope:
+                    continue
+                value, item = self.pending.pop(key)
+                state = self._state.get(key)
+                if state is not None and state[1] == item:
+                    state[0] = now
+                    state[2] = value
+                taken.append((key[1], value, item))
+        return taken
+
+    def update(self, key, value, item=None, monotonic=True, final=False):
+        '''
+        Returns True if the update should be sent to the daemon
+        @param key: a tuple of (scope, signal name)
+        @param value: the new value
+        @param item: what the value is about, e.g. a package_id
+        @param monotonic: drop values lower than the last one sent
+        @param final: send regardless of the rate, if the value changed
+        '''
+        now = _monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None or state[1] != item:
+                self._state[key] = [now, item, value]
+                return True
+            last_time, last_item, last_value = state
+            if value == last_value:
+                # back to what the daemon has, nothing to catch up on
+                self.pending.pop(key, None)
+                return False
+            if monotonic and value < last_value:
+                return False
+            if not final and now - last_time < self.interval:
+                self.pending[key] = (value, item)
+                return False
+            state[0] = now
+            state[2] = value
+            self.pending.pop(key, None)
+            return True
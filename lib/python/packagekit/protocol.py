@@ -0,0 +1,154 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Wire encodings spoken between a python backend and pk-backend-spawn
+#
+# The text protocol is the default: one signal per line, fields split by
+# tabs, with newlines in free text escaped to ';' by the backend.
+#
+# The framed protocol is experimental: pk-backend-spawn doesn't negotiate
+# or parse it yet, so a helper only accepts it with PK_BACKEND_FRAMED=1 in
+# its environment, e.g. for tests/benchmarks/bench-protocol.py. It is
+# switched on by sending the command "protocol\tframed" to the dispatcher.
+# The dispatcher answers with the text line "protocol\tframed" and every
+# signal after that is one record:
+#
+#   u32 record length
+#   u32 number of fields
+#   u32 length of each field
+#   the field bytes, concatenated
+#
+# where all integers are big endian and the first field is the signal
+# name. Field bytes are carried raw, so tabs and newlines need no
+# escaping. The file list of a files signal is one field with the names
+# separated by NUL, which can't appear in a path. A helper that doesn't
+# know the command, or doesn't have the framed protocol enabled, answers
+# with an error and finished, and the text protocol stays in use. While
+# the framed protocol is in use the helper points its file descriptor 1
+# at stderr, so a stray print() can't corrupt a record, and writes the
+# records to a copy of the original stdout.
+#
+# Independently of the encoding, the dispatcher can be put in pipelined
+# mode with the command "pipeline\ttrue", answered by "pipeline\ttrue".
+# Every following command line then starts with a request id chosen by
+# the daemon, "<id>\t<command>\t<args>", and every signal emitted for
+# that command, including finished, carries the id as an extra first
+# field. The daemon can write several commands without waiting for the
+# finished of the previous one; they are run in order. While pipelined
+# queries run under async_dispatcher(), the line "cancel\t<id>" cancels
+# one of them, see cancel.py; "cancel" is therefore not a valid id.
+#
+# Large batches of signals, e.g. the files of a big package or a chunk of
+# get-packages output, can skip the pipe once the daemon sends the command
+# "side-channel\t<directory>", answered by "side-channel\t<directory>".
+# Any write of at least DEFAULT_SIDE_CHANNEL_THRESHOLD bytes is then put
+# in a new file in that directory, ideally on a tmpfs, and replaced by the
+# signal "side-channel\t<path>\t<size>". The file holds exactly the bytes
+# that would have gone down the pipe, in the protocol in use and tagged
+# as usual, so the daemon maps it, parses it in place and must unlink it
+# once read. The side-channel signal itself is never tagged.
+# "side-channel\tnone" turns this off again. Once its signal is written
+# a file is the daemon's to unlink, even when it comes from a command that
+# failed or was cancelled; the helper only removes a file whose signal it
+# couldn't write.
+# Like the framed protocol this is experimental, pk-backend-spawn doesn't
+# read the files yet, and only accepted with PK_BACKEND_SIDE_CHANNEL=1.
+#
+
+import struct
+
+PROTOCOL_TEXT = 'text'
+PROTOCOL_FRAMED = 'framed'
+PROTOCOLS = (PROTOCOL_TEXT, PROTOCOL_FRAMED)
+
+# opt-ins for the experimental framed protocol and side channel
+FRAMED_ENV = 'PK_BACKEND_FRAMED'
+SIDE_CHANNEL_ENV = 'PK_BACKEND_SIDE_CHANNEL'
+
+_LENGTH = struct.Struct('!I')
+_signal_names = {}
+
+def signal_name(template):
+    ''' Returns the signal name of a text template, e.g. b"package" '''
+    try:
+        return _signal_names[template]
+    except KeyError:
+        name = template.split(b'\t', 1)[0].rstrip(b'\n')
+        _signal_names[template] = name
+        return name
+
+def encode_text(template, fields, tag=None):
+    '''
+    Encode one signal as a text protocol line
+    @param tag: request id to prefix the line with, as bytes
+    '''
+    if tag is not None:
+        return tag + b'\t' + template % fields
+    return template % fields
+
+def encode_framed(template, fields, tag=None):
+    '''
+    Encode one signal as a framed protocol record
+    @param tag: request id to send as the first field, as bytes
+    '''
+    if tag is not None:
+        parts = [tag, signal_name(template)]
+    else:
+        parts = [signal_name(template)]
+    for field in fields:
+        if not isinstance(field, bytes):
+            field = b'%i' % field
+        parts.append(field)
+    lengths = [len(part) for part in parts]
+    count = len(parts)
+    header = struct.pack('!%iI' % (count + 2), (count + 1) * _LENGTH.size + sum(lengths),
+                         count, *lengths)
+    return header + b''.join(parts)
+
+def decode_text(data):
+    '''
+    Split text protocol output into records
+    Returns a tuple of (list of field lists, unparsed trailing bytes)
+    '''
+    lines = data.split(b'\n')
+    remainder = lines.pop()
+    return [line.split(b'\t') for line in lines], remainder
+
+def decode_framed(data):
+    '''
+    Split framed protocol output into records
+    Returns a tuple of (list of field lists, unparsed trailing bytes)
+    '''
+    unpack_from = _LENGTH.unpack_from
+    size = _LENGTH.size
+    records = []
+    offset = 0
+    end = len(data)
+    while end - offset >= size:
+        length = unpack_from(data, offset)[0]
+        if end - offset - size < length:
+            break
+        record_end = offset + size + length
+        count = unpack_from(data, offset + size)[0]
+        lengths = struct.unpack_from('!%iI' % count, data, offset + 2 * size)
+        offset += (count + 2) * size
+        fields = []
+        for field_length in lengths:
+            fields.append(data[offset:offset + field_length])
+            offset += field_length
+        records.append(fields)
+        offset = record_end
+    return records, data[offset:]
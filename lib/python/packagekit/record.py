@@ -0,0 +1,153 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Opt-in capture of everything a python backend is asked and answers
+#
+# Set PK_BACKEND_RECORD to a file name to record the command line the
+# helper was started with, every command line read from stdin and every
+# write of signals meant for the daemon, each with the time in seconds
+# since the helper started. The capture can be played back by
+# packagekit.replay, standing in for the helper without the distro.
+#
+# Like traces, captures are per process: the pid of the helper is
+# appended to the file name, e.g. /tmp/pk.capture.1234, and a child
+# forked by a zygote opens its own file after the fork.
+#
+# A capture is a header line followed by one record per event:
+#
+#   <seconds>\t<kind>\t<size>\n<size bytes of data>\n
+#
+# where kind is "argv" for the tab separated command line arguments,
+# "stdin" for a command line without its newline, or "stdout" for
+# signals exactly as they were encoded, in the protocol in use then.
+#
+
+import os
+import atexit
+import threading
+
+try:
+    from time import monotonic as _monotonic
+except ImportError:
+    from time import time as _monotonic
+
+from . import diagnostics
+from .diagnostics import RECORD_ENV
+
+CAPTURE_HEADER = b'# PackageKit helper capture 1\n'
+
+RECORD_ARGV = 'argv'
+RECORD_STDIN = 'stdin'
+RECORD_STDOUT = 'stdout'
+
+class PackagekitRecorder(object):
+    '''
+    Appends timestamped records to a capture file
+    '''
+
+    def __init__(self, path):
+        '''
+        @param path: the file name, the pid is appended to it
+        '''
+        self.path = '%s.%i' % (path, os.getpid())
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'wb')
+        self._file.write(CAPTURE_HEADER)
+
+    def record(self, kind, data):
+        '''
+        @param kind: RECORD_ARGV, RECORD_STDIN or RECORD_STDOUT
+        @param data: what was read or written, as bytes
+        '''
+        now = _monotonic() - diagnostics.start_time
+        with self._lock:
+            self._file.write(b'%.6f\t%s\t%i\n' % (now, kind.encode('ascii'), len(data)))
+            self._file.write(data)
+            self._file.write(b'\n')
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+def read_capture(path):
+    '''
+    Read a capture written by PackagekitRecorder
+    Returns a list of (seconds, kind, data) tuples, in the order recorded
+    '''
+    records = []
+    with open(path, 'rb') as f:
+        if f.readline() != CAPTURE_HEADER:
+            raise ValueError('%s is not a helper capture' % path)
+        while True:
+            header = f.readline()
+            if not header:
+                break
+            try:
+                seconds, kind, size = header.rstrip(b'\n').split(b'\t')
+                seconds = float(seconds)
+                size = int(size)
+            except ValueError:
+                raise ValueError('%s: bad record %r' % (path, header))
+            data = f.read(size)
+            if len(data) != size or f.read(1) != b'\n':
+                # the helper was killed in the middle of a write
+                break
+            records.append((seconds, kind.decode('ascii'), data))
+    return records
+
+_recorder = None
+_recorder_checked = False
+
+def get_recorder():
+    ''' Returns the PackagekitRecorder of this process, or None if not recording '''
+    global _recorder, _recorder_checked
+    if not _recorder_checked:
+        path = os.environ.get(RECORD_ENV)
+        if path:
+            _recorder = PackagekitRecorder(path)
+            atexit.register(_recorder.flush)
+        _recorder_checked = True
+    return _recorder
+
+def _before_fork():
+    # nothing buffered may be written twice, by the parent and the child
+    if _recorder is not None:
+        _recorder.flush()
+
+def _after_fork():
+    global _recorder, _recorder_checked
+    _recorder = None
+    _recorder_checked = False
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork, after_in_child=_after_fork)
+
+def record_argv(args):
+    ''' Record the command line arguments the helper was started with '''
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.record(RECORD_ARGV, '\t'.join(args).encode('utf-8'))
+
+def record_command(line):
+    ''' Record a command line read from stdin, without its newline '''
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.record(RECORD_STDIN, line.encode('utf-8'))
+
+def flush_record():
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.flush()
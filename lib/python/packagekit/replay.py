@@ -0,0 +1,105 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Fake helper playing back a capture recorded with PK_BACKEND_RECORD
+#
+# Replays the signals of a real helper without its distro, to benchmark
+# the daemon's parsing or a client's rendering, like the hand written
+# tests/data/pk-spawn-test-profiling.sh but with real output:
+#
+#   python3 -m packagekit.replay search-name.capture
+#   python3 -m packagekit.replay --max-speed search-name.capture
+#
+# Like the helper, it waits for each command it was sent when recording
+# before answering it, so it can stand in for a dispatcher that is kept
+# running. The command lines it reads aren't compared with the capture.
+# Writes are spaced as they were recorded, relative to the command they
+# answer, or sent as fast as possible with --max-speed.
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+
+try:
+    from time import monotonic as _monotonic
+except ImportError:
+    from time import time as _monotonic
+
+from .record import read_capture, RECORD_STDIN, RECORD_STDOUT
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def replay(records, speed=1.0, stdin=None, stdout=None):
+    '''
+    Play back the records of a capture
+    @param speed: how much faster than recorded to go, 0 for no waiting
+    @param stdin: file object to read commands from, None to not wait for them
+    @param stdout: file descriptor to write signals to, stdout by default
+    Returns the number of bytes written
+    '''
+    if stdout is None:
+        stdout = sys.stdout.fileno()
+    written = 0
+    # when the last command was recorded, and when it was read now
+    recorded_base = 0.0
+    base = _monotonic()
+    for seconds, kind, data in records:
+        if kind == RECORD_STDIN:
+            if stdin is not None and not stdin.readline():
+                # the daemon closed the pipe, nothing more to answer
+                break
+            recorded_base = seconds
+            base = _monotonic()
+        elif kind == RECORD_STDOUT:
+            if speed > 0:
+                delay = base + (seconds - recorded_base) / speed - _monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            _write_all(stdout, data)
+            written += len(data)
+    return written
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Play back a python backend capture as a fake helper')
+    parser.add_argument('capture', help='file recorded with PK_BACKEND_RECORD')
+    parser.add_argument('--speed', type=float, default=1.0, metavar='FACTOR',
+                        help='play back this many times faster than recorded')
+    parser.add_argument('--max-speed', action='store_true',
+                        help='write everything as fast as possible')
+    parser.add_argument('--no-wait', action='store_true',
+                        help="don't wait for the recorded commands on stdin")
+    options = parser.parse_args(args)
+
+    try:
+        records = read_capture(options.capture)
+    except (IOError, OSError, ValueError) as e:
+        print('cannot read capture: %s' % str(e), file=sys.stderr)
+        sys.exit(1)
+    speed = 0 if options.max_speed else options.speed
+    stdin = None if options.no_wait else sys.stdin
+    start = _monotonic()
+    written = replay(records, speed, stdin)
+    print('replayed %i bytes in %.3f s' % (written, _monotonic() - start), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
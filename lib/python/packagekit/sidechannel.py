@@ -0,0 +1,76 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Side channel for large batches of signals, see protocol.py
+#
+
+import os
+
+# batches smaller than this go down the pipe as usual
+DEFAULT_SIDE_CHANNEL_THRESHOLD = 256 * 1024
+
+class PackagekitSideChannel(object):
+    '''
+    Moves large writes out of the pipe into files in a directory chosen
+    by the daemon, normally on a tmpfs such as /run, and replaces them
+    with a short side-channel signal naming the file.
+    '''
+
+    def __init__(self, directory, encode, threshold=DEFAULT_SIDE_CHANNEL_THRESHOLD):
+        '''
+        @param directory: where to create the files, the daemon removes
+                          each once it has read it
+        @param encode: function encoding the side-channel signal, with the
+                       arguments of protocol.encode_text()
+        @param threshold: smallest write in bytes worth a file
+        '''
+        self.directory = directory
+        self.encode = encode
+        self.threshold = threshold
+
+    def check(self):
+        ''' Raises OSError if no files can be created in the directory '''
+        import tempfile
+        fd, path = tempfile.mkstemp(prefix='pk-', dir=self.directory)
+        os.close(fd)
+        os.unlink(path)
+
+    def divert(self, data):
+        '''
+        Write data to a new file
+        Returns the path of the file and the signal to send in its place,
+        as bytes. Once that signal is written the file is the daemon's; if
+        it can't be, the writer has to discard() the file.
+        '''
+        import tempfile
+        fd, path = tempfile.mkstemp(prefix='pk-', dir=self.directory)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        except:
+            os.close(fd)
+            os.unlink(path)
+            raise
+        os.close(fd)
+        return path, self.encode(b"side-channel\t%s\t%i\n", (path.encode('utf-8'), len(data)), None)
+
+    def discard(self, path):
+        ''' Remove a file whose signal never made it to the daemon '''
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
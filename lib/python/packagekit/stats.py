@@ -0,0 +1,82 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# What a running helper has done, for the stats command
+#
+# The command "stats" answers with one line per value, then finished:
+#
+#   stats\thelper\tuptime\t<seconds>
+#   stats\thelper\trss\t<bytes>
+#   stats\tcommand\t<name>\tcalls=<n> errors=<n> total-ms=<ms> mean-ms=<ms>
+#   stats\tsignal\t<name>\tcount=<n> bytes=<n>
+#   stats\tcache\t<name>\thits=<n> misses=<n> stores=<n>
+#   stats\tcounter\t<name>\t<value>
+#
+# The same report is written to stderr on SIGUSR2, which the daemon
+# logs, so a helper can be looked at without changing its stdin.
+#
+
+import threading
+
+try:
+    from time import monotonic as _monotonic
+except ImportError:
+    from time import time as _monotonic
+
+class PackagekitStats(object):
+    '''
+    Counters kept since the helper started, the signals are counted by
+    PackagekitSignalWriter
+    '''
+
+    def __init__(self, start_time=None):
+        '''
+        @param start_time: when the helper started, as time.monotonic()
+        '''
+        if start_time is None:
+            start_time = _monotonic()
+        self.start_time = start_time
+        # reentrant, the SIGUSR2 handler may interrupt an update
+        self._lock = threading.RLock()
+        self._counters = {}
+        self._caches = {}
+
+    def increment(self, name, value=1):
+        '''
+        Add to a counter of the backend's own, e.g. "vardb-reloads"
+        '''
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def register_cache(self, name, cache):
+        '''
+        Report the hits, misses and stores attributes of a cache
+        '''
+        self._caches[name] = cache
+
+    def uptime(self):
+        return _monotonic() - self.start_time
+
+    def get_counters(self):
+        ''' Returns (name, value) for each counter, by name '''
+        with self._lock:
+            return sorted(self._counters.items())
+
+    def get_caches(self):
+        ''' Returns (name, hits, misses, stores) for each registered cache '''
+        return [(name, getattr(cache, 'hits', 0), getattr(cache, 'misses', 0),
+                 getattr(cache, 'stores', 0))
+                for name, cache in sorted(self._caches.items())]
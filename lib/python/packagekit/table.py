@@ -0,0 +1,263 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Columnar package table for PackagekitFilter, needs NumPy
+#
+# For results spanning whole repositories a backend can fill a table in
+# bulk instead of calling add_installed() and add_available() for every
+# package, and the filters are evaluated as masks over its columns:
+#
+#   table = PackagekitPackageTable()
+#   table.add(installed, INFO_INSTALLED, names, gui=..., versions=...)
+#   table.add(available, INFO_AVAILABLE, names, gui=..., versions=...)
+#   fltr.add_table(table)
+#   for pkg, info in fltr.get_package_list():
+#       ...
+#
+# A column left out is worked out with the _pkgs_is_*() or _pkg_is_*()
+# method of the filter, and only for the rows the other filters left.
+#
+# Versions are numbers ordering the versions of packages with the same
+# name, e.g. the rank of their version keys. Like with _pkg_version_key()
+# the names have to tell apart packages that can't be compared, e.g. by
+# slot. With versions the downgrade check is a mask too, without them the
+# rows left go through _pkg_version_key() or _pkg_compare() as usual. As
+# for packages added to the list, the newest filter is only applied for a
+# filter implementing _pkg_version_key() and otherwise left to the backend.
+#
+# A filter overriding _filter_base() or _filter_installed() gets the rows
+# one at a time, like packages added to its list.
+#
+
+from .enums import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# each filter, to the column it looks at and the value it wants
+_FILTER_COLUMNS = {
+    FILTER_GUI: ('gui', True),
+    FILTER_NOT_GUI: ('gui', False),
+    FILTER_DEVELOPMENT: ('devel', True),
+    FILTER_NOT_DEVELOPMENT: ('devel', False),
+    FILTER_FREE: ('free', True),
+    FILTER_NOT_FREE: ('free', False),
+    FILTER_ARCH: ('arch', True),
+    FILTER_NOT_ARCH: ('arch', False),
+    FILTER_INSTALLED: ('installed', True),
+    FILTER_NOT_INSTALLED: ('installed', False),
+}
+
+# where the values of a column come from when a backend leaves it out
+_COLUMN_METHODS = {
+    'gui': '_pkg_is_gui',
+    'devel': '_pkg_is_devel',
+    'free': '_pkg_is_free',
+    'arch': '_pkg_is_arch',
+    'installed': '_pkg_is_installed',
+}
+
+class PackagekitPackageTable(object):
+    '''
+    Packages and their properties, stored as one array per property
+    '''
+
+    def __init__(self):
+        if numpy is None:
+            raise ImportError('PackagekitPackageTable needs NumPy')
+        self.pkgs = []
+        self._name_ids = {}
+        self._info_ids = {}
+        # the arrays of each add(), joined when filtering
+        self._chunks = []
+
+    def __len__(self):
+        return len(self.pkgs)
+
+    def add(self, pkgs, info, names, versions=None, **columns):
+        '''
+        Append packages that share an info, e.g. all the installed ones
+        @param pkgs: the package objects, as get_package_list() returns them
+        @param info: the enumerated INFO_* of all the packages
+        @param names: the name of each package
+        @param versions: a number for each package ordering the versions
+                         of packages with the same name, higher is newer;
+                         only used for the newest filter if the filter
+                         implements _pkg_version_key() too
+        @param columns: gui, devel, free, arch or installed, each either a
+                        boolean for every package or one for all of them
+        '''
+        pkgs = list(pkgs)
+        count = len(pkgs)
+        name_ids = self._name_ids
+        chunk = {
+            'name': numpy.fromiter((name_ids.setdefault(name, len(name_ids)) for name in names),
+                                   dtype=numpy.int64, count=count),
+            'info': numpy.full(count, self._info_ids.setdefault(info, len(self._info_ids)),
+                               dtype=numpy.int16),
+        }
+        if versions is not None:
+            chunk['versions'] = numpy.asarray(versions, dtype=numpy.float64).reshape(count)
+        for column, values in columns.items():
+            if column not in _COLUMN_METHODS:
+                raise TypeError("unknown column '%s'" % column)
+            if isinstance(values, bool):
+                chunk[column] = numpy.full(count, values, dtype=bool)
+            else:
+                chunk[column] = numpy.asarray(values, dtype=bool).reshape(count)
+        self.pkgs.extend(pkgs)
+        self._chunks.append((count, chunk))
+
+    def _join(self, column):
+        '''
+        Returns a tuple of (values, known) for all rows, where known is None
+        if every row has a value, or None for the values if none has
+        '''
+        given = [chunk[column] for count, chunk in self._chunks if column in chunk]
+        if not given:
+            return None, None
+        values = []
+        known = []
+        for count, chunk in self._chunks:
+            if column in chunk:
+                values.append(chunk[column])
+                known.append(numpy.ones(count, dtype=bool))
+            else:
+                values.append(numpy.zeros(count, dtype=given[0].dtype))
+                known.append(numpy.zeros(count, dtype=bool))
+        known = numpy.concatenate(known)
+        return numpy.concatenate(values), None if known.all() else known
+
+    def _column(self, fltr, column, mask):
+        ''' the values of a column, asking fltr for the rows in mask not given '''
+        values, known = self._join(column)
+        if values is None:
+            values = numpy.zeros(len(self.pkgs), dtype=bool)
+            missing = mask
+        elif known is None:
+            return values
+        else:
+            missing = mask & ~known
+        rows = numpy.flatnonzero(missing).tolist()
+        pkgs = self.pkgs
+        hook = _COLUMN_METHODS[column].replace('_pkg_', '_pkgs_', 1)
+        if fltr._overrides(hook):
+            flags = getattr(fltr, hook)([pkgs[i] for i in rows])
+        else:
+            method = getattr(fltr, _COLUMN_METHODS[column])
+            flags = [method(pkgs[i]) for i in rows]
+        values[rows] = numpy.fromiter((bool(flag) for flag in flags), dtype=bool, count=len(rows))
+        return values
+
+    def rows(self):
+        ''' Returns the (pkg, info) tuple of every package, in the order added '''
+        if not self.pkgs:
+            return []
+        infos = numpy.concatenate([chunk['info'] for n, chunk in self._chunks]).tolist()
+        info_names = dict((i, info) for info, i in self._info_ids.items())
+        return [(pkg, info_names[info]) for pkg, info in zip(self.pkgs, infos)]
+
+    def filter(self, fltr):
+        '''
+        Apply the filters of a PackagekitFilter
+        Returns the list of (pkg, info) tuples left, in the order added
+        '''
+        count = len(self.pkgs)
+        if not count:
+            return []
+        names = numpy.concatenate([chunk['name'] for n, chunk in self._chunks])
+        infos = numpy.concatenate([chunk['info'] for n, chunk in self._chunks])
+        versions, known = self._join('versions')
+        if known is not None:
+            versions = None
+
+        # base filters first, installed ones after the downgrade check
+        # like PackagekitFilter does
+        mask = numpy.ones(count, dtype=bool)
+        installed_filters = []
+        for flt in fltr.fltlist:
+            spec = _FILTER_COLUMNS.get(flt)
+            if spec is None:
+                continue
+            column, want = spec
+            if column == 'installed':
+                installed_filters.append(want)
+                continue
+            mask &= self._column(fltr, column, mask) == want
+
+        mask &= ~self._downgrades(fltr, mask, names, infos, versions)
+        for want in installed_filters:
+            mask &= self._column(fltr, 'installed', mask) == want
+
+        # like in the list, only with version keys
+        newest = FILTER_NEWEST in fltr.fltlist and fltr._overrides('_pkg_version_key')
+        rows = numpy.flatnonzero(mask)
+        if newest and versions is not None:
+            best = numpy.full(len(self._name_ids), -numpy.inf)
+            numpy.maximum.at(best, names[rows], versions[rows])
+            rows = rows[versions[rows] == best[names[rows]]]
+
+        pkgs = self.pkgs
+        info_names = dict((i, info) for info, i in self._info_ids.items())
+        package_list = [(pkgs[i], info_names[info]) for i, info in zip(rows.tolist(), infos[rows].tolist())]
+        if newest and versions is None:
+            package_list = fltr._get_newest(package_list)
+        return package_list
+
+    def _downgrades(self, fltr, mask, names, infos, versions):
+        '''
+        Returns the mask of available rows in mask that are the same as or
+        older than an installed row in mask with the same name
+        '''
+        drop = numpy.zeros(len(self.pkgs), dtype=bool)
+        if INFO_INSTALLED not in self._info_ids or INFO_AVAILABLE not in self._info_ids:
+            return drop
+        installed = mask & (infos == self._info_ids[INFO_INSTALLED])
+        available = mask & (infos == self._info_ids[INFO_AVAILABLE])
+        # only available rows of a name that is installed need a look
+        candidates = available & numpy.isin(names, names[installed])
+        if not candidates.any():
+            return drop
+
+        if versions is not None:
+            best = numpy.full(len(self._name_ids), -numpy.inf)
+            numpy.maximum.at(best, names[installed], versions[installed])
+            return candidates & (versions <= best[names])
+
+        pkgs = self.pkgs
+        name_list = names.tolist()
+        if fltr._overrides('_pkg_version_key'):
+            version_key = fltr._version_key
+            newest = {}
+            for i in numpy.flatnonzero(installed).tolist():
+                key = version_key(pkgs[i])
+                name = name_list[i]
+                if name not in newest or key > newest[name]:
+                    newest[name] = key
+            for i in numpy.flatnonzero(candidates).tolist():
+                drop[i] = version_key(pkgs[i]) <= newest[name_list[i]]
+            return drop
+
+        from .filter import _is_installed_or_older
+        installed_pkgs = {}
+        for i in numpy.flatnonzero(installed).tolist():
+            installed_pkgs.setdefault(name_list[i], []).append(pkgs[i])
+        compare = fltr._pkg_compare
+        for i in numpy.flatnonzero(candidates).tolist():
+            drop[i] = _is_installed_or_older(compare, pkgs[i], installed_pkgs[name_list[i]])
+        return drop
@@ -0,0 +1,176 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Opt-in tracing of python backends
+#
+# Set PK_BACKEND_TRACE to a file name to record nested spans (dispatch,
+# backend method, filtering, output and anything a backend wraps in
+# trace_span()) in the Chrome trace event format, which can be loaded in
+# chrome://tracing or https://ui.perfetto.dev. The daemon only passes its
+# environment to helpers with KeepEnvironment=true in PackageKit.conf.
+#
+# Backends use trace_span() of diagnostics.py, which only imports this
+# module when PK_BACKEND_TRACE is set.
+#
+# Every helper process writes its own file, named after PK_BACKEND_TRACE
+# with its pid appended, e.g. /tmp/pk.json.1234, so the helpers of one
+# session and the children of a zygote don't overwrite each other.
+#
+# Events are appended as they complete using the JSON array format, which
+# may legally be left without its closing bracket, so a helper that is
+# killed still leaves a readable trace behind.
+#
+
+import os
+import atexit
+import threading
+
+try:
+    from time import monotonic as _monotonic
+except ImportError:
+    from time import time as _monotonic
+
+from . import diagnostics
+from .diagnostics import TRACE_ENV
+
+class _NullSpan(object):
+    ''' what trace_span() returns when tracing is off '''
+    def __enter__(self):
+        return self
+    def __exit__(self, typ, value, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span(object):
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = _monotonic()
+        return self
+
+    def __exit__(self, typ, value, tb):
+        args = self.args
+        if typ is not None:
+            args = dict(args or {}, error=typ.__name__)
+        self.tracer.add_event(self.name, self.cat, self.start, _monotonic(), args)
+        return False
+
+class PackagekitTracer(object):
+    '''
+    Writes completed spans to a trace file
+    '''
+
+    def __init__(self, path):
+        '''
+        @param path: the file name, the pid is appended to it
+        '''
+        self.pid = os.getpid()
+        self.path = '%s.%i' % (path, self.pid)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._file = None
+
+    def span(self, name, cat='backend', **args):
+        '''
+        Returns a context manager recording the time spent in the block
+        @param name: what is being done, e.g. "search-name"
+        @param cat: the category, e.g. "dispatch", "filter" or "emit"
+        @param args: extra values to show with the span
+        '''
+        return _Span(self, name, cat, args or None)
+
+    def add_event(self, name, cat, start, end, args=None):
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': int(start * 1000000),
+            'dur': int((end - start) * 1000000),
+            'pid': self.pid,
+            'tid': threading.current_thread().ident,
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._pending.append(event)
+
+    def flush(self):
+        ''' append all completed spans to the trace file '''
+        import json
+        with self._lock:
+            events = self._pending
+            self._pending = []
+            if not events:
+                return
+            if self._file is None:
+                self._file = open(self.path, 'w')
+                self._file.write('[\n')
+            for event in events:
+                self._file.write(json.dumps(event, default=str))
+                self._file.write(',\n')
+            self._file.flush()
+
+_tracer = None
+_tracer_checked = False
+
+def get_tracer():
+    ''' Returns the PackagekitTracer of this process, or None if not tracing '''
+    global _tracer, _tracer_checked
+    if not _tracer_checked:
+        path = os.environ.get(TRACE_ENV)
+        if path:
+            _tracer = PackagekitTracer(path)
+            atexit.register(_tracer.flush)
+        _tracer_checked = True
+    return _tracer
+
+def _after_fork():
+    # a forked child, e.g. of a zygote, traces to a file of its own, and
+    # only once the environment of its transaction is in place
+    global _tracer, _tracer_checked
+    _tracer = None
+    _tracer_checked = False
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+def trace_span(name, cat='backend', **args):
+    '''
+    Record the time spent in a block, for backends to mark their own work:
+
+        with trace_span('PortageBridge.update'):
+            ...
+    '''
+    tracer = get_tracer()
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, cat, **args)
+
+def trace_startup():
+    ''' Record the time from the start of the helper until now as the startup span '''
+    tracer = get_tracer()
+    if tracer is not None:
+        tracer.add_event('startup', 'init', diagnostics.start_time, _monotonic())
+
+def flush_trace():
+    tracer = get_tracer()
+    if tracer is not None:
+        tracer.flush()
@@ -0,0 +1,195 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Buffered output used by PackageKitBaseBackend to talk to the daemon
+#
+
+import sys
+import atexit
+import threading
+
+from .diagnostics import trace_span, get_recorder
+from .protocol import signal_name
+
+try:
+    from time import monotonic as _monotonic
+except ImportError:
+    from time import time as _monotonic
+
+# flush once this many bytes are pending
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+# never hold a signal back for longer than this many seconds
+DEFAULT_FLUSH_INTERVAL = 0.02
+
+class PackagekitSignalWriter(object):
+    '''
+    Collects the lines written to the daemon and writes them out in
+    batches, instead of doing a write() and flush() for every signal.
+
+    Lines are UTF-8 encoded bytes and go straight to the binary buffer
+    of stdout, skipping the text layer and its second encoding pass.
+
+    Pending data is written when:
+     - more than max_size bytes are buffered
+     - the oldest pending line is older than flush_interval seconds
+     - write() is called with urgent=True
+     - flush() is called explicitly
+
+    A max_size of 0 turns the writer into a write-through stream, which
+    is the behaviour of the backends before buffering was added.
+    '''
+
+    def __init__(self, stream=None, max_size=DEFAULT_BUFFER_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.stream = stream
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._pending_size = 0
+        self._deadline = None
+        # a plain lock, entered directly on every write, that the deadline
+        # thread waits on through the condition
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._thread = None
+        # a PackagekitSideChannel taking over large writes, if enabled
+        self.side_channel = None
+        # a PackagekitRecorder capturing every write, if enabled
+        self.recorder = get_recorder()
+        # signal template to [count, bytes] of everything written, see stats.py
+        self._signals = {}
+        atexit.register(self.flush)
+
+    def _get_stream(self):
+        # resolve late, backends swap sys.stdout to silence their libraries
+        if self.stream is not None:
+            return self.stream
+        stdout = sys.stdout
+
+        # anything print()ed by the backend has to go out first
+        stdout.flush()
+        return getattr(stdout, 'buffer', stdout)
+
+    def write(self, data, urgent=False, template=None, count=1):
+        '''
+        Queue data for the daemon
+        @param data: one or more complete protocol lines, as bytes
+        @param urgent: write out everything pending straight away
+        @param template: the template of the signals in data, to count them
+        @param count: how many signals of that template data holds
+        '''
+        size = len(data)
+        with self._lock:
+            if self.recorder is not None:
+                from .record import RECORD_STDOUT
+                self.recorder.record(RECORD_STDOUT, data)
+            if template is not None:
+                counts = self._signals.get(template)
+                if counts is None:
+                    self._signals[template] = [count, size]
+                else:
+                    counts[0] += count
+                    counts[1] += size
+            self._pending.append(data)
+            self._pending_size += size
+            if urgent or self._pending_size >= self.max_size:
+                self._flush_locked()
+            elif self._deadline is None:
+                self._deadline = _monotonic() + self.flush_interval
+                self._ensure_thread()
+                self._cond.notify()
+
+    def count_signals(self, counts):
+        '''
+        Count signals written without a template, e.g. a mix of them
+        @param counts: dict of template to [count, bytes]
+        '''
+        with self._lock:
+            for template, (count, size) in counts.items():
+                entry = self._signals.setdefault(template, [0, 0])
+                entry[0] += count
+                entry[1] += size
+
+    def get_signals(self):
+        '''
+        Returns (name, count, bytes) for each signal written, by name
+        Safe to call from a signal handler, it doesn't take the lock.
+        '''
+        signals = {}
+        for template, (count, size) in list(self._signals.items()):
+            entry = signals.setdefault(signal_name(template), [0, 0])
+            entry[0] += count
+            entry[1] += size
+        return sorted((name.decode('ascii', 'replace'), count, size)
+                      for name, (count, size) in signals.items())
+
+    def flush(self):
+        ''' write out everything that is pending '''
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._deadline = None
+        if not self._pending:
+            return
+        data = b''.join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        side_channel = self.side_channel
+        diverted = None
+        if side_channel is not None and len(data) >= side_channel.threshold:
+            try:
+                with trace_span('side-channel', 'emit', size=len(data)):
+                    diverted, data = side_channel.divert(data)
+            except (IOError, OSError):
+                # out of space, the pipe still works
+                pass
+        try:
+            with trace_span('write', 'emit', size=len(data)):
+                stream = self._get_stream()
+                stream.write(data)
+                stream.flush()
+        except:
+            # nobody else knows about the file
+            if diverted is not None:
+                side_channel.discard(diverted)
+            raise
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._deadline_loop,
+                                        name='pk-signal-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _deadline_loop(self):
+        with self._cond:
+            while True:
+                if self._deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = self._deadline - _monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                try:
+                    self._flush_locked()
+                except (IOError, ValueError):
+                    # the daemon went away, nothing sensible left to do
+                    self._pending = []
+                    self._pending_size = 0
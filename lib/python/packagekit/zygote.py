@@ -0,0 +1,293 @@
+# Licensed under the GNU General Public License Version 2
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Zygote mode for python backend helpers
+#
+# Importing a backend and setting up its package databases can take
+# seconds. A zygote is a helper started once with --zygote, which builds
+# its backend and then waits on a unix socket. Each helper the daemon
+# spawns afterwards calls forward_to_zygote() before its expensive
+# imports: it hands its stdin, stdout and stderr, its arguments and its
+# environment to the zygote, which forks a child that applies that
+# environment and runs the dispatcher on those descriptors. The spawned
+# helper stays around as a stand-in, passing on signals from the daemon
+# and exiting with the status of the child.
+#
+# Without a zygote listening, forward_to_zygote() returns and the helper
+# runs as it always has. This module must stay cheap to import.
+#
+# The backend of a zygote is only as fresh as the package databases it
+# was built from. Before each fork the zygote compares the
+# get_cache_fingerprint() of its backend with the one it started with,
+# and when a sync, a (un)merge or a config change moved it on, it hands
+# the transaction back to its helper to run unforked, waits for its
+# running children and re-executes itself to start over. Config files are
+# mostly edited in place, which a directory mtime doesn't show, so the
+# fingerprint has to cover the files themselves, e.g. with
+# files_fingerprint() of cache.py. Backends without a fingerprint can't
+# run a zygote.
+#
+
+import os
+import sys
+import array
+import errno
+import select
+import signal
+import socket
+import struct
+import threading
+
+ZYGOTE_DIR = '/run/PackageKit'
+
+_LENGTH = struct.Struct('!I')
+_STATUS = struct.Struct('!ii')
+
+# signals the daemon may send to the helper to cancel or kill it, or
+# that ask it for its stats
+_FORWARDED_SIGNALS = (signal.SIGTERM, signal.SIGQUIT, signal.SIGINT, signal.SIGHUP,
+                      signal.SIGUSR1, signal.SIGUSR2)
+
+def zygote_socket_path(name):
+    ''' Returns where the zygote of the named backend listens '''
+    return os.path.join(ZYGOTE_DIR, 'zygote-%s.socket' % name)
+
+def _recv_exactly(conn, size):
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise EOFError('zygote connection closed')
+        data += chunk
+    return data
+
+def forward_to_zygote(name, args=None):
+    '''
+    Run this transaction in the zygote of the named backend, if there is one.
+    Does not return if there is, returns False if there isn't.
+    @param name: the backend name, e.g. "portage"
+    @param args: the helper arguments, sys.argv[1:] by default
+    '''
+    if args is None:
+        args = sys.argv[1:]
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(zygote_socket_path(name))
+    except socket.error:
+        conn.close()
+        return False
+
+    import json
+    request = json.dumps({
+        'args': args,
+        'env': dict(os.environ),
+        'cwd': os.getcwd(),
+    }).encode('utf-8')
+    fds = array.array('i', [0, 1, 2])
+    conn.sendmsg([_LENGTH.pack(len(request)), request],
+                 [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds.tobytes())])
+
+    # the zygote answers with the pid of the child, then its exit status,
+    # or with 0 when it is restarting and the helper has to run itself
+    try:
+        pid = _LENGTH.unpack(_recv_exactly(conn, _LENGTH.size))[0]
+    except EOFError:
+        sys.exit(1)
+    if not pid:
+        conn.close()
+        return False
+    def forward(signum, frame):
+        os.kill(pid, signum)
+    for signum in _FORWARDED_SIGNALS:
+        signal.signal(signum, forward)
+    while True:
+        try:
+            status, signum = _STATUS.unpack(_recv_exactly(conn, _STATUS.size))
+            break
+        except EOFError:
+            sys.exit(1)
+        except (IOError, OSError) as e:
+            if e.errno != errno.EINTR:
+                raise
+    if signum:
+        # die the same way, the daemon tells killed helpers apart
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+    sys.exit(status)
+
+def _recv_request(conn):
+    import json
+    fd_size = array.array('i').itemsize * 3
+    data, ancdata, flags, addr = conn.recvmsg(65536, socket.CMSG_SPACE(fd_size))
+    fds = array.array('i')
+    for level, typ, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and typ == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - len(cmsg_data) % fds.itemsize])
+    if len(data) < _LENGTH.size:
+        data += _recv_exactly(conn, _LENGTH.size - len(data))
+    length = _LENGTH.unpack_from(data)[0]
+    data = data[_LENGTH.size:]
+    if len(data) < length:
+        data += _recv_exactly(conn, length - len(data))
+    return list(fds), json.loads(data.decode('utf-8'))
+
+def _run_child(backend, request, fds):
+    # imported here, the helpers forwarding to us never need it
+    from .writer import PackagekitSignalWriter
+    from .diagnostics import flush_diagnostics
+
+    for signum in _FORWARDED_SIGNALS + (signal.SIGCHLD,):
+        signal.signal(signum, signal.SIG_DFL)
+    backend._install_signal_handlers()
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    sys.stdin = os.fdopen(0, 'r')
+    sys.stdout = os.fdopen(1, 'w')
+    sys.stderr = os.fdopen(2, 'w')
+    os.environ.clear()
+    os.environ.update(request['env'])
+    try:
+        os.chdir(request['cwd'])
+    except OSError:
+        pass
+
+    code = 0
+    try:
+        backend.writer = PackagekitSignalWriter()
+        backend.load_environment()
+        backend.dispatcher(request['args'])
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            code = e.code
+        elif e.code is not None:
+            code = 1
+    except BaseException:
+        sys.excepthook(*sys.exc_info())
+        code = 1
+    try:
+        backend.writer.flush()
+        flush_diagnostics()
+        sys.stdout.flush()
+    finally:
+        os._exit(code)
+
+def _watch_child(conn, pid, connections):
+    # a helper killed with SIGKILL can't pass that on, so the child goes
+    # when its stand-in hangs up
+    try:
+        conn.sendall(_LENGTH.pack(pid))
+        hung_up = False
+        while True:
+            if not hung_up and select.select([conn], [], [], 0.1)[0] and not conn.recv(1):
+                os.kill(pid, signal.SIGKILL)
+                hung_up = True
+            elif hung_up:
+                select.select([], [], [], 0.1)
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+        if os.WIFSIGNALED(status):
+            conn.sendall(_STATUS.pack(0, os.WTERMSIG(status)))
+        else:
+            conn.sendall(_STATUS.pack(os.WEXITSTATUS(status), 0))
+    except (IOError, OSError):
+        pass
+    finally:
+        connections.discard(conn)
+        conn.close()
+
+def _restart(listener, path, conn, fds, connections):
+    # new helpers run unforked until we listen again, this one too
+    listener.close()
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    for fd in fds:
+        os.close(fd)
+    try:
+        conn.sendall(_LENGTH.pack(0))
+    except (IOError, OSError):
+        pass
+    conn.close()
+    # the stand-ins of running children wait on their connection for the
+    # exit status, which the watcher threads can't send once we exec
+    while connections:
+        select.select([], [], [], 0.1)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+def run_zygote(backend, name):
+    '''
+    Serve transactions of the named backend until killed
+    @param backend: the initialised PackageKitBaseBackend to fork from
+    @param name: the backend name, e.g. "portage"
+    '''
+    fingerprint = backend.get_cache_fingerprint()
+    if fingerprint is None:
+        # nothing would tell when the backend has gone stale
+        sys.stderr.write('the %s backend has no cache fingerprint, not running a zygote\n' % name)
+        sys.exit(1)
+    path = zygote_socket_path(name)
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # only the daemon, running as root, may hand us transactions
+    old_umask = os.umask(0o077)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(16)
+
+    # connections of running children, which their siblings mustn't keep open
+    connections = set()
+    while True:
+        conn, addr = listener.accept()
+        try:
+            fds, request = _recv_request(conn)
+        except (IOError, OSError, EOFError, ValueError):
+            conn.close()
+            continue
+        if len(fds) != 3:
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+            continue
+
+        if backend.get_cache_fingerprint() != fingerprint:
+            _restart(listener, path, conn, fds, connections)
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            listener.close()
+            conn.close()
+            for other in list(connections):
+                other.close()
+            _run_child(backend, request, fds)
+        for fd in fds:
+            os.close(fd)
+        connections.add(conn)
+        thread = threading.Thread(target=_watch_child, args=(conn, pid, connections),
+                                  name='pk-zygote-%i' % pid)
+        thread.daemon = True
+        thread.start()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Runs tests/data/pk-spawn-synthetic.py the way the daemon runs a helper,
+# one command after the other on its stdin, and reports for each command
+# the latency until finished, signals and bytes per second, and the peak
+# RSS of the helper so far. Use it as the baseline for changes to the
+# python backend library.
+#
+# Run from the build directory, like tests/data/pk-spawn-dispatcher.py:
+#   ./tests/benchmarks/bench-backend.py [--packages N] [--files N] [--detail N] [--repeat N]
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+HELPER = os.path.join('tests', 'data', 'pk-spawn-synthetic.py')
+
+def commands(packages):
+    ''' the commands to time, as (name, arguments) tuples '''
+    step = max(packages // 100, 1)
+    names = ['synthetic%06i' % i for i in range(0, packages, step)]
+    ids = ['%s;1.1;x86_64;synthetic' % name for name in names]
+    return [
+        ('get-packages', ['none']),
+        ('get-packages', ['installed']),
+        ('get-packages', ['~installed']),
+        ('search-name', ['none', 'synthetic0001']),
+        ('resolve', ['none', '&'.join(names)]),
+        ('get-updates', ['none']),
+        ('get-details', ['&'.join(ids)]),
+        ('get-files', ['&'.join(ids)]),
+    ]
+
+def peak_rss(pid):
+    ''' Returns the peak resident set size of a process in bytes '''
+    with open('/proc/%i/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+class Helper(object):
+    ''' a running synthetic helper '''
+
+    def __init__(self, env):
+        self.proc = subprocess.Popen([sys.executable, HELPER], env=env,
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.fd = self.proc.stdout.fileno()
+        self.pending = b''
+
+    def run(self, name, args):
+        '''
+        Send a command and read its signals up to finished
+        Returns a tuple of (seconds, signals, bytes)
+        '''
+        start = time.time()
+        self.proc.stdin.write(('\t'.join([name] + args) + '\n').encode('utf-8'))
+        self.proc.stdin.flush()
+        signals = 0
+        size = 0
+        while True:
+            lines = self.pending.split(b'\n')
+            self.pending = lines.pop()
+            for line in lines:
+                signals += 1
+                size += len(line) + 1
+                if line == b'finished':
+                    return time.time() - start, signals, size
+            data = os.read(self.fd, 1024 * 1024)
+            if not data:
+                raise RuntimeError('helper exited during %s' % name)
+            self.pending += data
+
+    def close(self):
+        self.proc.stdin.write(b'exit\n')
+        self.proc.stdin.close()
+        self.proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the python backend library with a synthetic helper')
+    parser.add_argument('--packages', type=int, default=10000, help='package names in the database')
+    parser.add_argument('--files', type=int, default=50, help='files in each package')
+    parser.add_argument('--detail', type=int, default=500, help='bytes of description of each package')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each command, the fastest is shown')
+    options = parser.parse_args()
+
+    env = dict(os.environ)
+    env.update({
+        'LANG': 'C',
+        'NETWORK': 'FALSE',
+        'UID': '0',
+        'BACKGROUND': 'FALSE',
+        'INTERACTIVE': 'FALSE',
+        'PK_SYNTHETIC_PACKAGES': str(options.packages),
+        'PK_SYNTHETIC_FILES': str(options.files),
+        'PK_SYNTHETIC_DETAIL': str(options.detail),
+    })
+    helper = Helper(env)
+
+    print("%i packages, %i files and %i bytes of description each" %
+          (options.packages, options.files, options.detail))
+    print("%-30s %10s %9s %12s %10s %12s %10s" %
+          ('command', 'latency ms', 'signals', 'signals/s', 'bytes', 'MiB/s', 'peak RSS'))
+    for name, args in commands(options.packages):
+        runs = [helper.run(name, args) for i in range(options.repeat)]
+        elapsed, signals, size = min(runs)
+        label = ' '.join([name] + [arg for arg in args if len(arg) < 16])
+        print("%-30s %10.1f %9i %12.0f %10i %12.1f %9.1fM" %
+              (label, elapsed * 1000, signals, signals / elapsed, size,
+               size / elapsed / (1024 * 1024), peak_rss(helper.proc.pid) / (1024.0 * 1024)))
+    helper.close()
+
+if __name__ == "__main__":
+    main()
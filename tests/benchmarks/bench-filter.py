@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Compares PackagekitFilter.get_package_list with the three pass
+# implementation it replaced, with version keys instead of _pkg_compare,
+# with the _pkgs_is_*() bulk hooks, and with a PackagekitPackageTable when NumPy is installed, on a large
+# list of packages, and checks all give the same result.
+#
+# Run from the build directory, like tests/data/pk-spawn-dispatcher.py:
+#   ./tests/benchmarks/bench-filter.py [number-of-packages]
+
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+from packagekit.enums import *
+from packagekit.filter import PackagekitFilter
+
+try:
+    from packagekit.table import PackagekitPackageTable
+except ImportError:
+    PackagekitPackageTable = None
+
+FILTER_SETS = [
+    [FILTER_NONE],
+    [FILTER_INSTALLED],
+    [FILTER_NOT_INSTALLED],
+    [FILTER_GUI, FILTER_NOT_DEVELOPMENT, FILTER_ARCH],
+    [FILTER_FREE, FILTER_GUI, FILTER_NOT_INSTALLED],
+]
+
+def parse_version(version):
+    return tuple(int(part) for part in version.split('.'))
+
+class SyntheticFilter(PackagekitFilter):
+    ''' packages are (name, version, installed, flags) tuples '''
+
+    def _pkg_get_name(self, pkg):
+        return pkg[0]
+
+    def _pkg_compare(self, pkg1, pkg2):
+        # parsing both versions every time, like most backends do
+        version1 = parse_version(pkg1[1])
+        version2 = parse_version(pkg2[1])
+        if version1 == version2:
+            return 0
+        return 1 if version1 > version2 else -1
+
+    def _pkg_is_installed(self, pkg):
+        return pkg[2]
+
+    def _pkg_is_gui(self, pkg):
+        return pkg[3] % 2 == 0
+
+    def _pkg_is_devel(self, pkg):
+        return pkg[3] % 5 == 0
+
+    def _pkg_is_free(self, pkg):
+        return pkg[3] % 7 != 0
+
+    def _pkg_is_arch(self, pkg):
+        return pkg[3] % 11 != 0
+
+class KeyedFilter(SyntheticFilter):
+    ''' versions parsed once per package '''
+
+    def _pkg_version_key(self, pkg):
+        return parse_version(pkg[1])
+
+class BulkFilter(KeyedFilter):
+    ''' each property looked up once for all the packages left '''
+
+    def _pkgs_is_installed(self, pkgs):
+        return [pkg[2] for pkg in pkgs]
+
+    def _pkgs_is_gui(self, pkgs):
+        return [pkg[3] % 2 == 0 for pkg in pkgs]
+
+    def _pkgs_is_devel(self, pkgs):
+        return [pkg[3] % 5 == 0 for pkg in pkgs]
+
+    def _pkgs_is_free(self, pkgs):
+        return [pkg[3] % 7 != 0 for pkg in pkgs]
+
+    def _pkgs_is_arch(self, pkgs):
+        return [pkg[3] % 11 != 0 for pkg in pkgs]
+
+class LegacyFilter(SyntheticFilter):
+    ''' the get_package_list of before, rebuilding the list three times '''
+
+    def _get_package_list(self):
+        package_list = self.package_list
+        self.package_list = []
+        for pkg, state in package_list:
+            if self._filter_base(pkg):
+                self.package_list.append((pkg, state))
+
+        installed_dict = collections.defaultdict(list)
+        for pkg, state in self.package_list:
+            if state is INFO_INSTALLED:
+                installed_dict[self._pkg_get_name(pkg)].append(pkg)
+
+        package_list = self.package_list
+        self.package_list = []
+        for pkg, state in package_list:
+            add = True
+            if state is INFO_AVAILABLE:
+                for pkg_tmp in installed_dict[self._pkg_get_name(pkg)]:
+                    rc = self._pkg_compare(pkg, pkg_tmp)
+                    if rc == 0 or rc == -1:
+                        add = False
+                        break
+            if add:
+                self.package_list.append((pkg, state))
+
+        package_list = self.package_list
+        self.package_list = []
+        for pkg, state in package_list:
+            if self._filter_installed(pkg):
+                self.package_list.append((pkg, state))
+
+        return self.post_process()
+
+def packages(count):
+    '''
+    three available versions of each name, every third name installed and
+    every sixth installed in two versions, like slots
+    '''
+    pkgs = []
+    for i in range(count):
+        name = 'pkg%06i' % i
+        if i % 3 == 0:
+            pkgs.append(((name, '1.9.%i' % (i % 4), True, i), INFO_INSTALLED))
+        if i % 6 == 0:
+            pkgs.append(((name, '2.0.%i' % (i % 4), True, i), INFO_INSTALLED))
+        for version in ('1.8.%i' % (i % 4), '1.9.%i' % (i % 4), '1.10.0'):
+            pkgs.append(((name, version, False, i), INFO_AVAILABLE))
+        if len(pkgs) >= count:
+            break
+    return pkgs[:count]
+
+def run(cls, filters, pkgs):
+    fltr = cls(filters)
+    for pkg, state in pkgs:
+        fltr.add_custom(pkg, state)
+    start = time.time()
+    result = fltr.get_package_list()
+    return time.time() - start, result
+
+def make_table(pkgs):
+    ''' the packages as a table, with every column and the version ranks '''
+    ranks = dict((version, rank) for rank, version in
+                 enumerate(sorted(set(pkg[1] for pkg, state in pkgs), key=parse_version)))
+    table = PackagekitPackageTable()
+    for info in (INFO_INSTALLED, INFO_AVAILABLE):
+        rows = [pkg for pkg, state in pkgs if state is info]
+        flags = [pkg[3] for pkg in rows]
+        table.add(rows, info, [pkg[0] for pkg in rows],
+                  versions=[ranks[pkg[1]] for pkg in rows],
+                  installed=info is INFO_INSTALLED,
+                  gui=[flag % 2 == 0 for flag in flags],
+                  devel=[flag % 5 == 0 for flag in flags],
+                  free=[flag % 7 != 0 for flag in flags],
+                  arch=[flag % 11 != 0 for flag in flags])
+    return table
+
+def run_table(cls, filters, table):
+    fltr = cls(filters)
+    fltr.add_table(table)
+    start = time.time()
+    result = fltr.get_package_list()
+    return time.time() - start, result
+
+def main():
+    count = 100000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    pkgs = packages(count)
+    table = None
+    if PackagekitPackageTable is not None:
+        table = make_table(pkgs)
+
+    print("%i packages" % count)
+    print("%-40s %10s %10s %10s %10s %10s %8s" %
+          ('filters', 'legacy s', 'single s', 'keyed s', 'bulk s', 'table s', 'kept'))
+    for filters in FILTER_SETS:
+        legacy_time, legacy = min(run(LegacyFilter, filters, pkgs) for i in range(3))
+        single_time, single = min(run(SyntheticFilter, filters, pkgs) for i in range(3))
+        keyed_time, keyed = min(run(KeyedFilter, filters, pkgs) for i in range(3))
+        bulk_time, bulk = min(run(BulkFilter, filters, pkgs) for i in range(3))
+        table_time = '-'
+        if table is not None:
+            table_time, tabled = min(run_table(SyntheticFilter, filters, table) for i in range(3))
+            table_time = '%.3f' % table_time
+            # the table keeps the installed packages before the available ones
+            if sorted(tabled) != sorted(legacy):
+                print("%s: table results differ" % ';'.join(filters))
+                sys.exit(1)
+        if single != legacy or keyed != legacy or bulk != legacy:
+            print("%s: results differ" % ';'.join(filters))
+            sys.exit(1)
+        print("%-40s %10.3f %10.3f %10.3f %10.3f %10s %8i" %
+              (';'.join(filters), legacy_time, single_time, keyed_time, bulk_time,
+               table_time, len(single)))
+
+    # only possible with version keys
+    newest_time, newest = min(run(KeyedFilter, [FILTER_NEWEST], pkgs) for i in range(3))
+    table_time = '-'
+    if table is not None:
+        table_time, tabled = min(run_table(KeyedFilter, [FILTER_NEWEST], table) for i in range(3))
+        table_time = '%.3f' % table_time
+        if sorted(tabled) != sorted(newest):
+            print("%s: table results differ" % FILTER_NEWEST)
+            sys.exit(1)
+    print("%-40s %10s %10s %10.3f %10s %10s %8i" %
+          (FILTER_NEWEST, '-', '-', newest_time, '-', table_time, len(newest)))
+
+if __name__ == "__main__":
+    main()
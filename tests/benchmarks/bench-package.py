@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Times emitting package signals one at a time through a pipe, the way
+# most backends do, against the write and flush per signal the backends
+# started out with, and against packages() for bulk callers. Each way
+# runs in a child process whose stdout is read by this one.
+#
+# Run from the build directory, like tests/data/pk-spawn-dispatcher.py:
+#   ./tests/benchmarks/bench-package.py [number-of-packages]
+
+import os
+import sys
+import time
+import subprocess
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+MODES = ('baseline', 'package', 'packages')
+
+def emit(mode, count):
+    ''' the child: emit count package signals on stdout '''
+    from packagekit.backend import PackageKitBaseBackend, INFO_AVAILABLE
+    backend = PackageKitBaseBackend('')
+    start = time.time()
+    if mode == 'baseline':
+        # what package() did before signals were buffered
+        for i in range(count):
+            sys.stdout.write("package\t%s\t%s\t%s\n" % (INFO_AVAILABLE, "pkg%i;1.0.%i;x86_64;gentoo" % (i, i),
+                                                        "Synthetic package number %i" % i))
+            sys.stdout.flush()
+    elif mode == 'package':
+        for i in range(count):
+            backend.package("pkg%i;1.0.%i;x86_64;gentoo" % (i, i),
+                            INFO_AVAILABLE, "Synthetic package number %i" % i)
+    else:
+        backend.packages((INFO_AVAILABLE, "pkg%i;1.0.%i;x86_64;gentoo" % (i, i),
+                          "Synthetic package number %i" % i) for i in range(count))
+    backend.writer.flush()
+    sys.stderr.write("%f\n" % (time.time() - start))
+
+def run(mode, count):
+    ''' Returns the seconds the child took and the bytes it wrote '''
+    env = dict(os.environ, LANG='C', NETWORK='FALSE', UID='0', BACKGROUND='FALSE',
+               INTERACTIVE='FALSE')
+    proc = subprocess.Popen([sys.executable, __file__, '--emit', mode, str(count)],
+                            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    size = 0
+    while True:
+        data = proc.stdout.read(1024 * 1024)
+        if not data:
+            break
+        size += len(data)
+    elapsed = float(proc.stderr.read().split()[-1])
+    proc.wait()
+    return elapsed, size
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--emit':
+        emit(sys.argv[2], int(sys.argv[3]))
+        return
+    count = 100000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    print("%i package signals through a pipe" % count)
+    results = {}
+    for mode in MODES:
+        elapsed, size = min(run(mode, count) for i in range(3))
+        results[mode] = elapsed
+        print("%-10s %8.3f s %12.0f signals/s %10i bytes" % (mode, elapsed, count / elapsed, size))
+    print("package() against baseline: %.2fx" % (results['baseline'] / results['package']))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Compares emit and parse cost of the text and framed helper protocols
+# for large files() lists and multi-line details().
+#
+# Run from the build directory, like tests/data/pk-spawn-dispatcher.py:
+#   ./tests/benchmarks/bench-protocol.py [number-of-packages]
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+from packagekit.backend import *
+from packagekit.protocol import decode_text, decode_framed
+from packagekit.writer import PackagekitSignalWriter
+
+FILES_PER_PACKAGE = 2000
+
+def emit(backend, count):
+    file_list = ["/usr/share/doc/pkg/file-%i.txt" % i for i in range(FILES_PER_PACKAGE)]
+    desc = "A synthetic package.\nIt has a description\nspread over several lines."
+    start = time.time()
+    for i in range(count):
+        package_id = "pkg%i;1.0;x86_64;gentoo" % i
+        if backend.protocol == PROTOCOL_TEXT:
+            backend.files(package_id, ";".join(file_list))
+            backend.details(package_id, "Synthetic package", "GPL-2", GROUP_SYSTEM,
+                            format_string(desc), "http://example.com", 1024)
+        else:
+            backend.files(package_id, file_list)
+            backend.details(package_id, "Synthetic package", "GPL-2", GROUP_SYSTEM,
+                            desc, "http://example.com", 1024)
+    backend.finished()
+    return time.time() - start
+
+def parse_text(data):
+    # what pk-backend-spawn does with each line
+    records, remainder = decode_text(data)
+    for fields in records:
+        if fields[0] == b"files":
+            fields[2].split(b";")
+        elif fields[0] == b"details":
+            fields[5].replace(b";", b"\n")
+    return len(records)
+
+def parse_framed(data):
+    records, remainder = decode_framed(data)
+    for fields in records:
+        if fields[0] == b"files":
+            fields[2].split(b"\0")
+    return len(records)
+
+def main():
+    count = 500
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    os.environ.setdefault('LANG', 'C')
+    os.environ.setdefault('NETWORK', 'FALSE')
+    os.environ.setdefault('UID', '0')
+    os.environ.setdefault('BACKGROUND', 'FALSE')
+    os.environ.setdefault('INTERACTIVE', 'FALSE')
+    backend = PackageKitBaseBackend('')
+
+    print("%i packages with %i files each" % (count, FILES_PER_PACKAGE))
+    for protocol, parse in ((PROTOCOL_TEXT, parse_text), (PROTOCOL_FRAMED, parse_framed)):
+        stream = io.BytesIO()
+        backend.writer = PackagekitSignalWriter(stream=stream)
+        backend.set_protocol(protocol)
+        emit_time = emit(backend, count)
+        data = stream.getvalue()
+        start = time.time()
+        records = parse(data)
+        parse_time = time.time() - start
+        print("%-7s emit %7.3f s  parse %7.3f s  %6.1f MiB  %i records" %
+              (protocol, emit_time, parse_time, len(data) / 1048576.0, records))
+
+if __name__ == "__main__":
+    main()
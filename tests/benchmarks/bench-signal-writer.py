@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Compares the write-through output of the python backends with the
+# buffered PackagekitSignalWriter for a large get-packages result.
+#
+# Run from the build directory, like tests/data/pk-spawn-dispatcher.py:
+#   ./tests/benchmarks/bench-signal-writer.py [number-of-packages]
+
+import os
+import sys
+import time
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+from packagekit.backend import *
+from packagekit.writer import PackagekitSignalWriter
+
+class CountingStream:
+    ''' stream that does one write(2) per write() and counts them '''
+    def __init__(self):
+        self.fd = os.open(os.devnull, os.O_WRONLY)
+        self.syscalls = 0
+
+    def write(self, data):
+        os.write(self.fd, data)
+        self.syscalls += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+def run(backend, count):
+    start = time.time()
+    for i in range(count):
+        backend.package("pkg%i;1.0.%i;x86_64;gentoo" % (i, i),
+                        INFO_AVAILABLE, "Synthetic package number %i" % i)
+    backend.finished()
+    return time.time() - start
+
+def main():
+    count = 60000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    os.environ.setdefault('LANG', 'C')
+    os.environ.setdefault('NETWORK', 'FALSE')
+    os.environ.setdefault('UID', '0')
+    os.environ.setdefault('BACKGROUND', 'FALSE')
+    os.environ.setdefault('INTERACTIVE', 'FALSE')
+    backend = PackageKitBaseBackend('')
+
+    results = []
+    for name, max_size in (("write-through", 0), ("buffered", 64 * 1024)):
+        stream = CountingStream()
+        backend.writer = PackagekitSignalWriter(stream=stream, max_size=max_size)
+        elapsed = run(backend, count)
+        results.append((name, stream.syscalls, elapsed))
+        stream.close()
+
+    print("%i package signals" % count)
+    for name, syscalls, elapsed in results:
+        print("%-14s %8i write(2) %8.3f s %10.0f signals/s" %
+              (name, syscalls, elapsed, count / elapsed))
+    print("syscalls reduced %.0fx, wall time reduced %.1fx" %
+          (results[0][1] / float(results[1][1]), results[0][2] / results[1][2]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Backend answering queries about a made up package database, to measure
+# the python backend library without a distro behind it. The size of the
+# database is taken from the environment:
+#
+#   PK_SYNTHETIC_PACKAGES  number of package names, default 10000
+#   PK_SYNTHETIC_FILES     files in each package, default 50
+#   PK_SYNTHETIC_DETAIL    bytes of description of each package, default 500
+#
+# Every third package is installed and every tenth has an update. Run
+# from the build directory, like pk-spawn-dispatcher.py:
+#   ./tests/data/pk-spawn-synthetic.py get-packages none
+
+import sys
+import os
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+from packagekit.backend import *
+from packagekit.filter import PackagekitFilter
+from packagekit.package import PackagekitPackage
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+class SyntheticFilter(PackagekitFilter):
+    ''' packages are (name, version, installed) tuples '''
+
+    def _pkg_get_name(self, pkg):
+        return pkg[0]
+
+    def _pkg_compare(self, pkg1, pkg2):
+        if pkg1[1] == pkg2[1]:
+            return 0
+        return 1 if pkg1[1] > pkg2[1] else -1
+
+    def _pkg_is_installed(self, pkg):
+        return pkg[2]
+
+class PackageKitSyntheticBackend(PackageKitBaseBackend, PackagekitPackage):
+
+    def __init__(self, args):
+        PackageKitBaseBackend.__init__(self, args)
+        self.package_count = _env_int('PK_SYNTHETIC_PACKAGES', 10000)
+        self.file_count = _env_int('PK_SYNTHETIC_FILES', 50)
+        self.detail_size = _env_int('PK_SYNTHETIC_DETAIL', 500)
+
+    def _name(self, i):
+        return 'synthetic%06i' % i
+
+    def _package_id(self, pkg):
+        name, version, installed = pkg
+        return self.get_package_id(name, '1.%i' % version, 'x86_64',
+                                   'installed' if installed else 'synthetic')
+
+    def _versions(self, i):
+        ''' the installed and available versions of package number i '''
+        name = self._name(i)
+        if i % 3 == 0:
+            yield (name, 1, True)
+        yield (name, 1, False)
+        if i % 10 == 0:
+            yield (name, 2, False)
+
+    def _index(self, package_id):
+        name = package_id.split(';', 1)[0]
+        if not name.startswith('synthetic'):
+            return None
+        try:
+            i = int(name[len('synthetic'):])
+        except ValueError:
+            return None
+        if i >= self.package_count:
+            return None
+        return i
+
+    def _emit_filtered(self, indexes, filters):
+        fltr = SyntheticFilter(filters)
+        total = max(len(indexes), 1)
+        for n, i in enumerate(indexes):
+            self.check_cancelled()
+            for pkg in self._versions(i):
+                fltr.add_custom(pkg, INFO_INSTALLED if pkg[2] else INFO_AVAILABLE)
+            self.percentage(n * 100 // total)
+        self.packages((info, self._package_id(pkg), 'Synthetic package %s' % pkg[0])
+                      for pkg, info in fltr.get_package_list())
+        self.percentage(100)
+
+    def get_packages(self, filters):
+        self.allow_cancel(True)
+        self.status(STATUS_QUERY)
+        self._emit_filtered(range(self.package_count), filters)
+
+    def search_name(self, filters, values):
+        self.allow_cancel(True)
+        self.status(STATUS_QUERY)
+        indexes = [i for i in range(self.package_count)
+                   if any(value in self._name(i) for value in values)]
+        self._emit_filtered(indexes, filters)
+
+    def resolve(self, filters, values):
+        self.allow_cancel(True)
+        self.status(STATUS_QUERY)
+        indexes = [i for i in (self._index(value) for value in values) if i is not None]
+        self._emit_filtered(indexes, filters)
+
+    def get_updates(self, filters):
+        self.allow_cancel(True)
+        self.status(STATUS_QUERY)
+        self.packages((INFO_NORMAL, self._package_id((self._name(i), 2, False)),
+                       'Update of synthetic package %i' % i)
+                      for i in range(0, self.package_count, 30))
+
+    def get_details(self, package_ids):
+        self.allow_cancel(True)
+        self.status(STATUS_INFO)
+        text = ('Synthetic description. ' * (self.detail_size // 23 + 1))[:self.detail_size]
+        for package_id in package_ids:
+            i = self._index(package_id)
+            if i is None:
+                self.error(ERROR_PACKAGE_NOT_FOUND, "%s not found" % package_id, exit=False)
+                continue
+            self.details(package_id, 'Synthetic package %i' % i, 'GPL-2.0+', GROUP_OTHER,
+                         text, 'https://example.com/%s' % self._name(i), 1024 * i)
+
+    def get_files(self, package_ids):
+        self.allow_cancel(True)
+        self.status(STATUS_INFO)
+        for package_id in package_ids:
+            i = self._index(package_id)
+            if i is None:
+                self.error(ERROR_PACKAGE_NOT_FOUND, "%s not found" % package_id, exit=False)
+                continue
+            name = self._name(i)
+            self.files(package_id, ['/usr/share/%s/file%i' % (name, n)
+                                    for n in range(self.file_count)])
+
+def main():
+    backend = PackageKitSyntheticBackend('')
+    backend.dispatcher(sys.argv[1:])
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,10 @@
 # the Free Software Foundation; either version 2 of the License, or
 # (at your option) any later version.
 
+# Synthetic output; to profile with what a real python backend sends, run
+# it with PK_BACKEND_RECORD=<file> and play that back with
+# python3 -m packagekit.replay <file>.<pid>
+
 time=0.01
 
 for i in `seq 1 100`
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Pipelined queries run concurrently by async_dispatcher(). This file is
+# also the backend under test, run as a helper when given arguments.
+#
+# Run from the build directory:
+#   python3 -m unittest discover -s ../tests/python
+
+import os
+import sys
+import unittest
+import subprocess
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+def _helper():
+    import time
+    import threading
+    from packagekit.backend import PackageKitBaseBackend, INFO_AVAILABLE, ERROR_PACKAGE_NOT_FOUND
+
+    fast_done = threading.Event()
+
+    class PackageKitTestBackend(PackageKitBaseBackend):
+
+        def _packages(self, name, start, end):
+            for i in range(start, end):
+                self.package('%s;%i;noarch;data' % (name, i), INFO_AVAILABLE, name)
+                self.writer.flush()
+
+        def search_name(self, filters, values):
+            if values[0] == 'slow':
+                # only done once the fast one is, so the two have to overlap
+                self._packages('slow', 0, 3)
+                fast_done.wait(10)
+                self._packages('slow', 3, 4)
+            elif values[0] == 'fast':
+                self._packages('fast', 0, 3)
+                fast_done.set()
+            elif values[0] == 'loop':
+                for i in range(1000):
+                    self.check_cancelled()
+                    time.sleep(0.01)
+            elif values[0] == 'fatal':
+                self.error(ERROR_PACKAGE_NOT_FOUND, 'fatal')
+
+    PackageKitTestBackend('').async_dispatcher(sys.argv[2:])
+
+class AsyncDispatchTest(unittest.TestCase):
+
+    def _spawn(self):
+        env = dict(os.environ, LANG='C', UID='0', NETWORK='FALSE', BACKGROUND='FALSE',
+                   INTERACTIVE='FALSE')
+        helper = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--helper'],
+                                  env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                  universal_newlines=True)
+        self.addCleanup(helper.stdout.close)
+        self.addCleanup(helper.stdin.close)
+        self._send(helper, 'pipeline', 'true')
+        self.assertEqual(helper.stdout.readline(), 'pipeline\ttrue\n')
+        return helper
+
+    def _send(self, helper, *command):
+        helper.stdin.write('\t'.join(command) + '\n')
+        helper.stdin.flush()
+
+    def _read_until(self, helper, *last):
+        lines = []
+        while not set(last).issubset(lines):
+            line = helper.stdout.readline()
+            self.assertTrue(line, 'the helper went away after %r' % lines)
+            lines.append(line)
+        return lines
+
+    def _exit(self, helper):
+        self._send(helper, 'exit')
+        helper.stdin.close()
+        self.assertEqual(helper.wait(10), 0)
+
+    def test_interleaved(self):
+        helper = self._spawn()
+        self._send(helper, '1', 'search-name', 'none', 'slow')
+        self._send(helper, '2', 'search-name', 'none', 'fast')
+        lines = self._read_until(helper, '1\tfinished\n', '2\tfinished\n')
+        self._exit(helper)
+
+        # each line whole and tagged with the request that sent it
+        for line in lines:
+            fields = line.rstrip('\n').split('\t')
+            if fields[1] == 'package':
+                self.assertEqual(len(fields), 5)
+                name = {'1': 'slow', '2': 'fast'}[fields[0]]
+                self.assertTrue(fields[3].startswith(name + ';'))
+                self.assertEqual(fields[4], name)
+            else:
+                self.assertEqual(fields[1:], ['finished'])
+        self.assertEqual(len([line for line in lines if line.startswith('1\tpackage\t')]), 4)
+        self.assertEqual(len([line for line in lines if line.startswith('2\tpackage\t')]), 3)
+        # the last of the slow one waited for the fast one
+        self.assertLess(lines.index('2\tpackage\tavailable\tfast;2;noarch;data\tfast\n'),
+                        lines.index('1\tpackage\tavailable\tslow;3;noarch;data\tslow\n'))
+
+    def test_cancel_one(self):
+        helper = self._spawn()
+        self._send(helper, '1', 'search-name', 'none', 'loop')
+        self._send(helper, '2', 'search-name', 'none', 'fast')
+        lines = self._read_until(helper, '2\tfinished\n')
+        self.assertEqual(len([line for line in lines if line.startswith('2\tpackage\t')]), 3)
+        self.assertFalse([line for line in lines if line.startswith('1\t')])
+
+        self._send(helper, 'cancel', '1')
+        lines = self._read_until(helper, '1\tfinished\n')
+        self.assertEqual(lines, ['1\terror\ttransaction-cancelled\tthe transaction was cancelled\n',
+                                 '1\tfinished\n'])
+        self._exit(helper)
+
+    def test_fatal_error(self):
+        # error() ends the helper from a worker thread too
+        helper = self._spawn()
+        self._send(helper, '1', 'search-name', 'none', 'loop')
+        self._send(helper, '2', 'search-name', 'none', 'fatal')
+        out = helper.stdout.read()
+        self.assertEqual(helper.wait(10), 254)
+        self.assertEqual(out, '2\terror\tpackage-not-found\tfatal\n')
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--helper']:
+        _helper()
+    else:
+        unittest.main()
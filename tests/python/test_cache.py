@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Query results replayed from the cache. This file is also the backend
+# under test, run as a helper when given arguments.
+#
+# Run from the build directory:
+#   python3 -m unittest discover -s ../tests/python
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+def _helper():
+    from packagekit.backend import PackageKitBaseBackend
+
+    class PackageKitTestBackend(PackageKitBaseBackend):
+
+        def get_cache_fingerprint(self):
+            return 'test'
+
+        def get_files(self, package_ids):
+            # tells the test the result wasn't replayed
+            sys.stderr.write('computed\n')
+            sys.stderr.flush()
+            self.files(package_ids[0], ['/usr/bin/test', '/usr/share/test'])
+
+    PackageKitTestBackend('').dispatcher(sys.argv[2:])
+
+class FilesFingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.dir, 'package.use'))
+        self._write('make.conf', 'USE="X"\n')
+        self._write(os.path.join('package.use', 'test'), 'app-misc/test -X\n')
+        os.symlink('../profiles/default', os.path.join(self.dir, 'make.profile'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, data):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            f.write(data)
+
+    def _fingerprint(self):
+        from packagekit.cache import files_fingerprint
+        return files_fingerprint([self.dir, os.path.join(self.dir, 'missing')])
+
+    def test_edit_in_place(self):
+        # neither edit touches the mtime of a directory
+        dir_mtimes = [os.stat(os.path.join(self.dir, name)).st_mtime
+                      for name in ('', 'package.use')]
+        fingerprint = self._fingerprint()
+        self.assertEqual(self._fingerprint(), fingerprint)
+        self._write('make.conf', 'USE="-X"\n')
+        self.assertNotEqual(self._fingerprint(), fingerprint)
+        fingerprint = self._fingerprint()
+        path = os.path.join(self.dir, 'package.use', 'test')
+        self._write(path, 'app-misc/test +X\n')
+        mtime = os.stat(path).st_mtime + 1
+        os.utime(path, (mtime, mtime))
+        self.assertNotEqual(self._fingerprint(), fingerprint)
+        self.assertEqual([os.stat(os.path.join(self.dir, name)).st_mtime
+                          for name in ('', 'package.use')], dir_mtimes)
+
+    def test_profile_link(self):
+        fingerprint = self._fingerprint()
+        os.unlink(os.path.join(self.dir, 'make.profile'))
+        os.symlink('../profiles/hardened', os.path.join(self.dir, 'make.profile'))
+        self.assertNotEqual(self._fingerprint(), fingerprint)
+
+class QueryCacheTest(unittest.TestCase):
+
+    def _run(self, commands):
+        env = dict(os.environ, PK_BACKEND_FRAMED='1', LANG='C', UID='0',
+                   NETWORK='FALSE', BACKGROUND='FALSE', INTERACTIVE='FALSE')
+        helper = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--helper'],
+                                  env=env, stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = helper.communicate(''.join('%s\n' % '\t'.join(command) for command in commands)
+                                      .encode('utf-8'), timeout=30)
+        return helper.returncode, out, err
+
+    def test_text_hit(self):
+        rc, out, err = self._run([('get-files', 'test;1;noarch;data')] * 2)
+        self.assertEqual(rc, 0)
+        self.assertEqual(err.count(b'computed\n'), 1)
+        self.assertEqual(out.count(b'files\ttest;1;noarch;data\t/usr/bin/test;/usr/share/test\n'), 2)
+
+    def test_protocol_switch(self):
+        # what framed mode recorded can't be replayed as text lines
+        rc, out, err = self._run([
+            ('protocol', 'framed'),
+            ('get-files', 'test;1;noarch;data'),
+            ('protocol', 'text'),
+            ('get-files', 'test;1;noarch;data'),
+            ('get-files', 'test;1;noarch;data'),
+        ])
+        self.assertEqual(rc, 0)
+        self.assertEqual(err.count(b'computed\n'), 2)
+        self.assertTrue(out.endswith(b'files\ttest;1;noarch;data\t/usr/bin/test;/usr/share/test\n'
+                                     b'finished\n'
+                                     b'files\ttest;1;noarch;data\t/usr/bin/test;/usr/share/test\n'
+                                     b'finished\n'))
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--helper']:
+        _helper()
+    else:
+        unittest.main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# PackagekitFilter and the ways sub classes extend it
+#
+# Run from the build directory:
+#   python3 -m unittest discover -s ../tests/python
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+from packagekit.enums import *
+from packagekit.filter import PackagekitFilter
+
+try:
+    from packagekit.table import PackagekitPackageTable, numpy
+except ImportError:
+    numpy = None
+
+class PackageFilter(PackagekitFilter):
+    ''' packages are (name, version, installed, gui) tuples '''
+
+    def _pkg_get_name(self, pkg):
+        return pkg[0]
+
+    def _pkg_compare(self, pkg1, pkg2):
+        if pkg1[1] == pkg2[1]:
+            return 0
+        return 1 if pkg1[1] > pkg2[1] else -1
+
+    def _pkg_is_installed(self, pkg):
+        return pkg[2]
+
+    def _pkg_is_gui(self, pkg):
+        return pkg[3]
+
+class OwnFilter(PackageFilter):
+    ''' hides the packages whose name starts with "x" '''
+
+    def _filter_base(self, pkg):
+        return not pkg[0].startswith('x') and PackagekitFilter._filter_base(self, pkg)
+
+    def _filter_installed(self, pkg):
+        # installed packages at version 1 don't count as installed
+        return pkg[1] != 1 and PackagekitFilter._filter_installed(self, pkg)
+
+INSTALLED = [('app', 2, True, True), ('xapp', 1, True, True), ('lib', 1, True, False)]
+AVAILABLE = [('app', 3, False, True), ('xtool', 1, False, True), ('tool', 1, False, False)]
+
+class FilterOverrideTest(unittest.TestCase):
+
+    def _filter(self, cls, fltlist):
+        fltr = cls(fltlist)
+        fltr.add_installed(INSTALLED)
+        fltr.add_available(AVAILABLE)
+        return [pkg for pkg, info in fltr.get_package_list()]
+
+    def test_filter_base(self):
+        self.assertEqual(self._filter(OwnFilter, [FILTER_GUI]),
+                         [('app', 2, True, True), ('app', 3, False, True)])
+
+    def test_filter_installed(self):
+        self.assertEqual(self._filter(OwnFilter, [FILTER_INSTALLED]),
+                         [('app', 2, True, True)])
+
+    def test_bulk_hook_not_bypassing(self):
+        # a bulk hook mustn't take the filter away from _filter_base()
+        class BulkOwnFilter(OwnFilter):
+            def _pkgs_is_gui(self, pkgs):
+                return [pkg[3] for pkg in pkgs]
+        self.assertEqual(self._filter(BulkOwnFilter, [FILTER_GUI]),
+                         [('app', 2, True, True), ('app', 3, False, True)])
+
+    def test_stream(self):
+        # without versions to compare the filters are applied as packages come
+        class StreamFilter(PackagekitFilter):
+            _pkg_is_gui = PackageFilter._pkg_is_gui
+            _filter_base = OwnFilter._filter_base
+        fltr = StreamFilter([FILTER_NOT_GUI])
+        self.assertTrue(fltr.can_stream())
+        self.assertEqual([pkg for pkg, info in fltr.stream_available(AVAILABLE)],
+                         [('tool', 1, False, False)])
+
+    def test_stream_fallback_not_iterated(self):
+        # packages that can't be streamed are in the list, iterated or not
+        fltr = PackageFilter([FILTER_GUI])
+        self.assertFalse(fltr.can_stream())
+        fltr.stream_installed(INSTALLED)
+        self.assertEqual(list(fltr.stream_available(AVAILABLE)), [])
+        self.assertEqual([pkg for pkg, info in fltr.get_package_list()],
+                         [('app', 2, True, True), ('xapp', 1, True, True),
+                          ('app', 3, False, True), ('xtool', 1, False, True)])
+
+    @unittest.skipIf(numpy is None, 'needs NumPy')
+    def test_table(self):
+        table = PackagekitPackageTable()
+        table.add(INSTALLED, INFO_INSTALLED, [pkg[0] for pkg in INSTALLED])
+        table.add(AVAILABLE, INFO_AVAILABLE, [pkg[0] for pkg in AVAILABLE])
+        fltr = OwnFilter([FILTER_GUI])
+        fltr.add_table(table)
+        self.assertEqual([pkg for pkg, info in fltr.get_package_list()],
+                         [('app', 2, True, True), ('app', 3, False, True)])
+
+    @unittest.skipIf(numpy is None, 'needs NumPy')
+    def test_table_newest_like_list(self):
+        # without version keys newest is the backend's, with a table too
+        pkgs = INSTALLED + AVAILABLE
+        table = PackagekitPackageTable()
+        table.add(INSTALLED, INFO_INSTALLED, [pkg[0] for pkg in INSTALLED],
+                  versions=[pkg[1] for pkg in INSTALLED])
+        table.add(AVAILABLE, INFO_AVAILABLE, [pkg[0] for pkg in AVAILABLE],
+                  versions=[pkg[1] for pkg in AVAILABLE])
+        fltr = PackageFilter([FILTER_NEWEST])
+        fltr.add_table(table)
+        self.assertEqual([pkg for pkg, info in fltr.get_package_list()],
+                         self._filter(PackageFilter, [FILTER_NEWEST]))
+        self.assertEqual(len(self._filter(PackageFilter, [FILTER_NEWEST])), len(pkgs))
+
+class SlotFilter(PackagekitFilter):
+    ''' packages are (name, slot, version, installed) tuples '''
+
+    def _pkg_get_name(self, pkg):
+        return pkg[0]
+
+    def _pkg_compare(self, pkg1, pkg2):
+        if pkg1[1] != pkg2[1]:
+            return -2
+        if pkg1[2] == pkg2[2]:
+            return 0
+        return 1 if pkg1[2] > pkg2[2] else -1
+
+    def _pkg_is_installed(self, pkg):
+        return pkg[3]
+
+class KeyedSlotFilter(SlotFilter):
+    ''' keys are only compared within a slot, as that's part of the name '''
+
+    def _pkg_get_name(self, pkg):
+        return '%s:%s' % (pkg[0], pkg[1])
+
+    def _pkg_version_key(self, pkg):
+        return pkg[2]
+
+SLOT_INSTALLED = [('python', 3, (3, 12, 1), True)]
+SLOT_AVAILABLE = [('python', 3, (3, 12, 0), False), ('python', 3, (3, 12, 2), False),
+                  ('python', 2, (2, 7, 17), False), ('python', 2, (2, 7, 18), False)]
+
+class SlotTest(unittest.TestCase):
+
+    def _filter(self, cls, fltlist):
+        fltr = cls(fltlist)
+        fltr.add_installed(SLOT_INSTALLED)
+        fltr.add_available(SLOT_AVAILABLE)
+        return [pkg for pkg, info in fltr.get_package_list()]
+
+    def test_other_slot_not_hidden(self):
+        # the installed 3.12.1 hides 3.12.0, not the versions of slot 2
+        expected = [('python', 3, (3, 12, 1), True), ('python', 3, (3, 12, 2), False),
+                    ('python', 2, (2, 7, 17), False), ('python', 2, (2, 7, 18), False)]
+        self.assertEqual(self._filter(SlotFilter, [FILTER_NONE]), expected)
+        self.assertEqual(self._filter(KeyedSlotFilter, [FILTER_NONE]), expected)
+
+    def test_newest_per_slot(self):
+        self.assertEqual(self._filter(KeyedSlotFilter, [FILTER_NEWEST]),
+                         [('python', 3, (3, 12, 2), False), ('python', 2, (2, 7, 18), False)])
+
+    @unittest.skipIf(numpy is None, 'needs NumPy')
+    def test_table_per_slot(self):
+        names = ['%s:%s' % (pkg[0], pkg[1]) for pkg in SLOT_INSTALLED + SLOT_AVAILABLE]
+        versions = [pkg[2][2] for pkg in SLOT_INSTALLED + SLOT_AVAILABLE]
+        table = PackagekitPackageTable()
+        table.add(SLOT_INSTALLED, INFO_INSTALLED, names[:1], versions=versions[:1])
+        table.add(SLOT_AVAILABLE, INFO_AVAILABLE, names[1:], versions=versions[1:])
+        fltr = KeyedSlotFilter([FILTER_NEWEST])
+        fltr.add_table(table)
+        self.assertEqual([pkg for pkg, info in fltr.get_package_list()],
+                         [('python', 3, (3, 12, 2), False), ('python', 2, (2, 7, 18), False)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Memory profiling of commands, alone and running concurrently
+#
+# Run from the build directory:
+#   python3 -m unittest discover -s ../tests/python
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+from packagekit.memprofile import PackagekitMemoryProfiler
+
+class MemoryProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'memprofile')
+        self.profiler = PackagekitMemoryProfiler(self.path, top=0)
+
+    def tearDown(self):
+        self.profiler.tracemalloc.stop()
+        shutil.rmtree(self.dir)
+
+    def _lines(self):
+        with open(self.path) as f:
+            return [line.split(' ', 2)[2] for line in f.read().splitlines()]
+
+    def test_alone(self):
+        with self.profiler.profile('get-packages'):
+            data = [b'x' * 1024 for i in range(100)]
+        lines = self._lines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith('get-packages: peak '))
+        self.assertNotIn('concurrent', lines[0])
+
+    def test_concurrent_not_serialised(self):
+        # a query starting while another is measured mustn't wait for it
+        entered = threading.Event()
+        done = threading.Event()
+
+        def other():
+            with self.profiler.profile('search-name'):
+                entered.set()
+                done.wait(10)
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        try:
+            self.assertTrue(entered.wait(10))
+            with self.profiler.profile('resolve'):
+                pass
+        finally:
+            done.set()
+            thread.join()
+        self.assertEqual(self._lines()[0], 'resolve: not measured, ran alongside another command')
+        self.assertTrue(self._lines()[1].startswith('search-name: peak '))
+        self.assertTrue(self._lines()[1].endswith(', including concurrent commands'))
+
+if __name__ == '__main__':
+    unittest.main()
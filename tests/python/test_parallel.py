@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Lookups spread over threads by parallel_map(). This file is also the
+# backend under test, run as a helper when given arguments.
+#
+# Run from the build directory:
+#   python3 -m unittest discover -s ../tests/python
+
+import os
+import sys
+import unittest
+import subprocess
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+def _helper():
+    import time
+    from packagekit.backend import PackageKitBaseBackend, PkError, INFO_AVAILABLE, \
+        ERROR_PACKAGE_NOT_FOUND
+
+    def lookup(item):
+        # "<name>:<seconds>", names starting with "bad" aren't found
+        name, delay = item.split(':')
+        time.sleep(float(delay))
+        if name.startswith('bad'):
+            raise PkError(ERROR_PACKAGE_NOT_FOUND, name)
+        return name
+
+    class PackageKitTestBackend(PackageKitBaseBackend):
+
+        def _lookup(self, items, ordered):
+            for item, name in self.parallel_map(lookup, items.split(','), ordered=ordered):
+                self.package('%s;1;noarch;data' % name, INFO_AVAILABLE, item)
+
+        def search_name(self, filters, values):
+            self._lookup(values[0], True)
+
+        def search_details(self, filters, values):
+            self._lookup(values[0], False)
+
+    PackageKitTestBackend('').dispatcher(sys.argv[2:])
+
+class ParallelMapTest(unittest.TestCase):
+
+    def _run(self, command, items):
+        env = dict(os.environ, LANG='C', UID='0', NETWORK='FALSE', BACKGROUND='FALSE',
+                   INTERACTIVE='FALSE')
+        helper = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--helper',
+                                   command, 'none', items],
+                                  env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                  universal_newlines=True)
+        out, err = helper.communicate(timeout=30)
+        return helper.returncode, out.splitlines()
+
+    def _names(self, lines):
+        return [line.split('\t')[2].split(';')[0] for line in lines if line.startswith('package\t')]
+
+    def test_ordered(self):
+        # the first items take longest, and still come first
+        rc, lines = self._run('search-name', 'a:0.3,b:0.2,c:0,d:0.1,e:0,f:0')
+        self.assertEqual(rc, 0)
+        self.assertEqual(self._names(lines), ['a', 'b', 'c', 'd', 'e', 'f'])
+        self.assertEqual(lines[-1], 'finished')
+
+    def test_unordered(self):
+        rc, lines = self._run('search-details', 'a:0.3,b:0')
+        self.assertEqual(rc, 0)
+        self.assertEqual(self._names(lines), ['b', 'a'])
+
+    def test_first_error(self):
+        # bad2 fails first, but bad1 comes first in the items
+        rc, lines = self._run('search-name', 'a:0,bad1:0.2,bad2:0,c:0')
+        self.assertEqual(rc, 254)
+        self.assertEqual(lines, ['package\tavailable\ta;1;noarch;data\ta:0',
+                                 'error\tpackage-not-found\tbad1'])
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--helper']:
+        _helper()
+    else:
+        unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Progress signals coalesced by the base backend. This file is also the
+# backend under test, run as a helper when given arguments.
+#
+# Run from the build directory:
+#   python3 -m unittest discover -s ../tests/python
+
+import os
+import sys
+import unittest
+import subprocess
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+def _helper():
+    import time
+    from packagekit.backend import PackageKitBaseBackend, INFO_AVAILABLE
+
+    class PackageKitTestBackend(PackageKitBaseBackend):
+
+        def search_name(self, filters, values):
+            # a comma separated script of percentages
+            for step in values[0].split(','):
+                if step == 'sleep':
+                    # longer than the 1/10 s between updates
+                    time.sleep(0.15)
+                elif step == 'package':
+                    self.package('test;1;noarch;data', INFO_AVAILABLE, 'test')
+                else:
+                    self.percentage(int(step))
+
+    PackageKitTestBackend('').dispatcher(sys.argv[2:])
+
+class ProgressTest(unittest.TestCase):
+
+    def _run(self, script):
+        env = dict(os.environ, LANG='C', UID='0', NETWORK='FALSE', BACKGROUND='FALSE',
+                   INTERACTIVE='FALSE')
+        helper = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--helper',
+                                   'search-name', 'none', script],
+                                  env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                  universal_newlines=True)
+        out, err = helper.communicate(timeout=30)
+        self.assertEqual(helper.returncode, 0)
+        lines = out.splitlines()
+        self.assertEqual(lines[-1], 'finished')
+        return lines
+
+    def _percentages(self, lines):
+        return [int(line.split('\t')[1]) for line in lines if line.startswith('percentage\t')]
+
+    def test_never_backwards(self):
+        lines = self._run('10,5,20,30,25,40')
+        self.assertEqual(self._percentages(lines), [10, 40])
+
+    def test_held_before_finished(self):
+        # the daemon ends up at the last value even without a 100
+        lines = self._run(','.join(str(percent) for percent in range(100)))
+        self.assertEqual(self._percentages(lines), [0, 99])
+        self.assertEqual(lines[-2:], ['percentage\t99', 'finished'])
+
+    def test_held_before_next_signal(self):
+        lines = self._run('10,20,package,30')
+        self.assertEqual(lines, ['percentage\t10', 'percentage\t20',
+                                 'package\tavailable\ttest;1;noarch;data\ttest',
+                                 'percentage\t30', 'finished'])
+
+    def test_rate(self):
+        lines = self._run('10,20,sleep,30,40,100')
+        self.assertEqual(self._percentages(lines), [10, 30, 100])
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--helper']:
+        _helper()
+    else:
+        unittest.main()
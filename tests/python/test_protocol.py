@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Encoding and decoding of the text and framed helper protocols
+#
+# Run from the build directory:
+#   python3 -m unittest discover -s ../tests/python
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+from packagekit.protocol import encode_text, encode_framed, decode_text, decode_framed
+
+SIGNALS = [
+    (b"finished\n", (), None),
+    (b"percentage\t%i\n", (42,), None),
+    (b"package\t%s\t%s\t%s\n", (b'available', b'test;1.0;noarch;data', b'a test'), b'7'),
+    # what the text protocol can't carry unescaped
+    (b"files\t%s\t%s\n", (b'test;1.0;noarch;data', b'/usr/bin/a\tb\n/usr/bin/c'), b'8'),
+    (b"details\t%s\t%s\n", (b'', b'\xc3\xa9t\xc3\xa9'), None),
+]
+
+def _fields(template, fields, tag):
+    record = [template.split(b'\t', 1)[0].rstrip(b'\n')]
+    record += [field if isinstance(field, bytes) else b'%i' % field for field in fields]
+    if tag is not None:
+        record.insert(0, tag)
+    return record
+
+class ProtocolTest(unittest.TestCase):
+
+    def test_framed_round_trip(self):
+        data = b''.join(encode_framed(*signal) for signal in SIGNALS)
+        records, remainder = decode_framed(data)
+        self.assertEqual(records, [_fields(*signal) for signal in SIGNALS])
+        self.assertEqual(remainder, b'')
+
+    def test_framed_partial(self):
+        # a record split across reads is left for the next one
+        data = b''.join(encode_framed(*signal) for signal in SIGNALS)
+        last = len(encode_framed(*SIGNALS[-1]))
+        for cut in (1, 4, 9, last - 1):
+            records, remainder = decode_framed(data[:-cut])
+            self.assertEqual(records, [_fields(*signal) for signal in SIGNALS[:-1]])
+            records, rest = decode_framed(remainder + data[-cut:])
+            self.assertEqual(records, [_fields(*SIGNALS[-1])])
+            self.assertEqual(rest, b'')
+
+    def test_text_round_trip(self):
+        signals = SIGNALS[:3]
+        data = b''.join(encode_text(*signal) for signal in signals)
+        records, remainder = decode_text(data + b'finis')
+        self.assertEqual(records, [_fields(*signal) for signal in signals])
+        self.assertEqual(remainder, b'finis')
+
+if __name__ == '__main__':
+    unittest.main()
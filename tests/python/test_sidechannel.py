@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Large writes moved to files by the side channel. This file is also the
+# backend under test, run as a helper when given arguments.
+#
+# Run from the build directory:
+#   python3 -m unittest discover -s ../tests/python
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+def _helper():
+    from packagekit.backend import PackageKitBaseBackend, ERROR_PACKAGE_NOT_FOUND
+
+    class PackageKitTestBackend(PackageKitBaseBackend):
+
+        def get_files(self, package_ids):
+            # enough to go to the side channel
+            self.files(package_ids[0], ['/usr/share/test/%06i' % i for i in range(20000)])
+            if package_ids[0].startswith('broken'):
+                self.error(ERROR_PACKAGE_NOT_FOUND, 'broken', exit=False)
+
+        def get_details(self, package_ids):
+            pass
+
+    PackageKitTestBackend('').dispatcher(sys.argv[2:])
+
+class SideChannelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _spawn(self, enabled=True):
+        env = dict(os.environ, LANG='C', UID='0', NETWORK='FALSE', BACKGROUND='FALSE',
+                   INTERACTIVE='FALSE')
+        if enabled:
+            env['PK_BACKEND_SIDE_CHANNEL'] = '1'
+        helper = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--helper'],
+                                  env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                  universal_newlines=True)
+        self.addCleanup(helper.stdout.close)
+        return helper
+
+    def _send(self, helper, *command):
+        helper.stdin.write('\t'.join(command) + '\n')
+        helper.stdin.flush()
+
+    def test_not_enabled(self):
+        helper = self._spawn(enabled=False)
+        self._send(helper, 'side-channel', self.dir)
+        self.assertTrue(helper.stdout.readline().startswith('error\tnot-supported\t'))
+        self.assertEqual(helper.stdout.readline(), 'finished\n')
+        helper.stdin.close()
+        self.assertEqual(helper.wait(), 0)
+
+    def test_files_left_to_daemon(self):
+        helper = self._spawn()
+        self._send(helper, 'side-channel', self.dir)
+        self.assertEqual(helper.stdout.readline(), 'side-channel\t%s\n' % self.dir)
+
+        self._send(helper, 'get-files', 'test;1;noarch;data')
+        name, path, size = helper.stdout.readline().rstrip('\n').split('\t')
+        self.assertEqual(name, 'side-channel')
+        with open(path) as f:
+            data = f.read()
+        self.assertEqual(len(data), int(size))
+        self.assertTrue(data.startswith('files\ttest;1;noarch;data\t/usr/share/test/000000;'))
+        self.assertTrue(data.endswith(';/usr/share/test/019999\n'))
+        self.assertEqual(helper.stdout.readline(), 'finished\n')
+
+        # announced, so not removed under the daemon even if the command failed
+        self._send(helper, 'get-files', 'broken;1;noarch;data')
+        name, failed_path, size = helper.stdout.readline().rstrip('\n').split('\t')
+        self.assertEqual(name, 'side-channel')
+        self.assertEqual(helper.stdout.readline(), 'error\tpackage-not-found\tbroken\n')
+        self.assertEqual(helper.stdout.readline(), 'finished\n')
+
+        # nor when the helper exits before the daemon read them
+        helper.stdin.close()
+        self.assertEqual(helper.wait(), 0)
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         sorted([os.path.basename(path), os.path.basename(failed_path)]))
+
+    def test_unsent_discarded(self):
+        # a file whose signal couldn't be written is nobody else's to remove
+        from packagekit.sidechannel import PackagekitSideChannel
+        from packagekit.writer import PackagekitSignalWriter
+        from packagekit.protocol import encode_text
+
+        class BrokenPipe(object):
+            def write(self, data):
+                raise IOError('broken pipe')
+            def flush(self):
+                pass
+
+        writer = PackagekitSignalWriter(BrokenPipe())
+        writer.side_channel = PackagekitSideChannel(self.dir, encode_text, threshold=16)
+        writer.write(b'files\ttest;1;noarch;data\t/usr/bin/test\n')
+        self.assertRaises(IOError, writer.flush)
+        self.assertEqual(os.listdir(self.dir), [])
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--helper']:
+        _helper()
+    else:
+        unittest.main()
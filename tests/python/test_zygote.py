@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Transactions run through a zygote started with --zygote. This file is
+# also the backend under test, run as a helper when given arguments.
+#
+# Run from the build directory:
+#   python3 -m unittest discover -s ../tests/python
+
+import os
+import sys
+import time
+import shutil
+import signal
+import tempfile
+import unittest
+import subprocess
+
+sys.path.insert(0,os.path.join(os.getcwd(), 'lib', 'python'))
+
+def _helper():
+    import packagekit.zygote as zygote
+    zygote.ZYGOTE_DIR = os.environ['PK_TEST_ZYGOTE_DIR']
+    if sys.argv[1:2] != ['--zygote']:
+        zygote.forward_to_zygote('test')
+
+    from packagekit.backend import PackageKitBaseBackend, INFO_AVAILABLE
+
+    from packagekit.cache import files_fingerprint
+
+    config = os.path.join(zygote.ZYGOTE_DIR, 'config')
+
+    class PackageKitTestBackend(PackageKitBaseBackend):
+
+        def __init__(self, args):
+            PackageKitBaseBackend.__init__(self, args)
+            with open(os.path.join(config, 'settings')) as f:
+                self.built = f.read()
+
+        def get_cache_fingerprint(self):
+            return files_fingerprint([config])
+
+        def search_name(self, filters, values):
+            # the parent tells a forked child from an unforked helper
+            self.package('test;%i;noarch;data' % os.getppid(), INFO_AVAILABLE, self.built)
+            self.writer.flush()
+            time.sleep(float(values[0]))
+
+    if sys.argv[1:2] == ['--zygote']:
+        zygote.run_zygote(PackageKitTestBackend(''), 'test')
+    PackageKitTestBackend('').dispatcher(sys.argv[1:])
+
+class ZygoteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.env = dict(os.environ, PK_TEST_ZYGOTE_DIR=self.dir, LANG='C', UID='0',
+                        NETWORK='FALSE', BACKGROUND='FALSE', INTERACTIVE='FALSE')
+        os.mkdir(os.path.join(self.dir, 'config'))
+        self._set_config('1')
+        self.zygote = self._spawn('--zygote')
+        self._wait_listening()
+
+    def tearDown(self):
+        self.zygote.kill()
+        self.zygote.communicate()
+        shutil.rmtree(self.dir)
+
+    def _set_config(self, value):
+        # edited in place, leaving the mtime of the directory alone
+        with open(os.path.join(self.dir, 'config', 'settings'), 'w') as f:
+            f.write(value)
+
+    def _wait_listening(self):
+        socket_path = os.path.join(self.dir, 'zygote-test.socket')
+        for i in range(100):
+            if os.path.exists(socket_path):
+                return
+            time.sleep(0.05)
+        self.fail('the zygote never listened')
+
+    def _search(self):
+        helper = self._spawn('search-name', 'none', '0')
+        out, err = helper.communicate(timeout=10)
+        self.assertEqual(helper.returncode, 0)
+        self.assertTrue(out.endswith('finished\n'))
+        return out
+
+    def _spawn(self, *args):
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)] + list(args),
+                                env=self.env, stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+
+    def test_forked(self):
+        out = self._search()
+        self.assertIn('package\tavailable\ttest;%i;noarch;data\t1\n' % self.zygote.pid, out)
+
+    def test_restart(self):
+        # a changed config sends the helper back to run unforked, and the
+        # zygote restarts with a fresh backend
+        self._set_config('22')
+        out = self._search()
+        self.assertIn('package\tavailable\ttest;%i;noarch;data\t22\n' % os.getpid(), out)
+        self._wait_listening()
+        out = self._search()
+        self.assertIn('package\tavailable\ttest;%i;noarch;data\t22\n' % self.zygote.pid, out)
+
+    def test_stats_signal(self):
+        # SIGUSR2 asks the child for its stats and must not kill it
+        helper = self._spawn('search-name', 'none', '1')
+        self.assertTrue(helper.stdout.readline().startswith('package\t'))
+        helper.send_signal(signal.SIGUSR2)
+        out, err = helper.communicate(timeout=10)
+        self.assertEqual(helper.returncode, 0)
+        self.assertIn('stats\thelper\tuptime\t', err)
+        self.assertTrue(out.endswith('finished\n'))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and not sys.argv[1].startswith('-v'):
+        _helper()
+    else:
+        unittest.main()